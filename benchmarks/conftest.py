@@ -0,0 +1,89 @@
+"""Fixtures for the ice/deice benchmarks.
+
+Timings are measured by pytest-benchmark, the data size, throughput and peak Python memory
+(from tracemalloc, in a separate untimed run) are added to the benchmark `extra_info`.
+Data is generated from a fixed seed so runs are reproducible.
+"""
+
+import functools
+import tracemalloc
+import zipfile
+
+import numpy as np
+import pytest
+
+from dataicer import DirectoryHandler, SQLiteHandler, ZipHandler
+
+ARCHIVES = {
+    "directory": DirectoryHandler,
+    "zip": ZipHandler,
+    "zip_deflated": functools.partial(ZipHandler, compression=zipfile.ZIP_DEFLATED),
+    "sqlite": SQLiteHandler,
+}
+ROUNDS = 3
+SEED = 20240101
+
+
+def peak_memory(func) -> float:
+    """The peak memory (MB) allocated while calling func."""
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1e6
+
+
+def record(benchmark, nbytes: int, peak: float):
+    benchmark.extra_info["MB"] = nbytes / 1e6
+    benchmark.extra_info["peak_MB"] = peak
+    if benchmark.stats is not None:
+        benchmark.extra_info["MB/s"] = nbytes / 1e6 / benchmark.stats.stats.mean
+
+
+@pytest.fixture
+def rng() -> np.random.Generator:
+    """A random generator seeded the same way for every benchmark."""
+    return np.random.default_rng(SEED)
+
+
+@pytest.fixture(params=list(ARCHIVES))
+def new_archive(request, tmp_path):
+    """Create an empty archive of each type, mode "w" replaces the previous archive."""
+
+    def factory(handlers):
+        return ARCHIVES[request.param](tmp_path / "archive", handlers, mode="w")
+
+    return factory
+
+
+@pytest.fixture
+def bench_ice(benchmark, new_archive):
+    """Benchmark icing keyword data to a new archive."""
+
+    def run(handlers, data: dict, nbytes: int):
+        benchmark.pedantic(
+            lambda archive: archive.ice(**data),
+            setup=lambda: ((new_archive(handlers),), {}),
+            rounds=ROUNDS,
+        )
+        record(
+            benchmark, nbytes, peak_memory(lambda: new_archive(handlers).ice(**data))
+        )
+
+    return run
+
+
+@pytest.fixture
+def bench_deice(benchmark, new_archive):
+    """Benchmark deicing all the keys of an archive, returns the deiced data."""
+
+    def run(handlers, data: dict, nbytes: int) -> dict:
+        archive = new_archive(handlers)
+        archive.ice(**data)
+        result = benchmark.pedantic(archive.deice, rounds=ROUNDS, warmup_rounds=1)
+        record(benchmark, nbytes, peak_memory(archive.deice))
+        return result
+
+    return run
@@ -0,0 +1,36 @@
+import pytest
+import numpy as np
+
+from dataicer.plugins import get_numpy_handlers
+
+MODES = ["raw", "txt", "npy", "npz", "chunked", "json"]
+SIZES = [10**3, 10**5, 10**6]
+KEYS = [1, 16, 128]
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("mode", MODES)
+def test_ice_numpy(bench_ice, rng, mode, size):
+    arr = rng.random(size)
+    bench_ice(get_numpy_handlers(mode), {"arr": arr}, arr.nbytes)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("mode", MODES)
+def test_deice_numpy(bench_deice, rng, mode, size):
+    arr = rng.random(size)
+    test = bench_deice(get_numpy_handlers(mode), {"arr": arr}, arr.nbytes)
+    np.testing.assert_array_equal(test["arr"], arr)
+
+
+@pytest.mark.parametrize("keys", KEYS)
+def test_ice_numpy_keys(bench_ice, rng, keys):
+    data = {f"arr{i}": rng.random(1000) for i in range(keys)}
+    bench_ice(get_numpy_handlers("npy"), data, keys * 8000)
+
+
+@pytest.mark.parametrize("keys", KEYS)
+def test_deice_numpy_keys(bench_deice, rng, keys):
+    data = {f"arr{i}": rng.random(1000) for i in range(keys)}
+    test = bench_deice(get_numpy_handlers("npy"), data, keys * 8000)
+    assert set(test) == set(data)
@@ -0,0 +1,36 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+from dataicer.plugins import get_pandas_handlers
+
+MODES = ["csv", "h5"]
+ROWS = [10**3, 10**5]
+
+
+def make_df(rng: np.random.Generator, rows: int) -> pd.DataFrame:
+    return pd.DataFrame(
+        dict(
+            floats=rng.random(rows),
+            ints=np.arange(rows),
+            times=pd.date_range("2000-01-01", periods=rows, freq="s"),
+            strs=rng.choice(["abc", "defg", "hi"], rows),
+        )
+    )
+
+
+@pytest.mark.parametrize("rows", ROWS)
+@pytest.mark.parametrize("mode", MODES)
+def test_ice_pandas(bench_ice, rng, mode, rows):
+    df = make_df(rng, rows)
+    nbytes = int(df.memory_usage(deep=True).sum())
+    bench_ice(get_pandas_handlers(mode=mode), {"df": df}, nbytes)
+
+
+@pytest.mark.parametrize("rows", ROWS)
+@pytest.mark.parametrize("mode", MODES)
+def test_deice_pandas(bench_deice, rng, mode, rows):
+    df = make_df(rng, rows)
+    nbytes = int(df.memory_usage(deep=True).sum())
+    test = bench_deice(get_pandas_handlers(mode=mode), {"df": df}, nbytes)
+    assert test["df"].shape == df.shape
@@ -0,0 +1,30 @@
+import pytest
+import numpy as np
+import xarray as xr
+
+from dataicer.plugins import get_xarray_handlers
+
+SIZES = [100, 1000]
+
+
+def make_dataset(rng: np.random.Generator, size: int) -> xr.Dataset:
+    return xr.Dataset(
+        {
+            "a": (["x", "y"], rng.random((size, size))),
+            "b": (["x", "y"], rng.random((size, size))),
+        },
+        coords={"x": np.arange(size), "y": np.arange(size)},
+    )
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_ice_xarray(bench_ice, rng, size):
+    ds = make_dataset(rng, size)
+    bench_ice(get_xarray_handlers("nc"), {"ds": ds}, ds.nbytes)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_deice_xarray(bench_deice, rng, size):
+    ds = make_dataset(rng, size)
+    test = bench_deice(get_xarray_handlers("nc"), {"ds": ds}, ds.nbytes)
+    assert test["ds"].equals(ds)
@@ -4,3 +4,6 @@ from ._core import list_handlers
 from ._base_archive import BaseArchiveHandler
 from ._dir_archive import DirectoryHandler
 from ._zip_archive import ZipHandler
+from ._sqlite_archive import SQLiteHandler
+from ._lazy import LazyDeice, IceProxy
+from ._stats import ArchiveStats
@@ -1,24 +1,224 @@
-from typing import Dict, Union, Sequence
+"""Archive handlers store the JSON of each key and the files written by the handlers.
+
+Handlers are registered with each archive for its sessions. While any session is open
+`jsonpickle.handlers.get` is replaced by a lookup which prefers the handlers of the
+archive active in the current thread or task, and falls back to the global `jsonpickle`
+registry otherwise. The original lookup is put back when the last session closes.
+"""
+
+from typing import Any, Callable, Dict, Iterable, Literal, Union, Sequence
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from contextvars import ContextVar, copy_context
 from pathlib import Path
+import asyncio
+import threading
+import time
 import jsonpickle as jp
 import json
+import zlib
 from ._utils import PathType
 from ._core import _get_json_meta
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+from ._lazy import LazyDeice
+from ._stats import ArchiveStats, CountedFilePath, CountedOpen, _in_file_path
+
+# archives with an open session in the current context (thread or task), handlers
+# are registered per archive and jsonpickle uses those of the last opened archive
+_open_archives: ContextVar = ContextVar("dataicer_open_archives", default=())
+_registry_get = jp.handlers.get
+# the number of open sessions in all threads, see `_get_handler`
+_hook_count = 0
+_hook_lock = threading.Lock()
+
+
+def active_archive():
+    """The archive whose handlers jsonpickle uses in the current context."""
+    archives = _open_archives.get()
+    return archives[-1] if archives else None
+
+
+def _push_archive(archive) -> None:
+    global _hook_count
+    with _hook_lock:
+        _hook_count += 1
+        if _hook_count == 1:
+            jp.handlers.get = _get_handler
+    _open_archives.set(_open_archives.get() + (archive,))
+
+
+def _pop_archive(archive) -> None:
+    global _hook_count
+    archives = _open_archives.get()
+    for i in range(len(archives) - 1, -1, -1):
+        if archives[i] is archive:
+            _open_archives.set(archives[:i] + archives[i + 1 :])
+            with _hook_lock:
+                _hook_count -= 1
+                # leave a lookup installed by someone else in place
+                if _hook_count == 0 and jp.handlers.get is _get_handler:
+                    jp.handlers.get = _registry_get
+            return
+
+
+def _loads(text: str):
+    """Parse a JSON string, with orjson if it is installed.
+
+    orjson rejects NaN, Infinity and integers beyond 64 bits which the json module
+    accepts, so those documents fall back to the json module.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text)
+
+
+def _collect_files(obj) -> list:
+    """All the files referenced by flattened JSON data, including nested objects."""
+    files = []
+
+    def collect(obj):
+        if isinstance(obj, dict):
+            file_uuid = obj.get("file_uuid")
+            if isinstance(file_uuid, str):
+                files.append(file_uuid)
+            for val in obj.values():
+                collect(val)
+        elif isinstance(obj, list):
+            for val in obj:
+                collect(val)
+
+    collect(obj)
+    return files
+
+
+def _get_handler(cls_or_name, default=None):
+    """Look up a jsonpickle handler, preferring the handlers of the active archive."""
+    archive = active_archive()
+    if archive is not None and archive._registry is not None:
+        handler = archive._registry.get(cls_or_name)
+        if handler is not None:
+            return handler
+    return _registry_get(cls_or_name, default)
+
 
 class BaseArchiveHandler:
     """Base class for dealing with dataice handlers"""
 
     _archive_type = "base"
+    # index of the keys and their files, stored as JSON without a .json suffix
+    _index_file = "index"
 
     def __init__(
         self,
         dir_path: PathType,
         handlers: dict = None,
+        environment: Literal["eager", "lazy", "off"] = "eager",
+        restore_options: Dict[str, Any] = None,
+        workers: Union[int, Executor, None] = None,
+        compact_json: bool = False,
+        stats: ArchiveStats = None,
     ):
-        """"""
+        """
+
+        Args:
+            dir_path: The path of the archive.
+            handlers: type and handler pairs, handlers are `jsonpickle` extensions.
+            environment: when to capture the Python environment to the archive meta data.
+                "eager" captures it on every ice, "lazy" only if the archive has no
+                environment yet and "off" never captures it.
+            restore_options: default options for handlers when deicing, e.g.
+                `{"mmap_mode": "r"}`.
+            workers: ice/deice keys concurrently with this many threads or an existing
+                thread pool executor. Keys are processed one at a time if None.
+            compact_json: write key JSON without indentation or sorted keys, smaller and
+                faster to write for archives with many keys.
+            stats: collect timings and sizes of the archive operations, see `ArchiveStats`.
+        """
         self.path = Path(dir_path)
         self._handlers = handlers if handlers is not None else dict()
+        self._environment = environment
+        self._restore_options = restore_options if restore_options else dict()
+        self._local = threading.local()
+        self._workers = workers
+        self._compact_json = compact_json
+        self._session_depth = 0
+        self._session_lock = threading.RLock()
+        self._dirty = False
+        self._files_lock = threading.RLock()
+        self._index = None
+        self._index_changed = False
+        self._index_invalidated = False
+        self._refcounts = None
+        self._claimed = set()
+        self._registry = None
+        self.stats = stats
+
+    @property
+    def stats(self) -> Union[ArchiveStats, None]:
+        """The `ArchiveStats` collecting the timings and sizes of operations, or None."""
+        return self._stats
+
+    @stats.setter
+    def stats(self, stats: Union[ArchiveStats, None]):
+        self._stats = stats
+        # files are only wrapped to be counted while collecting stats
+        if stats is None:
+            self.__dict__.pop("open_file", None)
+            self.__dict__.pop("file_path", None)
+        else:
+            self.open_file = self._counted_open_file
+            self.file_path = self._counted_file_path
+
+    def _counted_open_file(self, file_name: str, mode: str = "r"):
+        opened = type(self).open_file(self, file_name, mode)
+        if _in_file_path.get():
+            return opened
+        return CountedOpen(self._stats, opened, file_name, mode)
+
+    def _counted_file_path(self, file_name: str, mode: str = "r"):
+        file_path = type(self).file_path(self, file_name, mode)
+        return CountedFilePath(self._stats, file_path, file_name, mode)
+
+    def _measure(self, event: str, **fields):
+        """Time a block as an event if stats are collected, see `ArchiveStats.measure`.
+
+        Yields the event fields, or None if stats are not collected.
+        """
+        if self._stats is None:
+            return nullcontext()
+        return self._stats.measure(event, **fields)
+
+    def _measure_key(self, event: str, key: str):
+        """Time an operation on a key if stats are collected, see `_measure`."""
+        if self._stats is None:
+            return nullcontext()
+        return self._stats.measure_key(event, key)
+
+    def _handler_fields(self, data, cls=None) -> dict:
+        """The handler class and mode of flattened data for stats."""
+        if not isinstance(data, dict) or "py/object" not in data:
+            return {"handler": None, "mode": None}
+        if cls is None:
+            cls = jp.unpickler.loadclass(data["py/object"])
+        handler = _get_handler(cls) if cls is not None else None
+        if handler is not None and not isinstance(handler, type):
+            handler = type(handler)
+        return {
+            "handler": None if handler is None else handler.__qualname__,
+            "mode": data.get("mode"),
+        }
+
+    @property
+    def dirty(self) -> bool:
+        """True if keys or files have been changed since the archive was opened."""
+        return self._dirty
 
     def save_json(self, **kwargs):
         """Save objects to file with names from keyword arguments."""
@@ -30,80 +230,651 @@ class BaseArchiveHandler:
 
     def keys(self) -> Sequence[str]:
         """Get all the objects keys that have been iced in the archive"""
+        with self._read_index() as index:
+            return tuple(index)
+
+    def key_info(self, key: str) -> dict:
+        """The index entry of a key.
+
+        Has the JSON file name, the files of the key, the size and crc32 checksum of the
+        JSON and a summary of the iced object type, shape and dtype if known.
+        """
+        with self._read_index() as index:
+            entry = dict(index[key])
+            entry["files"] = self._entry_files(key)
+        return entry
+
+    def _scan_keys(self) -> Dict[str, dict]:
+        """Index entries for the keys found by listing the archive."""
         raise NotImplementedError
 
     def _read_key(self, key) -> str:
         """returns a JSON string from reading a key in an archive"""
         raise NotImplementedError
 
+    def open_file(self, file_name: str, mode: str = "r"):
+        """Context manager for opening an individual file in the archive."""
+        raise NotImplementedError
+
+    def file_path(self, file_name: str, mode: str = "r"):
+        """Context manager giving a local path for a file in the archive.
+
+        For libraries that can only read/write to a path on disk (e.g. HDF5).
+        """
+        raise NotImplementedError
+
+    def native_path(self, file_name: str) -> Union[Path, None]:
+        """The path of a file if it is stored directly on the local filesystem, else None."""
+        return None
+
+    def iter_json(self):
+        """Iterate over the JSON files of the archive."""
+        for key in self.keys():
+            contents = self._read_key(key)
+            yield key, contents
+
     def remove_key(self, key: str) -> None:
         """remove a key and any associated files from an archive"""
         raise NotImplementedError
 
-    def _key_get_uuid(self, key: str) -> Union[str, None]:
-        """Check if a key has a uuid and return it if True else None"""
-        key_json = self._read_key(key)
-        key_dict = json.loads(key_json)
-        if isinstance(key_dict, dict):
-            uuid = key_dict.get("file_uuid")
-        else:
-            uuid = None
-        return uuid
+    def has_file(self, file_name: str) -> bool:
+        """Check if a file is stored in the archive."""
+        raise NotImplementedError
 
-    def ice(self, meta: Union[dict, None] = None, **kwargs):
+    def remove_file(self, file_name: str) -> None:
+        """Remove a single file from the archive."""
+        raise NotImplementedError
+
+    def _key_get_files(self, key: str) -> list:
+        """All the files referenced by a key, including those of nested objects."""
+        return _collect_files(_loads(self._read_key(key)))
+
+    def claim_file(self, file_name: str) -> bool:
+        """Reference a file from the key being iced.
+
+        Returns False if the file is already in the archive, or is being written by
+        another thread, so content addressed files are only written once.
+        """
+        with self._files_lock:
+            file_refs = getattr(self._local, "file_refs", None)
+            if file_refs is not None:
+                file_refs.append(file_name)
+            if file_name in self._claimed or self.has_file(file_name):
+                return False
+            self._claimed.add(file_name)
+            return True
+
+    def _get_index(self) -> Dict[str, dict]:
+        """The index of the archive keys, loaded once per session.
+
+        Archives without an index file, or with an index file which no longer matches
+        the stored keys, are indexed by listing the archive.
+        """
+        with self._files_lock:
+            if self._index is None:
+                index_data = None
+                if self.has_file(self._index_file):
+                    with self.open_file(self._index_file, mode="r") as open_file:
+                        index_data = json.load(open_file)
+                if index_data is not None and self._index_matches(index_data):
+                    self._index = index_data["keys"]
+                else:
+                    self._scan_index()
+            return self._index
+
+    def _scan_index(self) -> None:
+        """Index the archive by listing it, the index file is rewritten on flush."""
+        with self._files_lock:
+            self._index = self._scan_keys()
+            self._index_changed = self._mode != "r"
+            self._refcounts = None
+
+    def _index_matches(self, index_data: dict) -> bool:
+        """Check an index file against the stored keys.
+
+        The index is stale if a writer was killed within a session or the archive was
+        changed by a writer which does not update the index.
+        """
+        return set(index_data["keys"]) == self._stored_keys()
+
+    def _stored_keys(self) -> set:
+        """The names of the keys stored in the archive."""
+        return set(self._scan_keys())
+
+    def _invalidate_index(self) -> None:
+        """Remove the index file before the first change to the keys of a session.
+
+        A session which is killed before the index is written again leaves no index
+        behind, so the next session indexes the archive by listing it.
+        """
+        with self._files_lock:
+            if not self._index_invalidated:
+                self._index_invalidated = True
+                if self.has_file(self._index_file):
+                    self.remove_file(self._index_file)
+
+    def _key_missing(self, key: str) -> None:
+        """Index the archive again after the JSON of an indexed key was not found."""
+        with self._files_lock:
+            if self._index is not None and key in self._index:
+                self._scan_index()
+
+    @contextmanager
+    def _read_index(self):
+        """The index for a lookup, it is only kept between lookups within a session."""
+        try:
+            yield self._get_index()
+        finally:
+            if self._session_depth == 0:
+                self._flush_index()
+
+    def _index_key(self, key: str, val: str) -> None:
+        """Update the index entry of a key after its JSON is saved."""
+        encoded = val.encode()
+        with self._files_lock:
+            self._invalidate_index()
+            self._get_index()[key] = {
+                "json": f"{key}.json",
+                "size": len(encoded),
+                "checksum": f"{zlib.crc32(encoded):08x}",
+                "files": None,
+            }
+            self._index_changed = True
+
+    def _unindex_key(self, key: str) -> None:
+        with self._files_lock:
+            self._invalidate_index()
+            del self._get_index()[key]
+            self._index_changed = True
+
+    def _entry_files(self, key: str) -> list:
+        """The files of a key, read from the key JSON if they are not indexed yet."""
+        with self._files_lock:
+            entry = self._get_index()[key]
+            if entry.get("files") is None:
+                entry["files"] = self._key_get_files(key)
+            return entry["files"]
+
+    def _replace_file(self, file_name: str, text: str) -> None:
+        """Replace a text file in the archive in a single step."""
+        with self.open_file(file_name, mode="w") as open_file:
+            open_file.write(text)
+
+    def _flush_index(self) -> None:
+        """Write the index if it has changed and drop the session state."""
+        with self._files_lock:
+            if self._index_changed or self._index_invalidated:
+                for key in self._get_index():
+                    self._entry_files(key)
+                text = json.dumps({"version": 1, "keys": self._index}, sort_keys=True)
+                self._replace_file(self._index_file, text)
+            self._index = None
+            self._index_changed = False
+            self._index_invalidated = False
+            self._refcounts = None
+            self._claimed = set()
+
+    def _get_refcounts(self) -> Dict[str, int]:
+        """The number of keys referencing each file, counted from the index."""
+        with self._files_lock:
+            if self._refcounts is None:
+                refcounts = dict()
+                for key in self._get_index():
+                    for file_name in self._entry_files(key):
+                        refcounts[file_name] = refcounts.get(file_name, 0) + 1
+                self._refcounts = refcounts
+            return self._refcounts
+
+    def _release_key(self, key: str) -> None:
+        """Remove a key from the index and release its files.
+
+        The key JSON is removed by the archive afterwards.
+        """
+        self._get_refcounts()
+        files = self._entry_files(key)
+        self._unindex_key(key)
+        self._release_files(files)
+
+    def _release_files(self, files: Iterable[str]) -> None:
+        """Dereference files and remove those which are no longer referenced."""
+        refcounts = self._get_refcounts()
+        with self._files_lock:
+            for file_name in files:
+                count = refcounts.pop(file_name, 1) - 1
+                if count > 0:
+                    refcounts[file_name] = count
+                    continue
+                self._claimed.discard(file_name)
+                if self.has_file(file_name):
+                    self.remove_file(file_name)
+
+    def _get_environment(self, current_keys) -> Union[bool, list]:
+        """The environment argument for the archive meta data."""
+        if self._environment == "off":
+            return False
+        if self._environment == "lazy" and "meta" in current_keys:
+            previous = _loads(self._read_key("meta"))
+            if isinstance(previous, dict) and previous.get("pip_freeze"):
+                return previous["pip_freeze"]
+        return True
+
+    def _map(self, func: Callable, items: Iterable) -> list:
+        """Map func over items using the archive workers.
+
+        The workers run in a copy of the current context so they use the handlers of the
+        archive sessions open in the calling thread.
+        """
+        if not self._workers:
+            return [func(item) for item in items]
+
+        context = copy_context()
+
+        def call(item):
+            return context.copy().run(func, item)
+
+        if isinstance(self._workers, Executor):
+            return list(self._workers.map(call, items))
+        with ThreadPoolExecutor(self._workers) as executor:
+            return list(executor.map(call, items))
+
+    @staticmethod
+    def _summary(val) -> dict:
+        """A short description of an object for the index."""
+        summary = {"type": f"{type(val).__module__}.{type(val).__qualname__}"}
+        shape = getattr(val, "shape", None)
+        if isinstance(shape, tuple):
+            summary["shape"] = [int(size) for size in shape]
+        dtype = getattr(val, "dtype", None)
+        if dtype is not None and not callable(dtype):
+            summary["dtype"] = str(dtype)
+        return summary
+
+    def _dumps(self, flat) -> str:
+        """Serialise flattened JSON data in the archive format."""
+        if self._compact_json:
+            return json.dumps(flat, separators=(",", ":"))
+        return jp.json.encode(flat)
+
+    def _pickler(self) -> jp.pickler.Pickler:
+        """The pickler of this thread.
+
+        Picklers are kept by the archive so keys are not each paying for a new one.
+        """
+        pickler = getattr(self._local, "pickler", None)
+        if pickler is None:
+            pickler = self._local.pickler = jp.pickler.Pickler()
+        return pickler
+
+    def _flatten(self, val):
+        """Flatten a value with the pickler of this thread."""
+        return self._pickler().flatten(val, reset=True)
+
+    def _encode(self, val) -> str:
+        return self._dumps(self._flatten(val))
+
+    def _restore(self, data, classes=None):
+        """Restore flattened data with the unpickler of this thread, see `_flatten`."""
+        unpickler = getattr(self._local, "unpickler", None)
+        if unpickler is None:
+            unpickler = self._local.unpickler = jp.unpickler.Unpickler(keys=True)
+        return unpickler.restore(data, reset=True, classes=classes)
+
+    def _decode(self, text: str, classes=None):
+        return self._restore(_loads(text), classes)
+
+    @contextmanager
+    def _measure_ice(self, key: str, val):
+        """Encode a value and time icing the key within the context, see `ArchiveStats`."""
+        with self._stats.measure_key("ice", key) as fields:
+            flat = self._flatten(val)
+            fields["encode_seconds"] = time.perf_counter() - fields["start"]
+            fields.update(self._handler_fields(flat, type(val)))
+            yield self._dumps(flat)
+
+    def _ice_key(self, item):
+        """Ice a single key, the file reference counts must be loaded beforehand."""
+        arg, val = item
+        self._local.file_refs = []
+        try:
+            if self._stats is None:
+                freeze = self._encode(val)
+                self.save_json(**{arg: freeze})
+            else:
+                with self._measure_ice(arg, val) as freeze:
+                    self.save_json(**{arg: freeze})
+            with self._files_lock:
+                entry = self._get_index()[arg]
+                entry["files"] = self._local.file_refs
+                entry["summary"] = self._summary(val)
+                self._index_changed = True
+                for file_name in self._local.file_refs:
+                    self._refcounts[file_name] = self._refcounts.get(file_name, 0) + 1
+        finally:
+            self._local.file_refs = None
+
+    def _ice_meta(self, meta: Union[dict, None], keys: Iterable[str]) -> list:
+        """Save the archive meta data before icing keys.
+
+        Returns the files of the replaced keys, these are released after the new values
+        are written so content addressed files shared by the old and new values are kept.
+        """
         meta = dict() if not meta else meta
         meta.update({"handlers": self._handlers})
-        self.save_json(**{"meta": _get_json_meta(meta)})
 
-        current_keys = self.keys()
+        current_keys = self._get_index()
+        with self._measure("meta") as fields:
+            environment = self._get_environment(current_keys)
+            self.save_json(**{"meta": _get_json_meta(meta, environment=environment)})
+            if fields is not None:
+                fields["environment"] = environment is not False
 
+        self._get_refcounts()
+        replaced = []
+        for arg in keys:
+            if arg in current_keys:
+                replaced.extend(self._entry_files(arg))
+        return replaced
+
+    def ice(self, meta: Union[dict, None] = None, **kwargs):
         with self as _:
-            for arg, val in kwargs.items():
-                if arg in current_keys:
-                    self.remove_key(arg)
-                freeze = jp.encode(val)
-                self.save_json(**{arg: freeze})
+            replaced = self._ice_meta(meta, kwargs)
+            self._map(self._ice_key, kwargs.items())
+            self._release_files(replaced)
+
+    @asynccontextmanager
+    async def _async_session(self):
+        """Open a session for a coroutine.
+
+        Yields a function which runs a call in the executor and returns an awaitable.
+        The calls run in a copy of the context of the coroutine, so sessions of several
+        archives on one event loop each use their own handlers.
+        """
+        loop = asyncio.get_running_loop()
+        if isinstance(self._workers, Executor):
+            executor = self._workers
+        elif self._workers:
+            executor = ThreadPoolExecutor(self._workers)
+        else:
+            executor = None
+
+        def run(func, *args):
+            return loop.run_in_executor(executor, copy_context().run, func, *args)
+
+        _push_archive(self)
+        try:
+            await run(self.open)
+            try:
+                yield run
+            finally:
+                await run(self.close)
+        finally:
+            _pop_archive(self)
+            if executor is not None and executor is not self._workers:
+                executor.shutdown(wait=False)
+
+    async def aice(self, meta: Union[dict, None] = None, **kwargs):
+        """Coroutine version of `ice`.
+
+        Encoding and file I/O run in the archive workers, or the event loop's default
+        executor, and the keys are iced concurrently.
+        """
+        async with self._async_session() as run:
+            replaced = await run(self._ice_meta, meta, list(kwargs))
+            await asyncio.gather(*(run(self._ice_key, item) for item in kwargs.items()))
+            await run(self._release_files, replaced)
+
+    def get_restore_option(self, name: str, default=None):
+        """Get a restore option for the key currently being deiced.
+
+        Key options passed to `deice` take precedence over the archive options.
+        """
+        key_options = getattr(self._local, "restore_options", None)
+        if key_options and name in key_options:
+            return key_options[name]
+        return self._restore_options.get(name, default)
 
-    def deice(self, *args, classes=None, **kwargs) -> dict:
+    @contextmanager
+    def _key_restore_options(self, options: Union[dict, None]):
+        """Set the restore options for the key being deiced in this thread."""
+        self._local.restore_options = options
+        try:
+            yield
+        finally:
+            self._local.restore_options = None
+
+    def deice(
+        self,
+        *args,
+        classes=None,
+        restore_options: Dict[str, Dict[str, Any]] = None,
+        **kwargs,
+    ) -> dict:
         """deice your archive
 
         Args:
             args: the keys to load, if None, all will be loaded
             classes: Classes to deice that are not importable from the module store. Passed to jsonpickle.decode
+            restore_options: per key options for the handlers, e.g. `{"arr": {"mmap_mode": "r"}}`,
+                these override the archive `restore_options`.
 
         Returns:
             dict: A decoded dictionary of all the variables in archive.
         """
-        if not args:
-            args = tuple(key for key in self.keys() if key != "meta")
+        restore_options = restore_options if restore_options else dict()
+
+        def deice_key(name):
+            return self._deice_key(name, classes, restore_options.get(name))
 
-        restored = dict()
         with self as _:
-            for name in args:
-                var = self._read_key(name)
-                restored[name] = jp.decode(var, keys=True, classes=classes)
+            if not args:
+                args = tuple(key for key in self.keys() if key != "meta")
+            restored = dict(zip(args, self._map(deice_key, args)))
 
         return restored
 
+    async def adeice(
+        self,
+        *args,
+        classes=None,
+        restore_options: Dict[str, Dict[str, Any]] = None,
+    ) -> dict:
+        """Coroutine version of `deice`.
+
+        The keys are read and decoded concurrently in the archive workers, or the
+        event loop's default executor.
+
+        Args:
+            args: the keys to load, if None, all will be loaded
+            classes: Classes to deice that are not importable from the module store. Passed to jsonpickle.decode
+            restore_options: per key options for the handlers, see `deice`.
+
+        Returns:
+            dict: A decoded dictionary of all the variables in archive.
+        """
+        restore_options = restore_options if restore_options else dict()
+
+        async with self._async_session() as run:
+            if not args:
+                keys = await run(self.keys)
+                args = tuple(key for key in keys if key != "meta")
+            values = await asyncio.gather(
+                *(
+                    run(self._deice_key, name, classes, restore_options.get(name))
+                    for name in args
+                )
+            )
+        return dict(zip(args, values))
+
+    def _deice_key(self, name: str, classes=None, key_options: dict = None):
+        """Decode a single key, must be called within an open session."""
+        if self._stats is not None:
+            return self._deice_key_measured(name, classes, key_options)
+        var = self._read_key(name)
+        with self._key_restore_options(key_options):
+            return self._decode(var, classes)
+
+    def _deice_key_measured(self, name: str, classes=None, key_options: dict = None):
+        """Decode a single key and record a deice event, see `ArchiveStats`."""
+        with self._stats.measure_key("deice", name) as fields:
+            data = _loads(self._read_key(name))
+            fields.update(self._handler_fields(data))
+            start = time.perf_counter()
+            with self._key_restore_options(key_options):
+                val = self._restore(data, classes)
+            fields["decode_seconds"] = time.perf_counter() - start
+        return val
+
+    def read_slice(self, key: str, index, classes=None):
+        """Read part of a stored array without restoring all of it.
+
+        Handlers with a `restore_slice` method only read the requested part of the file,
+        e.g. npy arrays and nc xarray objects. Other objects are deiced and then indexed.
+
+        Args:
+            key: a key holding a single array like object.
+            index: the index to apply, e.g. `np.s_[1000:2000, :]`, or a dict of dimension
+                names and indexes for xarray objects.
+            classes: passed to jsonpickle.decode if the key is deiced.
+        """
+        with self as _, self._measure_key("read_slice", key) as fields:
+            data = _loads(self._read_key(key))
+            if fields is not None:
+                fields.update(self._handler_fields(data))
+            handler = self._key_handler(data, "restore_slice")
+            if handler is not None:
+                return handler.restore_slice(data, index)
+
+            obj = self._deice_key(key, classes)
+            if isinstance(index, dict):
+                return obj.isel(index)
+            return obj[index]
+
+    def _key_handler(self, data, method: str):
+        """The handler of a key's JSON data if it has `method`."""
+        if not isinstance(data, dict) or "py/object" not in data:
+            return None
+        for cls, handler in self._handlers.items():
+            if jp.util.importable_name(cls) == data["py/object"]:
+                return handler if hasattr(handler, method) else None
+        return None
+
+    def append(self, key: str, obj, **kwargs) -> None:
+        """Append to a stored object in place.
+
+        Only the new data is written for DataFrames stored as h5 or csv, arrays stored
+        as npy, txt or chunked and xarray objects stored with an unlimited dimension.
+        Files in a `ZipHandler` are rewritten as zip members cannot be extended.
+
+        Args:
+            key: the key of the stored object.
+            obj: the rows to append, e.g. a DataFrame with the same columns or an array
+                with the same trailing shape.
+            kwargs: options for the handler, e.g. `dim` for xarray objects.
+        """
+        with self as _, self._measure_key("append", key) as fields:
+            data = _loads(self._read_key(key))
+            if fields is not None:
+                fields.update(self._handler_fields(data))
+            handler = self._key_handler(data, "append")
+            if handler is None:
+                raise TypeError(f"Key {key} cannot be appended to")
+            # handlers can replace files, e.g. the index of a DataFrame, the files of
+            # the key are released like those of a replaced key
+            refcounts = self._get_refcounts()
+            replaced = self._entry_files(key)
+            # handlers flatten new objects in the JSON data with the pickler
+            pickler = self._pickler()
+            pickler.reset()
+            data = handler(pickler).append(data, obj, **kwargs)
+
+            with self._files_lock:
+                entry = dict(self._get_index()[key])
+            self.save_json(**{key: self._dumps(data)})
+            files = _collect_files(data)
+            with self._files_lock:
+                summary = entry.get("summary")
+                if summary is not None and "shape" in data:
+                    summary["shape"] = [int(size) for size in data["shape"]]
+                self._get_index()[key].update(files=files, summary=summary)
+                self._index_changed = True
+                for file_name in files:
+                    refcounts[file_name] = refcounts.get(file_name, 0) + 1
+            self._release_files(replaced)
+
+    def deice_lazy(
+        self,
+        *args,
+        classes=None,
+        restore_options: Dict[str, Dict[str, Any]] = None,
+        cache_size: int = 8,
+    ) -> LazyDeice:
+        """deice your archive on demand
+
+        Keys are only read and decoded when the value is first used, the decoded
+        values are kept in a least recently used cache.
+
+        Args:
+            args: the keys to load, if None, all will be available
+            classes: Classes to deice that are not importable from the module store. Passed to jsonpickle.decode
+            restore_options: per key options for the handlers, see `deice`.
+            cache_size: the maximum number of decoded keys to keep.
+
+        Returns:
+            LazyDeice: A mapping of keys to proxies of the variables in the archive.
+        """
+        if not args:
+            args = tuple(key for key in self.keys() if key != "meta")
+        return LazyDeice(
+            self,
+            args,
+            classes=classes,
+            restore_options=restore_options,
+            cache_size=cache_size,
+        )
+
+    def __getitem__(self, item):
+        """"""
+        with self._read_index() as index:
+            if item not in index:
+                raise KeyError(f"{item} is not a valid key")
+
+        return self._read_key(item)
+
     def get_object_list(self):
         """Get the list of objects from the archive."""
         raise NotImplementedError
 
     def open(self):
-        for cls, handler in self._handlers.items():
-            try:
-                handler.set_archive_handler(self)
-            except AttributeError:
-                pass
-            jp.register(cls, handler, base=True)
+        """Open a session, the archive handlers are used by `jsonpickle` in this thread
+        or task until it is closed.
+
+        Handlers are registered with the archive and not globally, so many archives
+        can have sessions open at once from different threads or nested contexts.
+        """
+        with self._session_lock:
+            self._session_depth += 1
+            if self._session_depth == 1:
+                registry = jp.handlers.Registry()
+                for cls, handler in self._handlers.items():
+                    try:
+                        handler.set_archive_handler(self)
+                    except AttributeError:
+                        pass
+                    registry.register(cls, handler, base=True)
+                self._registry = registry
+        _push_archive(self)
 
     def __enter__(self):
         self.open()
         return self
 
     def close(self):
-        for cls, _ in self._handlers.items():
-            jp.unregister(cls)
+        _pop_archive(self)
+        with self._session_lock:
+            self._session_depth -= 1
+            if self._session_depth > 0:
+                return
+        self._flush_index()
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
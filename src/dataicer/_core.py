@@ -8,16 +8,25 @@ import datetime
 from pathlib import Path
 import jsonpickle as jp
 
-from ._pip import get_pip_freeze
+from ._pip import get_environment
 from ._utils import PathType
 
 jp.set_encoder_options("json", sort_keys=True, indent=4)
 
 
-def _get_json_meta(meta=None):
-    """Get the meta data for the archive"""
+def _get_json_meta(meta=None, environment: Union[bool, list] = True):
+    """Get the meta data for the archive
+
+    Args:
+        meta: extra meta data to store
+        environment: capture the environment (True), skip it (False) or a
+            previously captured environment to store.
+    """
     jvars = dict()
-    jvars["pip_freeze"] = get_pip_freeze()
+    if environment is True:
+        jvars["pip_freeze"] = get_environment()
+    elif environment:
+        jvars["pip_freeze"] = environment
     date = datetime.datetime.now()
     jvars["datestr"] = f"{date.year:4d}-{date.month:2d}-{date.day:2d}"
     jvars["timestr"] = f"{date.hour}:{date.minute}:{date.second}"
@@ -26,8 +35,18 @@ def _get_json_meta(meta=None):
     return jp.encode(jvars)
 
 
-def list_handlers() -> dict:
-    """List all the known jsonpickle handlers"""
-    base = jp.handlers.registry._base_handlers
-    extra = jp.handlers.registry._handlers
+def list_handlers(archive=None) -> dict:
+    """List all the known jsonpickle handlers
+
+    Args:
+        archive: list the handlers registered with this archive instead of the global
+            `jsonpickle` registry, archives do not register their handlers globally.
+    """
+    registry = jp.handlers.registry
+    if archive is not None:
+        # the registry of an archive is created by its first session
+        with archive:
+            registry = archive._registry
+    base = registry._base_handlers
+    extra = registry._handlers
     return {"base": base, "extra": extra}
@@ -1,10 +1,16 @@
-from typing import Literal
+from typing import Literal, Union
+from concurrent.futures import Executor
+from contextlib import contextmanager
+import json
 import shutil
 import os
 import pathlib
+import tempfile
+import zlib
 
 from ._errors import DataIceExists
-from ._base_archive import BaseArchiveHandler
+from ._base_archive import BaseArchiveHandler, _loads
+from ._stats import ArchiveStats
 from ._utils import PathType
 
 
@@ -20,15 +26,29 @@ class FileHandler:
 
 
 class DirectoryHandler(BaseArchiveHandler):
-    """A handler for saving/loading files to/from a directory."""
+    """A handler for saving/loading files to/from a directory.
+
+    Each key is stored as a `<key>.json` file by default. Consolidated archives keep the
+    JSON of all keys in a single JSON-lines file instead, which is loaded once per
+    session and replaced atomically when a session changes it. Sidecar files are stored
+    separately for both layouts.
+    """
 
     _archive_type = "directory"
+    # JSON-lines file of [key, JSON] documents for consolidated archives
+    _documents_file = "keys.jsonl"
 
     def __init__(
         self,
         dir_path: PathType,
         handlers: dict = None,
         mode: Literal["r", "w", "a"] = "r",
+        environment: Literal["eager", "lazy", "off"] = "eager",
+        restore_options: dict = None,
+        workers: Union[int, Executor, None] = None,
+        compact_json: bool = False,
+        consolidated: bool = None,
+        stats: ArchiveStats = None,
     ):
         """
 
@@ -36,11 +56,28 @@ class DirectoryHandler(BaseArchiveHandler):
             dir_path: The path of the directory, (always has a .ice suffix)
             handlers: type and handler pairs, handlers are `jsonpickle` extensions.
             mode: how to open the file.
+            environment: when to capture the Python environment, see `BaseArchiveHandler`.
+            restore_options: default handler options when deicing, see `BaseArchiveHandler`.
+            workers: threads to ice/deice keys with, see `BaseArchiveHandler`.
+            compact_json: write key JSON without indentation, see `BaseArchiveHandler`.
+            consolidated: store the JSON of all keys in a single file, for archives with
+                many small keys. If None existing consolidated archives stay consolidated
+                and new archives store a file per key. Key files of an existing archive
+                are moved into the single file when it is opened for appending.
+            stats: collect timings and sizes of the archive operations, see `ArchiveStats`.
         """
         self._mode = mode
         dir_path = pathlib.Path(dir_path).with_suffix(".ice")
 
-        super().__init__(dir_path, handlers=handlers)
+        super().__init__(
+            dir_path,
+            handlers=handlers,
+            environment=environment,
+            restore_options=restore_options,
+            workers=workers,
+            compact_json=compact_json,
+            stats=stats,
+        )
 
         if mode in ["r", "a"] and not self.path.exists():
             raise FileNotFoundError
@@ -51,45 +88,215 @@ class DirectoryHandler(BaseArchiveHandler):
         if not self.path.exists():
             self.path.mkdir()
 
+        if consolidated is None:
+            consolidated = (self.path / self._documents_file).exists()
+        self._consolidated = consolidated
+        self._documents = None
+        self._documents_changed = False
+        self._key_files = []
+
     def open_file(self, file_name, mode="r"):
-        """Context manager for opening an individual file in the archive."""
+        """Context manager for opening an individual file in the archive.
+
+        Files can be grouped in sub directories, e.g. "array/0.0", which are created
+        when the file is written.
+        """
+        if mode[0] in "wax":
+            self._dirty = True
+            if "/" in file_name:
+                (self.path / file_name).parent.mkdir(parents=True, exist_ok=True)
         return FileHandler(self.path, file_name, mode=mode)
 
+    @contextmanager
+    def file_path(self, file_name, mode="r"):
+        """Context manager giving the path of a file in the archive."""
+        if mode[0] in "wax":
+            self._dirty = True
+        yield self.path / file_name
+
+    def native_path(self, file_name):
+        """The path of a file in the archive."""
+        return self.path / file_name
+
+    def _replace_file(self, file_name, text):
+        """Write a text file in the archive via a temporary file so it is replaced atomically."""
+        fd, tmp_path = tempfile.mkstemp(prefix=".dataicer_", dir=self.path)
+        try:
+            with os.fdopen(fd, "w") as open_file:
+                open_file.write(text)
+            os.replace(tmp_path, self.path / file_name)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if file_name == self._index_file:
+            # stamp the index to check it against the directory, see `_index_matches`
+            mtime = self.path.stat().st_mtime_ns
+            os.utime(self.path / file_name, ns=(mtime, mtime))
+        self._dirty = True
+
+    def _scan_keys(self):
+        """Index entries for the JSON files in the directory."""
+        if self._consolidated:
+            with self._read_documents() as documents:
+                return {
+                    key: self._document_entry(val) for key, val in documents.items()
+                }
+        return {
+            json_file.stem: {"json": json_file.name}
+            for json_file in self.path.glob("*.json")
+        }
+
+    def _index_matches(self, index_data):
+        """Check the directory has not changed since the index was written.
+
+        The index file is given the modification time of the directory when it is
+        written, adding, removing or replacing files in the directory changes its
+        modification time. This does not list the directory, changes within the
+        timestamp resolution of the file system after the index is written are missed.
+        """
+        index_stat = (self.path / self._index_file).stat()
+        return self.path.stat().st_mtime_ns == index_stat.st_mtime_ns
+
+    def _document_entry(self, val: str) -> dict:
+        """The index entry of a key in the consolidated file."""
+        encoded = val.encode()
+        return {
+            "json": self._documents_file,
+            "size": len(encoded),
+            "checksum": f"{zlib.crc32(encoded):08x}",
+        }
+
+    def _get_documents(self) -> dict:
+        """The JSON of the keys of a consolidated archive, loaded once per session.
+
+        Key files of an archive which is not consolidated yet are read instead and are
+        replaced by the consolidated file on the next flush.
+        """
+        with self._files_lock:
+            if self._documents is None:
+                documents_path = self.path / self._documents_file
+                if documents_path.exists():
+                    with open(documents_path, "r") as open_file:
+                        self._documents = dict(
+                            _loads(line) for line in open_file if line.strip()
+                        )
+                else:
+                    key_files = list(self.path.glob("*.json"))
+                    self._documents = {
+                        json_file.stem: json_file.read_text() for json_file in key_files
+                    }
+                    if key_files and self._mode != "r":
+                        self._key_files = key_files
+                        self._documents_changed = True
+            return self._documents
+
+    @contextmanager
+    def _read_documents(self):
+        """The consolidated key JSON, it is only kept between reads within a session."""
+        try:
+            yield self._get_documents()
+        finally:
+            if self._session_depth == 0:
+                self._flush_documents()
+
+    def _flush_documents(self) -> None:
+        """Write the consolidated file if it has changed and drop it from memory."""
+        with self._files_lock:
+            if self._documents_changed:
+                text = "".join(
+                    json.dumps([key, val]) + "\n"
+                    for key, val in self._documents.items()
+                )
+                self._replace_file(self._documents_file, text)
+                for json_file in self._key_files:
+                    os.remove(json_file)
+                self._key_files = []
+            self._documents = None
+            self._documents_changed = False
+
+    def _flush_index(self) -> None:
+        # the key JSON is written before the index which refers to it
+        if self._consolidated:
+            self._flush_documents()
+        super()._flush_index()
+
+    def _json_unchanged(self, key: str, val: str) -> bool:
+        """Check if the stored JSON for a key is identical to `val`."""
+        entry = self._get_index().get(key)
+        if entry is None:
+            return False
+        encoded = val.encode()
+        if "size" in entry:
+            if entry["size"] != len(encoded):
+                return False
+            if entry["checksum"] != f"{zlib.crc32(encoded):08x}":
+                return False
+        elif not self._consolidated:
+            if (self.path / f"{key}.json").stat().st_size != len(encoded):
+                return False
+        return self._read_key(key) == val
+
     def save_json(self, **kwargs):
-        """Save JSON strings to file with names from keyword arguments."""
+        """Save JSON strings to file with names from keyword arguments.
+
+        Keys with unchanged JSON are not rewritten.
+        """
         for arg, val in kwargs.items():
-            with open(self.path / f"{arg}.json", "w") as open_file:
-                open_file.write(val)
+            if self._json_unchanged(arg, val):
+                continue
+            # a killed session leaves no stale index behind
+            self._invalidate_index()
+            if self._consolidated:
+                with self._files_lock:
+                    self._get_documents()[arg] = val
+                    self._documents_changed = True
+                    self._index_key(arg, val)
+                    self._get_index()[arg]["json"] = self._documents_file
+            else:
+                with open(self.path / f"{arg}.json", "w") as open_file:
+                    open_file.write(val)
+                self._index_key(arg, val)
+            self._dirty = True
+        if self._session_depth == 0:
+            self._flush_index()
 
     def _read_key(self, key):
-        with open(self.path / f"{key}.json", "r") as jf:
-            return jf.read()
-
-    def iter_json(self):
-        """Iterate over the JSON files of the archive."""
-        for key in self.keys():
-            contents = self._read_key(key)
-            yield key, contents
-
-    def keys(self):
-        """"""
-        return tuple(json_file.stem for json_file in self.path.glob("*.json"))
+        try:
+            if self._consolidated:
+                with self._read_documents() as documents:
+                    return documents[key]
+            with open(self.path / f"{key}.json", "r") as jf:
+                return jf.read()
+        except (KeyError, FileNotFoundError):
+            self._key_missing(key)
+            raise
 
     def remove_key(self, key: str) -> None:
         """Remove a key and associated files from an archive"""
         if self._mode == "r":
             raise ValueError("DirectoryArchive is read only")
 
-        assert key in self.keys()
+        with self as _:
+            assert key in self._get_index()
 
-        uuid = self._key_get_uuid(key)
-        if uuid is not None:
-            os.remove(self.path / uuid)
-        os.remove(self.path / f"{key}.json")
+            self._release_key(key)
+            if self._consolidated:
+                with self._files_lock:
+                    del self._get_documents()[key]
+                    self._documents_changed = True
+            else:
+                os.remove(self.path / f"{key}.json")
+            self._dirty = True
 
-    def __getitem__(self, item):
-        """"""
-        if item not in self.keys():
-            raise KeyError(f"{item} is not a valid key")
+    def has_file(self, file_name):
+        """Check if a file is stored in the archive."""
+        return (self.path / file_name).exists()
 
-        return self._read_key(item)
+    def remove_file(self, file_name):
+        """Remove a single file, or a sub directory of files, from the archive."""
+        path = self.path / file_name
+        if path.is_dir():
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        self._dirty = True
@@ -0,0 +1,136 @@
+from typing import Any, Dict, Iterable
+from collections import OrderedDict
+from collections.abc import Mapping
+import threading
+
+
+class IceProxy:
+    """A stand in for a variable in an archive, deiced when it is first used.
+
+    Attribute access, indexing, iteration and numpy conversion are forwarded to the
+    deiced value. Use `LazyDeice.load` to get the value itself.
+    """
+
+    __slots__ = ("_lazy", "_key")
+
+    def __init__(self, lazy: "LazyDeice", key: str):
+        object.__setattr__(self, "_lazy", lazy)
+        object.__setattr__(self, "_key", key)
+
+    def _value(self):
+        return self._lazy.load(self._key)
+
+    def __getattr__(self, name):
+        return getattr(self._value(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._value(), name, value)
+
+    def __getitem__(self, item):
+        return self._value()[item]
+
+    def __setitem__(self, item, value):
+        self._value()[item] = value
+
+    def __contains__(self, item):
+        return item in self._value()
+
+    def __len__(self):
+        return len(self._value())
+
+    def __iter__(self):
+        return iter(self._value())
+
+    def __call__(self, *args, **kwargs):
+        return self._value()(*args, **kwargs)
+
+    def __eq__(self, other):
+        return self._value() == other
+
+    def __ne__(self, other):
+        return self._value() != other
+
+    def __bool__(self):
+        return bool(self._value())
+
+    def __array__(self, *args, **kwargs):
+        import numpy as np
+
+        return np.asarray(self._value(), *args, **kwargs)
+
+    def __str__(self):
+        return str(self._value())
+
+    def __repr__(self):
+        return f"<IceProxy {self._key!r}>"
+
+
+class LazyDeice(Mapping):
+    """A read only mapping of archive keys which are only deiced when used.
+
+    Items are `IceProxy` objects which deice the key on first use, decoded values are
+    kept in a least recently used cache of `cache_size` keys. Evicted keys are deiced
+    again if they are used.
+    """
+
+    def __init__(
+        self,
+        archive,
+        keys: Iterable[str],
+        classes=None,
+        restore_options: Dict[str, Dict[str, Any]] = None,
+        cache_size: int = 8,
+    ):
+        self._archive = archive
+        self._keys = tuple(keys)
+        self._classes = classes
+        self._restore_options = restore_options if restore_options else dict()
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+
+    def load(self, key: str) -> Any:
+        """Get the deiced value of a key."""
+        if key not in self._keys:
+            raise KeyError(f"{key} is not a valid key")
+
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        with self._archive as archive:
+            value = archive._deice_key(
+                key, self._classes, self._restore_options.get(key)
+            )
+
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return value
+
+    def cached(self) -> tuple:
+        """The keys which are currently deiced."""
+        with self._lock:
+            return tuple(self._cache)
+
+    def __getitem__(self, key: str) -> IceProxy:
+        if key not in self._keys:
+            raise KeyError(f"{key} is not a valid key")
+        return IceProxy(self, key)
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name not in self._keys:
+            raise AttributeError(name)
+        return self[name]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return f"<LazyDeice {list(self._keys)}>"
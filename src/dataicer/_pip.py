@@ -1,8 +1,37 @@
 from typing import List
+import importlib
+from importlib import metadata
 import subprocess
+import sys
+
+_environment_cache = {"key": None, "freeze": None}
+
 
 def get_pip_freeze() -> List[str]:
     """Return the freeze list from pip directly as a list"""
     run = subprocess.Popen(["pip", "freeze"], stdout=subprocess.PIPE)
     stdout = run.stdout.read().decode().strip().split("\n")
     return stdout
+
+
+def _environment_key() -> tuple:
+    return (tuple(sys.path), len(sys.modules))
+
+
+def get_environment() -> List[str]:
+    """Return a pip freeze style list of the installed distributions.
+
+    The list is built from `importlib.metadata` without calling pip and is cached
+    for the process, it is only rebuilt when `sys.path` or `sys.modules` change.
+    """
+    key = _environment_key()
+    if _environment_cache["key"] != key:
+        importlib.invalidate_caches()
+        versions = dict()
+        for dist in metadata.distributions():
+            name = dist.metadata["Name"]
+            if name and name.lower() not in versions:
+                versions[name.lower()] = f"{name}=={dist.version}"
+        _environment_cache["freeze"] = sorted(versions.values(), key=str.lower)
+        _environment_cache["key"] = key
+    return list(_environment_cache["freeze"])
@@ -0,0 +1,479 @@
+from typing import Literal, Union
+from concurrent.futures import Executor
+from contextlib import contextmanager
+import io
+import os
+import pathlib
+import shutil
+import sqlite3
+import tempfile
+import threading
+import zlib
+
+from ._base_archive import BaseArchiveHandler
+from ._stats import ArchiveStats
+from ._utils import PathType
+
+# blobs are copied in and out of the database in pieces of this size
+_BLOB_CHUNK = 2**20
+# incremental blob I/O needs Python 3.11
+_HAS_BLOBOPEN = hasattr(sqlite3.Connection, "blobopen")
+
+
+class SQLiteSubstrBlob:
+    """Read only stand in for `sqlite3.Blob` on Python < 3.11.
+
+    Blobs are read in pieces with `substr`, SQLite may still load the whole blob for
+    each read.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, rowid: int):
+        self._conn = conn
+        self._rowid = rowid
+        self._size = conn.execute(
+            "SELECT length(data) FROM files WHERE rowid = ?", (rowid,)
+        ).fetchone()[0]
+        self._pos = 0
+
+    def read(self, length: int = -1) -> bytes:
+        if length < 0:
+            length = self._size - self._pos
+        length = max(min(length, self._size - self._pos), 0)
+        if length == 0:
+            return b""
+        data = self._conn.execute(
+            "SELECT substr(data, ?, ?) FROM files WHERE rowid = ?",
+            (self._pos + 1, length, self._rowid),
+        ).fetchone()[0]
+        self._pos += len(data)
+        return bytes(data)
+
+    def seek(self, offset: int, origin: int = io.SEEK_SET) -> None:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._size}
+        pos = base[origin] + offset
+        if not 0 <= pos <= self._size:
+            raise ValueError("offset out of blob range")
+        self._pos = pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteBlobReader(io.RawIOBase):
+    """Read only, seekable file object over a blob of the files table.
+
+    Reads go through the connection so they hold the archive lock.
+    """
+
+    def __init__(self, blob, lock):
+        self._blob = blob
+        self._lock = lock
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        with self._lock:
+            data = self._blob.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        with self._lock:
+            self._blob.seek(offset, whence)
+            return self._blob.tell()
+
+    def tell(self):
+        with self._lock:
+            return self._blob.tell()
+
+    def close(self):
+        if not self.closed:
+            with self._lock:
+                self._blob.close()
+        super().close()
+
+
+class SQLiteBlobWriter(io.RawIOBase):
+    """Write only file object which stores a blob in the files table when closed.
+
+    The data is spooled to a temporary file, then copied into a blob of the final size
+    with incremental blob I/O so large files are never held in memory.
+    """
+
+    def __init__(self, archive: "SQLiteHandler", file_name: str):
+        self._archive = archive
+        self._file_name = file_name
+        self._spool = tempfile.SpooledTemporaryFile(
+            max_size=_BLOB_CHUNK, dir=archive._working_path
+        )
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if memoryview(data).nbytes > _BLOB_CHUNK:
+            # write large buffers straight to disk, the spool only rolls over after a
+            # write so it would hold a copy of the whole buffer in memory
+            self._spool.rollover()
+        return self._spool.write(data)
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._spool.seek(0)
+                self._archive._write_blob(self._file_name, self._spool)
+            finally:
+                self._spool.close()
+        super().close()
+
+
+class SQLiteHandler(BaseArchiveHandler):
+    """A handler for saving/loading keys and files to/from a single SQLite database.
+
+    Key JSON and files are stored as rows of the `keys` and `files` tables, files are
+    streamed in and out of the database with incremental blob I/O (read in pieces and
+    written whole on Python < 3.11). The database uses
+    write ahead logging so other processes can read the archive while it is written.
+
+    A session is a transaction, it is committed when the outermost session closes and
+    rolled back if an exception escapes it, e.g. a failed `ice` leaves no keys behind.
+    Sessions in "w" and "a" mode hold the write lock of the database from the start, so
+    sessions of other writers wait (up to the sqlite3 timeout) until they close.
+    Files are read and written by many threads through a single connection, access to
+    the connection is serialised.
+    """
+
+    _archive_type = "sqlite"
+
+    def __init__(
+        self,
+        db_path: PathType,
+        handlers: dict = None,
+        mode: Literal["r", "w", "a"] = "r",
+        working_path=None,
+        environment: Literal["eager", "lazy", "off"] = "eager",
+        restore_options: dict = None,
+        workers: Union[int, Executor, None] = None,
+        compact_json: bool = False,
+        stats: ArchiveStats = None,
+    ):
+        """
+
+        Args:
+            db_path: The path of the database, (always has a .ice.sqlite suffix)
+            handlers: type and handler pairs, handlers are `jsonpickle` extensions.
+            mode: how to open the file.
+            working_path: where to create temporary files for plugins that need a path on disk.
+            environment: when to capture the Python environment, see `BaseArchiveHandler`.
+            restore_options: default handler options when deicing, see `BaseArchiveHandler`.
+            workers: threads to ice/deice keys with, see `BaseArchiveHandler`.
+            compact_json: write key JSON without indentation, see `BaseArchiveHandler`.
+            stats: collect timings and sizes of the archive operations, see `ArchiveStats`.
+        """
+        self._mode = mode
+        db_path = pathlib.Path(db_path)
+        if not db_path.name.endswith(".ice.sqlite"):
+            db_path = db_path.with_suffix(".ice.sqlite")
+        self.db_path = db_path
+        self._working_path = working_path
+        self._conn = None
+        self._conn_depth = 0
+        self._rollback = False
+        self._tempdir = None
+        self._lock = threading.RLock()
+
+        super().__init__(
+            self.db_path,
+            handlers=handlers,
+            environment=environment,
+            restore_options=restore_options,
+            workers=workers,
+            compact_json=compact_json,
+            stats=stats,
+        )
+        # file reference counting and database access share a lock to keep a single lock order
+        self._files_lock = self._lock
+
+        if mode in ["r", "a"] and not self.db_path.exists():
+            raise FileNotFoundError
+
+        if mode == "w":
+            for path in (self.db_path, *self._wal_paths()):
+                if path.exists():
+                    os.remove(path)
+            conn = sqlite3.connect(self.db_path)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE keys (key TEXT PRIMARY KEY, json TEXT NOT NULL)"
+                )
+                conn.execute(
+                    "CREATE TABLE files (name TEXT PRIMARY KEY, data BLOB NOT NULL)"
+                )
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _wal_paths(self):
+        return [
+            self.db_path.with_name(self.db_path.name + ext) for ext in ("-wal", "-shm")
+        ]
+
+    def _open_db(self):
+        """Connect to the database and begin a transaction, sessions can be nested."""
+        with self._lock:
+            if self._conn is None:
+                if self._mode == "r":
+                    conn = sqlite3.connect(
+                        f"{self.db_path.resolve().as_uri()}?mode=ro",
+                        uri=True,
+                        isolation_level=None,
+                        check_same_thread=False,
+                    )
+                else:
+                    conn = sqlite3.connect(
+                        self.db_path, isolation_level=None, check_same_thread=False
+                    )
+                    conn.execute("PRAGMA journal_mode=WAL")
+                # writers take the write lock up front, a deferred transaction which
+                # read before another writer committed cannot write and is not retried
+                conn.execute("BEGIN" if self._mode == "r" else "BEGIN IMMEDIATE")
+                self._conn = conn
+            self._conn_depth += 1
+
+    def _close_db(self):
+        with self._lock:
+            self._conn_depth -= 1
+            if self._conn_depth > 0:
+                return
+            try:
+                if self._rollback:
+                    self._conn.execute("ROLLBACK")
+                else:
+                    self._conn.execute("COMMIT")
+            finally:
+                self._conn.close()
+                self._conn = None
+                self._rollback = False
+                self._dirty = False
+                if self._tempdir is not None:
+                    self._tempdir.cleanup()
+                    self._tempdir = None
+
+    @contextmanager
+    def _db_session(self):
+        """Make sure the database is connected for the duration of the context."""
+        self._open_db()
+        try:
+            yield self._conn
+        finally:
+            self._close_db()
+
+    def _check_writeable(self):
+        if self._mode == "r":
+            raise ValueError("SQLiteArchive is read only")
+        self._dirty = True
+
+    def _file_rowid(self, file_name: str) -> int:
+        row = self._conn.execute(
+            "SELECT rowid FROM files WHERE name = ?", (file_name,)
+        ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"{file_name} is not in the archive")
+        return row[0]
+
+    def _write_blob(self, file_name: str, source) -> None:
+        """Store the rest of a binary file object as the blob of a file.
+
+        Without incremental blob I/O (Python < 3.11) the file is read into memory.
+        """
+        if not _HAS_BLOBOPEN:
+            data = source.read()
+            with self._lock:
+                self._check_writeable()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO files (name, data) VALUES (?, ?)",
+                    (file_name, data),
+                )
+            return
+        start = source.tell()
+        size = source.seek(0, io.SEEK_END) - start
+        source.seek(start)
+        with self._lock:
+            self._check_writeable()
+            rowid = self._conn.execute(
+                "INSERT OR REPLACE INTO files (name, data) VALUES (?, zeroblob(?))",
+                (file_name, size),
+            ).lastrowid
+            with self._conn.blobopen("files", "data", rowid) as blob:
+                for chunk in iter(lambda: source.read(_BLOB_CHUNK), b""):
+                    blob.write(chunk)
+
+    def open_file(self, file_name, mode="r"):
+        """Open an individual file in the archive, must be used within an open session.
+
+        Files opened for reading are streamed from the database, written files are
+        stored when they are closed.
+        """
+        if "a" in mode or "+" in mode:
+            raise ValueError(f"SQLiteHandler files cannot be opened with mode {mode}")
+        if "w" in mode:
+            self._check_writeable()
+            raw = SQLiteBlobWriter(self, file_name)
+            buffered = io.BufferedWriter(raw, buffer_size=_BLOB_CHUNK)
+        else:
+            with self._lock:
+                rowid = self._file_rowid(file_name)
+                if _HAS_BLOBOPEN:
+                    blob = self._conn.blobopen("files", "data", rowid, readonly=True)
+                else:
+                    blob = SQLiteSubstrBlob(self._conn, rowid)
+            raw = SQLiteBlobReader(blob, self._lock)
+            buffered = io.BufferedReader(raw, buffer_size=_BLOB_CHUNK)
+        if "b" not in mode:
+            return io.TextIOWrapper(buffered, encoding="utf-8")
+        return buffered
+
+    def _get_tempdir(self) -> pathlib.Path:
+        with self._lock:
+            if self._tempdir is None:
+                self._tempdir = tempfile.TemporaryDirectory(
+                    prefix="dataicer_", suffix=".ice", dir=self._working_path
+                )
+        return pathlib.Path(self._tempdir.name)
+
+    @contextmanager
+    def file_path(self, file_name, mode="r"):
+        """Context manager giving a local path for a file in the archive.
+
+        Only the requested file is copied out of the database, new files are stored on
+        exit. In "a" mode the file is copied out and stored again on exit.
+        Must be used within an open session.
+        """
+        path = self._get_tempdir() / file_name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if "w" in mode or "a" in mode:
+            self._check_writeable()
+            if "a" in mode:
+                with self.open_file(file_name, "rb") as src, open(path, "wb") as dst:
+                    shutil.copyfileobj(src, dst, _BLOB_CHUNK)
+            yield path
+            with open(path, "rb") as src:
+                self._write_blob(file_name, src)
+            os.remove(path)
+        else:
+            with self._lock:
+                if not path.exists():
+                    with self.open_file(file_name, "rb") as src, open(
+                        path, "wb"
+                    ) as dst:
+                        shutil.copyfileobj(src, dst, _BLOB_CHUNK)
+            yield path
+
+    def save_json(self, **kwargs):
+        """Save JSON strings to the archive with names from keyword arguments."""
+        if self._mode == "r":
+            raise ValueError("SQLiteArchive is read only")
+        with self._db_session() as conn, self._lock:
+            for arg, val in kwargs.items():
+                if self._json_unchanged(arg, val):
+                    continue
+                self._check_writeable()
+                conn.execute(
+                    "INSERT OR REPLACE INTO keys (key, json) VALUES (?, ?)", (arg, val)
+                )
+                self._index_key(arg, val)
+            if self._session_depth == 0:
+                self._flush_index()
+
+    def _json_unchanged(self, key: str, val: str) -> bool:
+        """Check if the stored JSON for a key is identical to `val`."""
+        entry = self._get_index().get(key)
+        if entry is None:
+            return False
+        encoded = val.encode()
+        if "size" in entry and (
+            entry["size"] != len(encoded)
+            or entry["checksum"] != f"{zlib.crc32(encoded):08x}"
+        ):
+            return False
+        return self._read_key(key) == val
+
+    def _read_key(self, key):
+        with self._db_session() as conn, self._lock:
+            row = conn.execute("SELECT json FROM keys WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self._key_missing(key)
+            raise KeyError(f"{key} is not a valid key")
+        return row[0]
+
+    def _get_index(self):
+        with self._db_session():
+            return super()._get_index()
+
+    def _stored_keys(self):
+        with self._db_session() as conn, self._lock:
+            return {row[0] for row in conn.execute("SELECT key FROM keys")}
+
+    def _scan_keys(self):
+        """Index entries for the keys table."""
+        with self._db_session() as conn, self._lock:
+            rows = conn.execute("SELECT key, json FROM keys").fetchall()
+        return {
+            key: {
+                "json": key,
+                "size": len(val.encode()),
+                "checksum": f"{zlib.crc32(val.encode()):08x}",
+            }
+            for key, val in rows
+        }
+
+    def remove_key(self, key: str) -> None:
+        """Remove a key and associated files from an archive"""
+        if self._mode == "r":
+            raise ValueError("SQLiteArchive is read only")
+
+        with self as _, self._lock:
+            assert key in self._get_index()
+
+            self._release_key(key)
+            self._check_writeable()
+            self._conn.execute("DELETE FROM keys WHERE key = ?", (key,))
+
+    def has_file(self, file_name):
+        """Check if a file, or a group of files "<file_name>/...", is stored in the archive."""
+        with self._db_session() as conn, self._lock:
+            row = conn.execute(
+                "SELECT 1 FROM files WHERE name = ? OR (name >= ? AND name < ?) LIMIT 1",
+                (file_name, f"{file_name}/", f"{file_name}0"),
+            ).fetchone()
+        return row is not None
+
+    def remove_file(self, file_name):
+        """Remove a single file, or a group of files "<file_name>/...", from the archive."""
+        with self._db_session() as conn, self._lock:
+            self._check_writeable()
+            conn.execute(
+                "DELETE FROM files WHERE name = ? OR (name >= ? AND name < ?)",
+                (file_name, f"{file_name}/", f"{file_name}0"),
+            )
+
+    def open(self):
+        super().open()
+        self._open_db()
+
+    def close(self):
+        super().close()
+        self._close_db()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and self._conn_depth == 1:
+            self._rollback = True
+        super().__exit__(exc_type, exc_value, traceback)
@@ -0,0 +1,329 @@
+from typing import Callable, Dict, Iterable, List
+from contextlib import contextmanager
+from contextvars import ContextVar
+import io
+import logging
+import os
+import threading
+import time
+
+# the key event of the key being iced/deiced in the current context, file events are
+# added to it
+_current_key: ContextVar = ContextVar("dataicer_current_key", default=None)
+# set while an archive opens or closes a file path, files it opens to do so are not
+# counted again
+_in_file_path: ContextVar = ContextVar("dataicer_in_file_path", default=False)
+
+# events for a whole key
+KEY_EVENTS = ("ice", "deice", "append", "read_slice")
+
+
+class ArchiveStats:
+    """Collects the timings and sizes of archive operations.
+
+    Pass an instance to an archive with `stats=` or set `archive.stats`. Every operation
+    is recorded as an event dict with an "event" name, its "start" (`time.perf_counter`),
+    "seconds" and "thread", and the event fields:
+
+        ice, deice, append, read_slice: one per key with the "key", the "handler" class
+            and "mode" of the stored object, "bytes_read", "bytes_written" and "files"
+            for the sidecar files of the key. ice also has the "encode_seconds" spent
+            flattening the object (including writing sidecars) and deice the
+            "decode_seconds" spent restoring it.
+        file: one per sidecar opened, with the "file", "mode", "key" and "bytes_read" or
+            "bytes_written" (characters for text files). Files read with a memory map
+            are not counted.
+        meta: saving the archive meta data, "environment" is True if the Python
+            environment was captured.
+        zip_extract, zip_compress, zip_compact: `ZipHandler` copying members to and from
+            local files, with the "file", and "bytes" and "compress_size" of members.
+
+    Events are passed to the callbacks as they are recorded, e.g. to forward them to a
+    profiler, see `log_events` for logging them.
+    """
+
+    def __init__(
+        self, callbacks: Iterable[Callable[[dict], None]] = None, keep_events=True
+    ):
+        """
+
+        Args:
+            callbacks: functions called with each event.
+            keep_events: keep the events in `events`, turn off for long running processes
+                which only use the callbacks.
+        """
+        self.events: List[dict] = []
+        self._callbacks = list(callbacks) if callbacks else []
+        self._keep_events = keep_events
+        self._lock = threading.Lock()
+
+    def record(self, event: str, **fields) -> dict:
+        """Record an event and pass it to the callbacks."""
+        fields["event"] = event
+        if self._keep_events:
+            with self._lock:
+                self.events.append(fields)
+        for callback in self._callbacks:
+            callback(fields)
+        return fields
+
+    @contextmanager
+    def measure(self, event: str, **fields):
+        """Time a block and record it as an event.
+
+        Yields the event fields so more can be added within the block.
+        """
+        fields.update(start=time.perf_counter(), thread=threading.get_ident())
+        try:
+            yield fields
+        finally:
+            fields["seconds"] = time.perf_counter() - fields["start"]
+            self.record(event, **fields)
+
+    @contextmanager
+    def measure_key(self, event: str, key: str):
+        """Time an operation on a key, the files opened within it are added to its event."""
+        with self.measure(
+            event, key=key, bytes_read=0, bytes_written=0, files=0
+        ) as fields:
+            token = _current_key.set(fields)
+            try:
+                yield fields
+            finally:
+                _current_key.reset(token)
+
+    def record_file(self, **fields) -> None:
+        """Record the use of a file and add it to the key it belongs to."""
+        key_fields = _current_key.get()
+        fields["key"] = None if key_fields is None else key_fields["key"]
+        if key_fields is not None:
+            with self._lock:
+                key_fields["files"] += 1
+                key_fields["bytes_read"] += fields.get("bytes_read", 0)
+                key_fields["bytes_written"] += fields.get("bytes_written", 0)
+        self.record("file", **fields)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.events.clear()
+
+    def totals(self) -> Dict[str, dict]:
+        """The count, seconds, and bytes read and written of each type of event."""
+        totals = dict()
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            total = totals.setdefault(
+                event["event"],
+                {"count": 0, "seconds": 0.0, "bytes_read": 0, "bytes_written": 0},
+            )
+            total["count"] += 1
+            total["seconds"] += event.get("seconds", 0.0)
+            if event["event"] in KEY_EVENTS + ("file",):
+                total["bytes_read"] += event.get("bytes_read", 0)
+                total["bytes_written"] += event.get("bytes_written", 0)
+        return totals
+
+    def key_stats(self) -> Dict[str, dict]:
+        """The key events of each key, by key and event name, e.g.
+        `stats.key_stats()["arr"]["ice"]["encode_seconds"]`.
+
+        Keys iced or deiced more than once have the totals of their events.
+        """
+        keys = dict()
+        with self._lock:
+            events = [event for event in self.events if event["event"] in KEY_EVENTS]
+        for event in events:
+            stats = keys.setdefault(event["key"], dict()).get(event["event"])
+            if stats is None:
+                keys[event["key"]][event["event"]] = {
+                    name: value
+                    for name, value in event.items()
+                    if name not in ("event", "key", "start", "thread")
+                }
+                continue
+            for name, value in event.items():
+                if name.endswith("seconds") or name.startswith(("bytes", "files")):
+                    stats[name] = stats.get(name, 0) + value
+        return keys
+
+    @staticmethod
+    def log_events(
+        logger: logging.Logger = None, level: int = logging.DEBUG
+    ) -> Callable[[dict], None]:
+        """A callback which logs every event, e.g. `ArchiveStats([ArchiveStats.log_events()])`.
+
+        Args:
+            logger: the logger to use, the "dataicer" logger if None.
+            level: the level to log at.
+        """
+        logger = logger if logger is not None else logging.getLogger("dataicer")
+
+        def log_event(event: dict) -> None:
+            if logger.isEnabledFor(level):
+                fields = " ".join(
+                    f"{name}={value}"
+                    for name, value in event.items()
+                    if name not in ("event", "start", "thread")
+                )
+                logger.log(level, "%s %s", event["event"], fields)
+
+        return log_event
+
+    def log_summary(
+        self, logger: logging.Logger = None, level: int = logging.INFO
+    ) -> None:
+        """Log the totals of each type of event, see `totals`."""
+        logger = logger if logger is not None else logging.getLogger("dataicer")
+        for event, total in sorted(self.totals().items()):
+            logger.log(
+                level,
+                "%s: %d in %.3f s, %d bytes read, %d bytes written",
+                event,
+                total["count"],
+                total["seconds"],
+                total["bytes_read"],
+                total["bytes_written"],
+            )
+
+
+class CountingFile:
+    """Proxy of an open file which counts the data read and written."""
+
+    def __init__(self, file_obj):
+        self._file = file_obj
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self._file.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = next(self._file)
+        self.bytes_read += len(line)
+        return line
+
+    def read(self, *args):
+        data = self._file.read(*args)
+        self.bytes_read += len(data)
+        return data
+
+    def read1(self, *args):
+        data = self._file.read1(*args)
+        self.bytes_read += len(data)
+        return data
+
+    def readline(self, *args):
+        line = self._file.readline(*args)
+        self.bytes_read += len(line)
+        return line
+
+    def readlines(self, *args):
+        lines = self._file.readlines(*args)
+        self.bytes_read += sum(len(line) for line in lines)
+        return lines
+
+    def readinto(self, buffer):
+        count = self._file.readinto(buffer)
+        self.bytes_read += count or 0
+        return count
+
+    def readinto1(self, buffer):
+        count = self._file.readinto1(buffer)
+        self.bytes_read += count or 0
+        return count
+
+    def write(self, data):
+        count = self._file.write(data)
+        self.bytes_written += (
+            len(data) if isinstance(data, str) else memoryview(data).nbytes
+        )
+        return count
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+
+# readers check for file objects with isinstance
+io.IOBase.register(CountingFile)
+
+
+class CountedOpen:
+    """Context manager for a file opened by an archive which records its use."""
+
+    def __init__(self, stats: ArchiveStats, opened, file_name: str, mode: str):
+        self._stats = stats
+        self._opened = opened
+        self._fields = dict(file=file_name, mode=mode)
+        self._file = None
+
+    def __enter__(self):
+        self._fields.update(start=time.perf_counter(), thread=threading.get_ident())
+        self._file = CountingFile(self._opened.__enter__())
+        return self._file
+
+    def __exit__(self, type, value, traceback):
+        try:
+            return self._opened.__exit__(type, value, traceback)
+        finally:
+            fields = self._fields
+            fields["seconds"] = time.perf_counter() - fields["start"]
+            fields["bytes_read"] = self._file.bytes_read
+            fields["bytes_written"] = self._file.bytes_written
+            self._stats.record_file(**fields)
+
+
+def _file_size(path) -> int:
+    return os.path.getsize(path) if os.path.isfile(path) else 0
+
+
+class CountedFilePath:
+    """Context manager for a file path given by an archive which records its use.
+
+    The size of the file is counted as read for "r" mode, written for "w" mode and the
+    change in size is counted as written for "a" mode.
+    """
+
+    def __init__(self, stats: ArchiveStats, file_path, file_name: str, mode: str):
+        self._stats = stats
+        self._file_path = file_path
+        self._fields = dict(file=file_name, mode=mode)
+        self._path = None
+        self._size = 0
+
+    def __enter__(self):
+        self._fields.update(start=time.perf_counter(), thread=threading.get_ident())
+        token = _in_file_path.set(True)
+        try:
+            self._path = self._file_path.__enter__()
+        finally:
+            _in_file_path.reset(token)
+        self._size = _file_size(self._path)
+        return self._path
+
+    def __exit__(self, type, value, traceback):
+        size = _file_size(self._path)
+        token = _in_file_path.set(True)
+        try:
+            return self._file_path.__exit__(type, value, traceback)
+        finally:
+            _in_file_path.reset(token)
+            fields = self._fields
+            fields["seconds"] = time.perf_counter() - fields["start"]
+            if "w" in fields["mode"]:
+                fields["bytes_written"] = size
+            elif "a" in fields["mode"]:
+                fields["bytes_written"] = max(size - self._size, 0)
+            else:
+                fields["bytes_read"] = self._size
+            self._stats.record_file(**fields)
@@ -1,29 +1,152 @@
-from typing import Literal
-import shutil
+from typing import Callable, Literal, Union
+from concurrent.futures import Executor
+from contextlib import contextmanager, nullcontext
+import io
 import os
 import pathlib
+import shutil
 import tempfile
+import threading
 import zipfile
-import time
+import zlib
 
-from ._errors import DataIceExists
 from ._base_archive import BaseArchiveHandler
+from ._stats import ArchiveStats
 from ._utils import PathType
-from ._dir_archive import DirectoryHandler
 
+# members are compressed in pieces of this size
+_COMPRESS_CHUNK = 2**20
+# members in these formats are already compressed or are read with random access, which
+# is slow through a compressed member, they are stored as is
+STORED_SUFFIXES = (".npz", ".h5", ".nc", ".parquet", ".feather")
+# files stored as a group of members "<file_name>/...", e.g. the chunks of an array
+GROUP_SUFFIXES = (".chunked",)
+
+
+def stored_member(file_name: str) -> bool:
+    """Check if a member should be stored uncompressed, see `STORED_SUFFIXES`.
+
+    The chunks of chunked arrays ("<file_uuid>.chunked/<chunk>") are compressed already.
+    """
+    folder, _, name = file_name.rpartition("/")
+    return name.endswith(STORED_SUFFIXES) or folder.endswith(GROUP_SUFFIXES)
+
+
+class ZipMemberHandler:
+    """Context manager for a single member of an open zip file.
+
+    Members are streamed to/from the zip file, text modes are wrapped
+    with a utf-8 text layer. If a lock is given it is held until the member is closed.
+    """
+
+    def __init__(self, zip_file: zipfile.ZipFile, member: str, mode="r", lock=None):
+        if "a" in mode or "+" in mode:
+            raise ValueError(f"ZipHandler members cannot be opened with mode {mode}")
+
+        self._lock = lock if lock is not None else nullcontext()
+        self._lock.__enter__()
+        try:
+            if "w" in mode:
+                file_obj = zip_file.open(member, mode="w", force_zip64=True)
+            else:
+                file_obj = zip_file.open(member, mode="r")
+        except BaseException:
+            self._lock.__exit__(None, None, None)
+            raise
+
+        if "b" not in mode:
+            file_obj = io.TextIOWrapper(file_obj, encoding="utf-8")
+        self.file_obj = file_obj
+
+    def __enter__(self):
+        return self.file_obj
+
+    def __exit__(self, type, value, traceback):
+        try:
+            self.file_obj.close()
+        finally:
+            self._lock.__exit__(type, value, traceback)
+
+
+class ZipMemberWriter(io.RawIOBase):
+    """Write only file object which compresses a member in the writing thread.
+
+    The compressed data is spooled to a temporary file and appended to the zip file
+    when closed, so members written by different threads are compressed in parallel and
+    the zip file is only locked to copy the compressed data.
+    """
+
+    def __init__(
+        self, archive: "ZipHandler", file_name: str, compress_type: int, compresslevel
+    ):
+        self._archive = archive
+        self._info = zipfile.ZipInfo(file_name)
+        self._info.compress_type = compress_type
+        self._info.external_attr = 0o600 << 16
+        if compress_type == zipfile.ZIP_LZMA:
+            # compressed data includes an end of stream marker
+            self._info.flag_bits |= 0x02
+        self._compressor = zipfile._get_compressor(compress_type, compresslevel)
+        self._spool = tempfile.SpooledTemporaryFile(
+            max_size=_COMPRESS_CHUNK, dir=archive._working_path
+        )
+        self._crc = 0
+        self._size = 0
+
+    def writable(self):
+        return True
 
-class ZipHandler(DirectoryHandler):
+    def write(self, data):
+        data = memoryview(data).cast("B")
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += data.nbytes
+        self._spool.write(self._compressor.compress(data))
+        return data.nbytes
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._spool.write(self._compressor.flush())
+                self._info.CRC = self._crc
+                self._info.file_size = self._size
+                self._info.compress_size = self._spool.tell()
+                self._spool.seek(0)
+                self._archive._add_member(self._info, self._spool)
+            finally:
+                self._spool.close()
+        super().close()
+
+
+class ZipHandler(BaseArchiveHandler):
     """A handler for saving/loading files to/from a zip file.
-    Writes are only atomic on close with the context manager.
 
-    This is mostly a thin wrapper around a DirectoryHandler that zips/unzips to
-    a temporary directory.
+    Members are read directly from the zip file on demand and are never extracted
+    unless a plugin needs a local path. Read only sessions never write to the zip file.
+
+    By default new members are appended to the zip file in place, so a write only costs
+    the size of the changed or new members. The central directory is rewritten on close,
+    until then other readers cannot open the zip file and a session that is killed leaves
+    it without a central directory.
+
+    With `atomic=True` writes are only atomic on close: the first write of a session
+    copies the zip file to a temporary file next to it, new members are appended to the
+    copy and it replaces the zip file when the session closes. Other readers see the
+    archive as of the last closed session, and a session that is killed leaves the
+    archive unchanged (and its temporary `.dataicer_*.ice.zip` file behind), but every
+    writing session copies the whole archive.
+
+    Replaced or removed members leave unreachable data in the zip file, this is
+    compacted on close once it exceeds `compact_threshold` of the archive size.
+
+    Members are stored uncompressed by default. With `compression` they are compressed in
+    the threads writing them, so keys iced with `workers` are compressed in parallel, and
+    members of an archive opened for reading are read and decompressed from many threads
+    at once. Only appending members to the zip file is serialised.
 
     Best performance will be achieved with a single context session.
     """
 
     _archive_type = "zip"
-    i = 1
 
     def __init__(
         self,
@@ -31,6 +154,15 @@ class ZipHandler(DirectoryHandler):
         handlers: dict = None,
         mode: Literal["r", "w", "a"] = "r",
         working_path=None,
+        compact_threshold: float = 0.5,
+        environment: Literal["eager", "lazy", "off"] = "eager",
+        restore_options: dict = None,
+        workers: Union[int, Executor, None] = None,
+        compact_json: bool = False,
+        stats: ArchiveStats = None,
+        compression: Union[int, Callable[[str], int]] = zipfile.ZIP_STORED,
+        compresslevel: int = None,
+        atomic: bool = False,
     ):
         """
 
@@ -38,47 +170,444 @@ class ZipHandler(DirectoryHandler):
             zip_path: The path of the zip file, (always has a .ice.zip suffix)
             handlers: type and handler pairs, handlers are `jsonpickle` extensions.
             mode: how to open the file.
+            working_path: where to create temporary files for plugins that need a path on disk.
+            compact_threshold: fraction of unreachable data in the zip file which triggers
+                a rewrite on close.
+            environment: when to capture the Python environment, see `BaseArchiveHandler`.
+            restore_options: default handler options when deicing, see `BaseArchiveHandler`.
+            workers: threads to ice/deice keys with, see `BaseArchiveHandler`.
+            compact_json: write key JSON without indentation, see `BaseArchiveHandler`.
+            stats: collect timings and sizes of the archive operations, see `ArchiveStats`.
+            compression: the `zipfile` compression of new members, e.g.
+                `zipfile.ZIP_DEFLATED`, members matching `stored_member` are always
+                stored. Or a function of the member name returning its compression.
+            compresslevel: the compression level, see `zipfile.ZipFile`.
+            atomic: write sessions to a copy of the zip file which replaces it on close,
+                instead of appending to the zip file in place.
         """
-        self._zip_mode = mode
-        self.zip_path = pathlib.Path(zip_path).with_suffix(".ice.zip")
+        self._mode = mode
+        zip_path = pathlib.Path(zip_path)
+        if not zip_path.name.endswith(".ice.zip"):
+            zip_path = zip_path.with_suffix(".ice.zip")
+        self.zip_path = zip_path
         self._working_path = working_path
-        self._handlers = handlers
-        self._open = False
+        self._zip = None
+        self._zip_depth = 0
+        self._session_path = None
+        self._tempdir = None
+        self._compact_threshold = compact_threshold
+        self._compression = compression
+        self._compresslevel = compresslevel
+        self._atomic = atomic
+        self._lock = threading.RLock()
+
+        super().__init__(
+            self.zip_path,
+            handlers=handlers,
+            environment=environment,
+            restore_options=restore_options,
+            workers=workers,
+            compact_json=compact_json,
+            stats=stats,
+        )
+        # file reference counting and member writes share a lock to keep a single lock order
+        self._files_lock = self._lock
 
         if mode in ["r", "a"] and not self.zip_path.exists():
             raise FileNotFoundError
 
-        if mode == "w" and self.zip_path.exists():
-            os.remove(self.zip_path)
+        if mode == "w":
+            if self.zip_path.exists():
+                os.remove(self.zip_path)
+            zipfile.ZipFile(self.zip_path, "w").close()
+
+    def _open_zip(self):
+        """Open the zip file for reading, sessions can be nested."""
+        with self._lock:
+            if self._zip is None:
+                self._zip = zipfile.ZipFile(self.zip_path, "r")
+            self._zip_depth += 1
 
-        self._tempdir = tempfile.TemporaryDirectory(
-            prefix="dataicer_", suffix=".ice", dir=self._working_path
+    def _temp_zip_path(self) -> pathlib.Path:
+        """A new temporary file next to the zip file, to replace it with."""
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=".dataicer_", suffix=".ice.zip", dir=self.zip_path.parent
         )
-        self.working_dir = pathlib.Path(self._tempdir.name)
-        super().__init__(
-            self.working_dir, self._handlers, mode="w" if mode in ["w", "a"] else "r"
+        os.close(fd)
+        return pathlib.Path(tmp_path)
+
+    def _writeable_zip(self) -> zipfile.ZipFile:
+        """Reopen the zip file for appending on the first write of a session.
+
+        Atomic archives append to a copy of the zip file, which replaces it when the
+        session closes.
+        """
+        self._check_writeable()
+        with self._lock:
+            if self._zip.mode == "r" and not self._atomic:
+                zip_file = zipfile.ZipFile(self.zip_path, "a")
+                self._zip.close()
+                self._zip = zip_file
+            elif self._zip.mode == "r":
+                session_path = self._temp_zip_path()
+                try:
+                    shutil.copyfile(self.zip_path, session_path)
+                    zip_file = zipfile.ZipFile(session_path, "a")
+                except BaseException:
+                    os.remove(session_path)
+                    raise
+                self._zip.close()
+                self._zip = zip_file
+                self._session_path = session_path
+            self._dirty = True
+        return self._zip
+
+    def _member_lock(self):
+        """Readers only need to hold the lock once the zip file is open for writing."""
+        return nullcontext() if self._zip.mode == "r" else self._lock
+
+    def _close_zip(self):
+        with self._lock:
+            self._zip_depth -= 1
+            if self._zip_depth > 0:
+                return
+            self._zip.close()
+            self._zip = None
+            if self._tempdir is not None:
+                self._tempdir.cleanup()
+                self._tempdir = None
+            if self._session_path is not None:
+                self._commit_session()
+            elif self._dirty and self._unreachable_fraction() > self._compact_threshold:
+                self.compact()
+            self._dirty = False
+
+    def _commit_session(self) -> None:
+        """Replace the zip file with the copy written by the session."""
+        session_path, self._session_path = self._session_path, None
+        try:
+            if self._unreachable_fraction(session_path) > self._compact_threshold:
+                compacted = self._compact_to(session_path)
+                os.remove(session_path)
+                session_path = compacted
+            with open(session_path, "rb+") as session_file:
+                os.fsync(session_file.fileno())
+            os.replace(session_path, self.zip_path)
+        finally:
+            if session_path.exists():
+                os.remove(session_path)
+
+    def _unreachable_fraction(self, path: pathlib.Path = None) -> float:
+        """The fraction of the zip file taken by member data not in the central directory."""
+        with zipfile.ZipFile(path or self.zip_path, "r") as zip_file:
+            infos = sorted(zip_file.infolist(), key=lambda info: info.header_offset)
+            end = zip_file.start_dir
+        if end == 0:
+            return 0.0
+
+        # allow for zip64 extras and data descriptors in the local headers
+        slack = 44
+        unreachable = infos[0].header_offset if infos else end
+        for info, next_offset in zip(
+            infos, [info.header_offset for info in infos[1:]] + [end]
+        ):
+            span = next_offset - info.header_offset
+            used = 30 + len(info.orig_filename.encode()) + len(info.extra)
+            unreachable += max(span - used - info.compress_size - slack, 0)
+        return unreachable / end
+
+    def compact(self) -> None:
+        """Rewrite the zip file with only the reachable members.
+
+        The new zip file replaces the old one atomically.
+        """
+        if self._zip is not None:
+            raise RuntimeError("Cannot compact a ZipHandler with an open session")
+        self._check_writeable()
+        os.replace(self._compact_to(self.zip_path), self.zip_path)
+
+    def _compact_to(self, path: pathlib.Path) -> pathlib.Path:
+        """Copy the reachable members of a zip file to a new temporary zip file."""
+        tmp_path = self._temp_zip_path()
+        try:
+            with self._measure("zip_compact", file=self.zip_path.name) as fields:
+                with zipfile.ZipFile(path, "r") as src, zipfile.ZipFile(
+                    tmp_path, "w"
+                ) as dst:
+                    for info in src.infolist():
+                        new_info = zipfile.ZipInfo(info.filename, info.date_time)
+                        new_info.compress_type = info.compress_type
+                        new_info.external_attr = info.external_attr
+                        with src.open(info) as src_file, dst.open(
+                            new_info,
+                            "w",
+                            force_zip64=info.file_size > zipfile.ZIP64_LIMIT,
+                        ) as dst_file:
+                            shutil.copyfileobj(src_file, dst_file)
+                if fields is not None:
+                    fields["bytes"] = tmp_path.stat().st_size
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path
+
+    @contextmanager
+    def _zip_session(self):
+        """Make sure the zip file is open for the duration of the context."""
+        self._open_zip()
+        try:
+            yield self._zip
+        finally:
+            self._close_zip()
+
+    def _check_writeable(self):
+        if self._mode == "r":
+            raise ValueError("ZipArchive is read only")
+
+    def _drop_member(self, member: str) -> None:
+        """Remove a member from the central directory of the open zip file.
+
+        The member data is left in place but is no longer reachable.
+        """
+        zip_file = self._zip
+        info = zip_file.NameToInfo.pop(member)
+        zip_file.filelist.remove(info)
+        zip_file._didModify = True
+
+    def _compress_type(self, file_name: str) -> int:
+        """The compression of a new member, see `compression`."""
+        if callable(self._compression):
+            return self._compression(file_name)
+        if stored_member(file_name):
+            return zipfile.ZIP_STORED
+        return self._compression
+
+    def _add_member(self, info: zipfile.ZipInfo, src) -> None:
+        """Append a member from its compressed data, replacing any member of its name.
+
+        `info` must have the CRC and sizes of the data.
+        """
+        with self._lock:
+            zip_file = self._writeable_zip()
+            if info.filename in zip_file.NameToInfo:
+                self._drop_member(info.filename)
+            zip_file._writecheck(info)
+            zip_file.fp.seek(zip_file.start_dir)
+            info.header_offset = zip_file.fp.tell()
+            zip_file._didModify = True
+            zip_file.fp.write(info.FileHeader())
+            shutil.copyfileobj(src, zip_file.fp, _COMPRESS_CHUNK)
+            zip_file.start_dir = zip_file.fp.tell()
+            zip_file.filelist.append(info)
+            zip_file.NameToInfo[info.filename] = info
+
+    def open_file(self, file_name, mode="r"):
+        """Context manager for opening an individual file in the archive.
+
+        Must be used within an open session.
+        """
+        if "w" in mode and self._compress_type(file_name) != zipfile.ZIP_STORED:
+            if "a" in mode or "+" in mode:
+                raise ValueError(
+                    f"ZipHandler members cannot be opened with mode {mode}"
+                )
+            self._writeable_zip()
+            raw = ZipMemberWriter(
+                self, file_name, self._compress_type(file_name), self._compresslevel
+            )
+            buffered = io.BufferedWriter(raw, buffer_size=_COMPRESS_CHUNK)
+            if "b" not in mode:
+                return io.TextIOWrapper(buffered, encoding="utf-8")
+            return buffered
+        if "w" in mode:
+            with self._lock:
+                self._writeable_zip()
+                if file_name in self._zip.NameToInfo:
+                    self._drop_member(file_name)
+                return ZipMemberHandler(
+                    self._zip, file_name, mode=mode, lock=self._lock
+                )
+        return ZipMemberHandler(
+            self._zip, file_name, mode=mode, lock=self._member_lock()
         )
 
+    def _get_tempdir(self) -> pathlib.Path:
+        with self._lock:
+            if self._tempdir is None:
+                self._tempdir = tempfile.TemporaryDirectory(
+                    prefix="dataicer_", suffix=".ice", dir=self._working_path
+                )
+        return pathlib.Path(self._tempdir.name)
+
+    @contextmanager
+    def file_path(self, file_name, mode="r"):
+        """Context manager giving a local path for a member of the archive.
+
+        Only the requested member is extracted, new files are added to the archive
+        on exit. In "a" mode the member is extracted and added back on exit.
+        Must be used within an open session.
+        """
+        path = self._get_tempdir() / file_name
+        if "w" in mode or "a" in mode:
+            self._writeable_zip()
+            if "a" in mode:
+                with self._lock:
+                    self._extract(file_name, path)
+            yield path
+            with self._measure("zip_compress", file=file_name) as fields:
+                self._write_member(file_name, path)
+                if fields is not None:
+                    with self._lock:
+                        info = self._zip.NameToInfo[file_name]
+                    fields.update(
+                        bytes=info.file_size, compress_size=info.compress_size
+                    )
+            os.remove(path)
+        else:
+            if not path.exists():
+                with self._member_lock():
+                    self._extract(file_name, path)
+            yield path
+
+    def _write_member(self, file_name: str, path: pathlib.Path) -> None:
+        """Add a local file to the archive, it is compressed before locking the zip file."""
+        compress_type = self._compress_type(file_name)
+        if compress_type == zipfile.ZIP_STORED:
+            with self._lock:
+                if file_name in self._zip.NameToInfo:
+                    self._drop_member(file_name)
+                self._zip.write(path, arcname=file_name, compress_type=compress_type)
+            return
+        with open(path, "rb") as src:
+            with ZipMemberWriter(
+                self, file_name, compress_type, self._compresslevel
+            ) as dst:
+                shutil.copyfileobj(src, dst, _COMPRESS_CHUNK)
+
+    def _extract(self, file_name: str, path: pathlib.Path) -> None:
+        """Extract a member to a local path, members can be extracted concurrently."""
+        with self._measure("zip_extract", file=file_name) as fields:
+            fd, tmp_path = tempfile.mkstemp(prefix=".dataicer_", dir=path.parent)
+            try:
+                with self._zip.open(file_name) as src, os.fdopen(fd, "wb") as dst:
+                    shutil.copyfileobj(src, dst, _COMPRESS_CHUNK)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            if fields is not None:
+                info = self._zip.NameToInfo[file_name]
+                fields.update(bytes=info.file_size, compress_size=info.compress_size)
+
+    def save_json(self, **kwargs):
+        """Save JSON strings to the archive with names from keyword arguments."""
+        self._check_writeable()
+        with self._zip_session(), self._lock:
+            for arg, val in kwargs.items():
+                name = f"{arg}.json"
+                if self._json_unchanged(name, val):
+                    continue
+                zip_file = self._writeable_zip()
+                if name in zip_file.NameToInfo:
+                    self._drop_member(name)
+                zip_file.writestr(
+                    name,
+                    val,
+                    compress_type=self._compress_type(name),
+                    compresslevel=self._compresslevel,
+                )
+                self._index_key(arg, val)
+            if self._session_depth == 0:
+                self._flush_index()
+
+    def _json_unchanged(self, name: str, val: str) -> bool:
+        """Check if the stored JSON member is identical to `val`."""
+        info = self._zip.NameToInfo.get(name)
+        if info is None:
+            return False
+        encoded = val.encode()
+        if info.file_size != len(encoded) or info.CRC != zlib.crc32(encoded):
+            return False
+        return self._zip.read(info) == encoded
+
+    def _read_key(self, key):
+        with self._zip_session() as zip_file, self._member_lock():
+            try:
+                return zip_file.read(f"{key}.json").decode()
+            except KeyError:
+                self._key_missing(key)
+                raise
+
+    def _get_index(self):
+        with self._zip_session():
+            return super()._get_index()
+
+    def _scan_index(self):
+        super()._scan_index()
+        # a scanned index is written with the next change, so sessions which only read
+        # never write to the zip file
+        self._index_changed = False
+
+    def _flush_index(self):
+        # lookups outside a session flush the index after the zip file is closed
+        with self._zip_session():
+            super()._flush_index()
+
+    def _scan_keys(self):
+        """Index entries for the JSON members of the zip file."""
+        with self._zip_session() as zip_file, self._member_lock():
+            return {
+                name[:-5]: {
+                    "json": name,
+                    "size": info.file_size,
+                    "checksum": f"{info.CRC:08x}",
+                }
+                for name, info in zip_file.NameToInfo.items()
+                if name.endswith(".json") and "/" not in name
+            }
+
+    def remove_key(self, key: str) -> None:
+        """Remove a key and associated files from an archive"""
+        self._check_writeable()
+
+        with self as _, self._lock:
+            assert key in self._get_index()
+
+            self._release_key(key)
+            self._writeable_zip()
+            self._drop_member(f"{key}.json")
+
+    def has_file(self, file_name):
+        """Check if a member, or a group of members "<file_name>/...", is stored in the archive.
+
+        Only names of groups (see `GROUP_SUFFIXES`) are looked up by listing the members.
+        """
+        with self._zip_session() as zip_file, self._member_lock():
+            if file_name in zip_file.NameToInfo:
+                return True
+            if not file_name.endswith(GROUP_SUFFIXES):
+                return False
+            prefix = f"{file_name}/"
+            return any(name.startswith(prefix) for name in zip_file.NameToInfo)
+
+    def remove_file(self, file_name):
+        """Remove a single member, or a group of members "<file_name>/...", from the archive."""
+        with self._zip_session(), self._lock:
+            zip_file = self._writeable_zip()
+            if file_name in zip_file.NameToInfo:
+                self._drop_member(file_name)
+            if not file_name.endswith(GROUP_SUFFIXES):
+                return
+            prefix = f"{file_name}/"
+            for name in [
+                name for name in zip_file.NameToInfo if name.startswith(prefix)
+            ]:
+                self._drop_member(name)
+
     def open(self):
         super().open()
-        if self._zip_mode in ["r", "a"]:
-            zip_file = zipfile.ZipFile(self.zip_path, "r")
-            zip_file.extractall(self.working_dir)
-        self._open = True
+        self._open_zip()
 
     def close(self):
         super().close()
-        zip_file = zipfile.ZipFile(self.zip_path, "w")
-
-        for file in self.path.iterdir():
-            zip_file.write(file.absolute(), arcname=file.name)
-        zip_file.close()
-        self._open = False
-
-    def __enter__(self):
-        self.open()
-        return self
-
-    def __exit__(self, exc_type, exc_value, traceback):
-        self.close()
-        pass
+        self._close_zip()
@@ -1,3 +1,8 @@
 from .numpy import get_numpy_handlers, NumpyNDArrayHandler
-from .pandas import get_pandas_handlers, PandasDataFrameHandler
+from .pandas import (
+    get_pandas_handlers,
+    PandasDataFrameHandler,
+    PandasIndexHandler,
+    PandasSeriesHandler,
+)
 from .xarray import get_xarray_handlers, XarrayDataArrayHandler, XarrayDatasetHandler
@@ -1,18 +1,146 @@
+from typing import Callable, Literal, Type
 from typing import Type
-from typing import Type
+import hashlib
+import pathlib
+import re
+import shutil
+import tempfile
+import threading
 import uuid
 
-from .._base_archive import BaseArchiveHandler
+from .._base_archive import BaseArchiveHandler, active_archive
+
+# files named by a content hash, see BaseFileHandler._write_hashed
+CONTENT_HASH_NAME = re.compile(r"[0-9a-f]{40}\..+")
+# files written with a seekable mode are kept in memory up to this size
+SPOOL_SIZE = 2**24
 
 
 class BaseFileHandler:
-    def __init__(self):
-        self._ah = None
+    def __init__(self, naming: Literal["uuid", "hash"] = "uuid"):
+        """
+
+        Args:
+            naming: how to name files, "uuid" gives every file a unique name and "hash"
+                names files by a BLAKE2 hash of their content so identical files are
+                only stored once in an archive.
+        """
+        self._archive = None
+        self._local = threading.local()
+        self._naming = naming
+
+    @property
+    def _ah(self) -> BaseArchiveHandler:
+        """The archive of the current session.
+
+        Handler instances can be shared by archives that are open at the same time.
+        """
+        archive = active_archive()
+        if archive is not None and any(
+            handler is self for handler in archive._handlers.values()
+        ):
+            return archive
+        return self._archive
+
+    # handler instances are shared by all threads, jsonpickle sets the context
+    # (pickler/unpickler) on every call so keep it per thread
+    @property
+    def context(self):
+        return self._local.context
+
+    @context.setter
+    def context(self, context):
+        self._local.context = context
+
+    def __getstate__(self):
+        # the archive and thread state are not part of the handler configuration
+        state = self.__dict__.copy()
+        state.pop("_archive", None)
+        state.pop("_ah", None)
+        state.pop("_local", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.pop("_ah", None)
+        self.__dict__.setdefault("_naming", "uuid")
+        self._archive = None
+        self._local = threading.local()
 
     def set_archive_handler(self, archive_handler: Type[BaseArchiveHandler]):
-        self._ah = archive_handler
+        self._archive = archive_handler
 
     def get_uuid(self) -> str:
         # jsonpickle doesn't supply any info about the parents to the
         # handlers so we need to just use a random uuid
         return str(uuid.uuid1())
+
+    def check_appendable(self, file_name: str) -> None:
+        """Files named by their content cannot be changed in place."""
+        if CONTENT_HASH_NAME.fullmatch(file_name):
+            raise ValueError(
+                f"{file_name} is content addressed and cannot be appended to"
+            )
+
+    def claim_file(self, file_name: str) -> bool:
+        """Reference a file from the archive, returns False if it is already stored."""
+        return self._ah.claim_file(file_name)
+
+    def write_file(self, ext: str, write: Callable, mode: str = None) -> str:
+        """Write a file to the archive and return its name.
+
+        Args:
+            ext: the file extension.
+            write: called with an open file if `mode` is given, else with a local path
+                for writers that need one.
+            mode: the mode to open the file with. Writers which seek and read back what
+                they write (e.g. HDF5) use "w+b", they are given the local path of
+                archives which store files on disk and a spooled temporary file which is
+                streamed to the archive otherwise.
+        """
+        if self._naming == "hash":
+            return self._write_hashed(ext, write, mode)
+
+        file_name = self.get_uuid() + f".{ext}"
+        self.claim_file(file_name)
+        seekable = mode is not None and "+" in mode
+        if mode is None or seekable and self._ah.native_path(file_name) is not None:
+            with self._ah.file_path(file_name, mode="w") as file_path:
+                write(file_path)
+        elif seekable:
+            self._write_spooled(file_name, write)
+        else:
+            with self._ah.open_file(file_name, mode=mode) as open_file:
+                write(open_file)
+        return file_name
+
+    def _write_spooled(self, file_name: str, write: Callable) -> None:
+        """Write a file with a writer that needs to seek, see `write_file`."""
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode="w+b") as spool:
+            write(spool)
+            spool.seek(0)
+            with self._ah.open_file(file_name, mode="wb") as open_file:
+                shutil.copyfileobj(spool, open_file, 1 << 20)
+
+    def _write_hashed(self, ext: str, write: Callable, mode: str = None) -> str:
+        """Write to a temporary file which is only added to the archive if no file
+        with the same content hash is stored already.
+        """
+        with tempfile.TemporaryDirectory(prefix="dataicer_") as tmp_dir:
+            tmp_path = pathlib.Path(tmp_dir) / f"content.{ext}"
+            if mode is None or "+" in mode:
+                write(tmp_path)
+            else:
+                with open(tmp_path, mode) as open_file:
+                    write(open_file)
+
+            digest = hashlib.blake2b(digest_size=20)
+            with open(tmp_path, "rb") as open_file:
+                for block in iter(lambda: open_file.read(1 << 20), b""):
+                    digest.update(block)
+
+            file_name = f"{digest.hexdigest()}.{ext}"
+            if self.claim_file(file_name):
+                with self._ah.file_path(file_name, mode="w") as file_path:
+                    shutil.move(tmp_path, file_path)
+        return file_name
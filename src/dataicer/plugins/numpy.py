@@ -1,11 +1,22 @@
 """This plugin is modelled on jsonpickles own implementation of a numpy extension for saving ndarray to json txt.
 
-We however use numpy save and load for txt/binary files.
+We however use numpy save and load for txt/binary files, write the raw array buffer, or
+store arrays as independently compressed chunks.
 """
+
 from __future__ import absolute_import
 import ast
+import bz2
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+import hashlib
+import itertools
+import lzma
+import math
+import os
 import sys
-from typing import Literal
+from typing import Callable, Literal, Sequence, Tuple
+import zlib
 
 import numpy as np
 
@@ -16,6 +27,8 @@ from jsonpickle import compat
 from .file import BaseFileHandler
 
 native_byteorder = "<" if sys.byteorder == "little" else ">"
+# arrays which are not contiguous are copied through a buffer of this size when written
+BUFFER_SIZE = 2**24
 
 
 def get_byteorder(arr):
@@ -24,10 +37,281 @@ def get_byteorder(arr):
     return native_byteorder if byteorder == "=" else byteorder
 
 
+def array_digest(arr: np.ndarray, *extra) -> str:
+    """BLAKE2 hash of the dtype, shape and contents of an array.
+
+    Non-contiguous arrays are hashed in C order blocks to avoid copying the whole array.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr((arr.dtype.descr, arr.shape) + extra).encode())
+    for block in iter_buffers(arr, "C"):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def iter_buffers(arr: np.ndarray, order: str = None, buffer_size: int = BUFFER_SIZE):
+    """The memory of an array as byte arrays, without copying contiguous arrays.
+
+    Arrays which are not contiguous in `order` are copied through a single buffer of
+    about `buffer_size` bytes, the buffer is reused so each block must be consumed
+    before the next one is taken.
+
+    Args:
+        arr: the array.
+        order: "C" or "F", uses the memory order of the array (see `raw_order`) if None.
+        buffer_size: the size of the copy buffer in bytes.
+    """
+    if order is None:
+        order = raw_order(arr)
+    if order == "F":
+        # the Fortran order of an array is the C order of its transpose
+        arr = arr.T
+    if arr.flags.c_contiguous:
+        yield _byte_view(arr)
+        return
+
+    rows = buffer_size // max(1, arr[0].nbytes)
+    if rows == 0:
+        for row in arr:
+            yield from iter_buffers(row, "C", buffer_size)
+        return
+    buffer = np.empty((min(rows, arr.shape[0]),) + arr.shape[1:], dtype=arr.dtype)
+    for i in range(0, arr.shape[0], rows):
+        block = buffer[: min(rows, arr.shape[0] - i)]
+        np.copyto(block, arr[i : i + rows])
+        yield _byte_view(block)
+
+
+def get_codec(
+    name: Literal["zlib", "lzma", "bz2", "blosc", "zstd", "none"],
+    level: int = None,
+    typesize: int = 1,
+) -> Tuple[Callable, Callable]:
+    """Compress and decompress functions for array chunks.
+
+    zlib, lzma and bz2 are in the standard library, blosc needs `blosc` and zstd needs
+    `zstandard` (or Python 3.14+).
+    """
+    if name == "zlib":
+        level = -1 if level is None else level
+        return lambda buffer: zlib.compress(buffer, level), zlib.decompress
+    if name == "lzma":
+        return lambda buffer: lzma.compress(buffer, preset=level), lzma.decompress
+    if name == "bz2":
+        level = 9 if level is None else level
+        return lambda buffer: bz2.compress(buffer, level), bz2.decompress
+    if name == "blosc":
+        import blosc
+
+        level = 5 if level is None else level
+        return (
+            lambda buffer: blosc.compress(buffer, typesize=typesize, clevel=level),
+            blosc.decompress,
+        )
+    if name == "zstd":
+        level = 3 if level is None else level
+        try:
+            from compression import zstd
+
+            return lambda buffer: zstd.compress(buffer, level), zstd.decompress
+        except ImportError:
+            import zstandard
+
+        return (
+            lambda buffer: zstandard.ZstdCompressor(level).compress(buffer),
+            lambda buffer: zstandard.ZstdDecompressor().decompress(buffer),
+        )
+    if name == "none":
+        return bytes, bytes
+    raise ValueError(f"Unknown compressor {name}")
+
+
+def auto_chunks(shape: Sequence[int], itemsize: int, target: int = 2**20) -> tuple:
+    """Chunk shape of about `target` bytes, the largest axis is halved until it fits."""
+    chunks = [max(1, size) for size in shape]
+    while math.prod(chunks) * itemsize > target and max(chunks) > 1:
+        axis = chunks.index(max(chunks))
+        chunks[axis] = math.ceil(chunks[axis] / 2)
+    return tuple(chunks)
+
+
+def _axis_region(item, size: int):
+    """The range of an axis read for an index item and the index of that range.
+
+    Returns None if the item is not an integer or slice.
+    """
+    if isinstance(item, slice):
+        selected = range(*item.indices(size))
+        if not selected:
+            return 0, 0, slice(0, 0)
+        if selected.step > 0:
+            low, high = selected[0], selected[-1] + 1
+            return low, high, slice(0, high - low, selected.step)
+        low, high = selected[-1], selected[0] + 1
+        return low, high, slice(high - low - 1, None, selected.step)
+    if isinstance(item, (int, np.integer)):
+        row = int(item) + size if item < 0 else int(item)
+        if not 0 <= row < size:
+            raise IndexError(f"index {item} is out of bounds for size {size}")
+        return row, row + 1, 0
+    return None
+
+
+def read_npy_slice(open_file, index):
+    """Read part of an npy file from a seekable file.
+
+    Only the rows of the first axis selected by the index are read, Fortran ordered
+    arrays and indexes starting with an array are read in full.
+    """
+    version = np.lib.format.read_magic(open_file)
+    read_header = {
+        (1, 0): np.lib.format.read_array_header_1_0,
+        (2, 0): np.lib.format.read_array_header_2_0,
+    }.get(version)
+    if read_header is not None:
+        shape, fortran_order, dtype = read_header(open_file)
+
+    index = index if isinstance(index, tuple) else (index,)
+    first = index[0] if index else slice(None)
+    region = None
+    if read_header is not None and shape and not fortran_order and not dtype.hasobject:
+        region = _axis_region(first, shape[0])
+    if region is None:
+        open_file.seek(0)
+        return np.load(open_file, allow_pickle=False)[index]
+    return _read_rows(open_file, open_file.tell(), shape, dtype, region, index)
+
+
+def _read_rows(open_file, offset: int, shape, dtype, region, index):
+    """Read the rows of a C ordered array in a file which start at `offset`."""
+    low, high, local = region
+    row_size = dtype.itemsize * math.prod(shape[1:])
+    open_file.seek(offset + low * row_size)
+    block = np.empty((high - low,) + tuple(shape[1:]), dtype=dtype)
+    readinto_array(open_file, block)
+    return block[(local,) + index[1:]]
+
+
+def _byte_view(arr: np.ndarray) -> np.ndarray:
+    """The memory of a C or Fortran contiguous array as bytes, in memory order."""
+    return arr.reshape(-1, order="A").view(np.uint8)
+
+
+def raw_order(arr: np.ndarray) -> str:
+    """The order raw arrays are written in, see `write_raw`."""
+    return "F" if arr.flags.f_contiguous and not arr.flags.c_contiguous else "C"
+
+
+def readinto_array(open_file, arr: np.ndarray) -> np.ndarray:
+    """Fill a contiguous array from a binary file without an intermediate copy."""
+    view, read = memoryview(_byte_view(arr)), 0
+    while read < arr.nbytes:
+        count = open_file.readinto(view[read:])
+        if not count:
+            raise ValueError("Array file is truncated")
+        read += count
+    return arr
+
+
+def write_raw(open_file, arr: np.ndarray, order: str = None) -> None:
+    """Write the memory of an array to a binary file, see `iter_buffers`.
+
+    Contiguous arrays are written straight from their buffer, others through a
+    bounded buffer, so writing never holds a second copy of the array.
+    """
+    for block in iter_buffers(arr, order):
+        open_file.write(block)
+
+
+def write_npy(open_file, arr: np.ndarray) -> None:
+    """Write an array as an npy file, like `np.save` without copying the array."""
+    if arr.dtype.hasobject:
+        raise ValueError("Object arrays cannot be saved when allow_pickle=False")
+    header = np.lib.format.header_data_from_array_1_0(arr)
+    try:
+        np.lib.format.write_array_header_1_0(open_file, header)
+    except ValueError:
+        # very large structured dtypes need a newer header version
+        np.save(open_file, arr, allow_pickle=False)
+        return
+    write_raw(open_file, arr, "F" if header["fortran_order"] else "C")
+
+
+def write_txt(open_file, arr: np.ndarray) -> None:
+    """Write the values of an array in C order as a single column of text.
+
+    Any ndim can be saved this way, arrays are written in blocks so they are not raveled.
+    """
+    for block in iter_buffers(arr, "C"):
+        np.savetxt(open_file, block.view(arr.dtype))
+
+
+def append_npy(path, arr: np.ndarray) -> None:
+    """Append rows to an npy file in place.
+
+    The rows are written to the end of the file and then the shape in the header is
+    updated, numpy pads the header so the first axis can grow without moving the data.
+    """
+    with open(path, "r+b") as open_file:
+        version = np.lib.format.read_magic(open_file)
+        read_header = {
+            (1, 0): np.lib.format.read_array_header_1_0,
+            (2, 0): np.lib.format.read_array_header_2_0,
+        }.get(version)
+        if read_header is None:
+            raise ValueError(f"npy files of version {version} cannot be appended to")
+        shape, fortran_order, dtype = read_header(open_file)
+        offset = open_file.tell()
+
+        if not shape or (fortran_order and len(shape) > 1):
+            raise ValueError("Only C ordered npy files can be appended to")
+        if tuple(arr.shape[1:]) != tuple(shape[1:]):
+            raise ValueError(f"Cannot append an array of shape {arr.shape} to {shape}")
+        if not np.can_cast(arr.dtype, dtype, casting="safe"):
+            raise ValueError(f"Cannot append an array of {arr.dtype} to {dtype}")
+
+        new_shape = (shape[0] + arr.shape[0],) + tuple(shape[1:])
+        header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (
+            np.lib.format.dtype_to_descr(dtype),
+            new_shape,
+        )
+        start = 10 if version == (1, 0) else 12
+        if len(header) + 1 > offset - start:
+            raise ValueError("The npy header has no room for the new shape")
+
+        open_file.seek(0, os.SEEK_END)
+        write_raw(open_file, arr.astype(dtype, copy=False), "C")
+        open_file.seek(start)
+        open_file.write(header.ljust(offset - start - 1).encode("latin1") + b"\n")
+
+
 class NumpyBaseHandler(BaseHandler, BaseFileHandler):
-    def __init__(self, mode: Literal["txt", "npy", "npz"] = "txt"):
-        BaseFileHandler.__init__(self)
+    def __init__(
+        self,
+        mode: Literal["raw", "txt", "npy", "npz", "chunked"] = "raw",
+        naming: Literal["uuid", "hash"] = "uuid",
+        compressor: Literal["zlib", "lzma", "bz2", "blosc", "zstd", "none"] = "zlib",
+        level: int = None,
+        chunks: Sequence[int] = None,
+        workers: int = 4,
+    ):
+        """
+
+        Args:
+            mode: the file format to store arrays with, "raw" stores the array buffer
+                as is and "chunked" stores an array as independently compressed chunks.
+            naming: "hash" to only store identical arrays once, see `BaseFileHandler`.
+            compressor: the chunk compressor for the "chunked" mode.
+            level: the compression level, uses the compressor default if None.
+            chunks: the chunk shape, chunks of about 1 MiB are used if None.
+            workers: threads to compress/decompress chunks with.
+        """
+        BaseFileHandler.__init__(self, naming=naming)
         self._mode = mode
+        self._compressor = compressor
+        self._level = level
+        self._chunks = chunks
+        self._workers = workers
 
     def flatten_dtype(self, dtype, data):
         if hasattr(dtype, "tostring"):
@@ -45,12 +329,30 @@ class NumpyBaseHandler(BaseHandler, BaseFileHandler):
             dtype = ast.literal_eval(dtype)
         return np.dtype(dtype)
 
-    def get_file_id(self):
+    def get_file_id(self, obj=None):
+        # objects have no buffer to hash, the mode stores them in the JSON or refuses them
+        if self._naming == "hash" and obj is not None and not obj.dtype.hasobject:
+            # raw files of C and Fortran ordered copies of an array differ
+            extra = (raw_order(obj),) if self._mode == "raw" else ()
+            return array_digest(obj, self._mode, *extra) + f".{self._mode}"
         return self.get_uuid() + f".{self._mode}"
 
 
 class NumpyNDArrayHandler(NumpyBaseHandler):
-    """Stores arrays as .npy files"""
+    """Stores arrays as .raw or .npy files
+
+    Arrays stored "raw" are the array buffer in memory order, the dtype, shape and order
+    are kept in the JSON. They are written and read without copies and keep their dtype.
+
+    Arrays stored as raw or npy in a `DirectoryHandler` can be memory mapped on restore
+    with the `mmap_mode` restore option of the archive or key.
+
+    With "hash" naming files are named by a hash of the array, identical arrays are
+    only written once.
+
+    Arrays stored "chunked" are split into chunks which are compressed and written in
+    parallel, partial reads (see `restore_slice`) only decompress the chunks they need.
+    """
 
     def flatten_flags(self, obj, data):
         if obj.flags.writeable is False:
@@ -61,38 +363,198 @@ class NumpyNDArrayHandler(NumpyBaseHandler):
             arr.flags.writeable = False
 
     def flatten(self, obj, data):
+        if self._mode == "raw" and obj.dtype.hasobject:
+            # objects have no buffer to store, they are stored in the JSON
+            return jpxnp.NumpyNDArrayHandlerView()(self.context).flatten(obj, data)
+
         self.flatten_dtype(obj.dtype.newbyteorder("N"), data)
         self.flatten_flags(obj, data)
-        data["file_uuid"] = self.get_file_id()
+        data["file_uuid"] = self.get_file_id(obj)
         data["shape"] = obj.shape
         data["mode"] = self._mode
+        if self._mode == "raw":
+            data["raw_dtype"] = np.lib.format.dtype_to_descr(obj.dtype)
+            data["order"] = raw_order(obj)
+
+        if not self.claim_file(data["file_uuid"]):
+            return data
 
         if self._mode in ["npy", "npz"]:
             with self._ah.open_file(data["file_uuid"], mode="wb") as open_file:
                 if self._mode == "npy":
-                    np.save(open_file, obj, allow_pickle=False)
+                    write_npy(open_file, obj)
                 elif self._mode == "npz":
                     np.savez(open_file, obj)
         elif self._mode == "txt":
             with self._ah.open_file(data["file_uuid"], mode="w") as open_file:
-                np.savetxt(
-                    open_file,
-                    obj.ravel(),  # ravel object to any ndim can be saved to txt (usually only 1d/2d)
-                )
+                write_txt(open_file, obj)
+        elif self._mode == "raw":
+            with self._ah.open_file(data["file_uuid"], mode="wb") as open_file:
+                write_raw(open_file, obj)
+        elif self._mode == "chunked":
+            self.flatten_chunks(obj, data)
 
         return data
 
+    def restore_raw(self, data):
+        """Read a raw array, the dtype keeps the byte order of the stored array."""
+        dtype = np.lib.format.descr_to_dtype(data["raw_dtype"])
+        arr = np.empty(data["shape"], dtype=dtype, order=data["order"])
+        with self._ah.open_file(data["file_uuid"], mode="rb") as open_file:
+            return readinto_array(open_file, arr)
+
+    def _map_chunks(self, func: Callable, chunk_ids) -> None:
+        if self._workers and self._workers > 1:
+            # run in copies of the current context to keep the archive session and stats
+            context = copy_context()
+            with ThreadPoolExecutor(self._workers) as executor:
+                list(
+                    executor.map(
+                        lambda chunk_id: context.copy().run(func, chunk_id), chunk_ids
+                    )
+                )
+        else:
+            for chunk_id in chunk_ids:
+                func(chunk_id)
+
+    def flatten_chunks(self, obj, data):
+        """Write an array as compressed chunks named `<file_uuid>/<i>.<j>...`."""
+        if obj.dtype.hasobject:
+            raise ValueError("Arrays of objects cannot be stored chunked")
+        chunks = (
+            auto_chunks(obj.shape, obj.dtype.itemsize)
+            if self._chunks is None
+            else tuple(self._chunks)
+        )
+        data["chunks"] = chunks
+        data["chunk_dtype"] = np.lib.format.dtype_to_descr(obj.dtype)
+        data["compressor"] = self._compressor
+        self.write_chunks(obj, data)
+
+    def write_chunks(self, obj, data, first_chunk: int = 0):
+        """Compress and write the chunks of obj, offset by `first_chunk` along axis 0."""
+        chunks = data["chunks"]
+        compress, _ = get_codec(data["compressor"], self._level, obj.dtype.itemsize)
+
+        def write_chunk(chunk_id):
+            region = tuple(
+                slice(i * size, (i + 1) * size) for i, size in zip(chunk_id, chunks)
+            )
+            block = np.ascontiguousarray(obj[region]).reshape(-1).view(np.uint8)
+            payload = compress(block)
+            if chunk_id:
+                chunk_id = (chunk_id[0] + first_chunk,) + chunk_id[1:]
+            name = f"{data['file_uuid']}/{_chunk_name(chunk_id)}"
+            with self._ah.open_file(name, mode="wb") as open_file:
+                open_file.write(payload)
+
+        grid = [
+            range(math.ceil(size / chunk)) for size, chunk in zip(obj.shape, chunks)
+        ]
+        self._map_chunks(write_chunk, itertools.product(*grid))
+
+    def append_chunks(self, data, obj):
+        """Append rows to a chunked array, only the last partial row of chunks is rewritten."""
+        shape, chunks = data["shape"], data["chunks"]
+        dtype = np.lib.format.descr_to_dtype(data["chunk_dtype"])
+        if not np.can_cast(obj.dtype, dtype, casting="safe"):
+            raise ValueError(f"Cannot append an array of {obj.dtype} to {dtype}")
+        start = shape[0] - shape[0] % chunks[0]
+        tail = self.restore_chunks(
+            data, [(start, shape[0])] + [(0, size) for size in shape[1:]]
+        )
+        rows = np.concatenate([tail, obj.astype(dtype)])
+        self.write_chunks(rows, data, first_chunk=start // chunks[0])
+
+    def restore_chunks(self, data, region: Sequence[Tuple[int, int]] = None):
+        """Read the chunks of an array overlapping a region, (start, stop) for each axis."""
+        shape, chunks = data["shape"], data["chunks"]
+        dtype = np.lib.format.descr_to_dtype(data["chunk_dtype"])
+        if region is None:
+            region = [(0, size) for size in shape]
+        out = np.empty([stop - start for start, stop in region], dtype=dtype)
+        _, decompress = get_codec(data["compressor"], typesize=dtype.itemsize)
+
+        def read_chunk(chunk_id):
+            name = f"{data['file_uuid']}/{_chunk_name(chunk_id)}"
+            with self._ah.open_file(name, mode="rb") as open_file:
+                payload = open_file.read()
+            bounds = [
+                (i * chunk, min((i + 1) * chunk, size))
+                for i, chunk, size in zip(chunk_id, chunks, shape)
+            ]
+            block = np.frombuffer(decompress(payload), dtype=dtype)
+            block = block.reshape([stop - start for start, stop in bounds])
+            src, dst = [], []
+            for (low, high), (start, stop) in zip(bounds, region):
+                src.append(slice(max(start, low) - low, min(stop, high) - low))
+                dst.append(slice(max(start, low) - start, min(stop, high) - start))
+            out[tuple(dst)] = block[tuple(src)]
+
+        grid = [
+            range(start // chunk, math.ceil(stop / chunk)) if stop > start else range(0)
+            for (start, stop), chunk in zip(region, chunks)
+        ]
+        self._map_chunks(read_chunk, itertools.product(*grid))
+        return out
+
+    def restore_mmap(self, data):
+        """Memory map a npy file if requested and the archive stores it on disk.
+
+        Uses the `mmap_mode` restore option, "r" gives read only arrays and "c"
+        copy-on-write arrays. Returns None if the array cannot be memory mapped.
+        """
+        mmap_mode = self._ah.get_restore_option("mmap_mode")
+        if not mmap_mode or data["mode"] not in ("npy", "raw"):
+            return None
+        if mmap_mode not in ("r", "c"):
+            raise ValueError(f"mmap_mode must be 'r' or 'c' not {mmap_mode}")
+
+        path = self._ah.native_path(data["file_uuid"])
+        if path is None:
+            return None
+        if data["mode"] == "raw":
+            return self.memmap_raw(data, path, mmap_mode)
+        return np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+
+    def memmap_raw(self, data, path, mmap_mode="r"):
+        dtype = np.lib.format.descr_to_dtype(data["raw_dtype"])
+        if math.prod(data["shape"]) == 0:
+            # empty files cannot be memory mapped
+            return np.empty(data["shape"], dtype=dtype, order=data["order"])
+        return np.memmap(
+            path,
+            dtype=dtype,
+            mode=mmap_mode,
+            shape=tuple(data["shape"]),
+            order=data["order"],
+        )
+
     def restore(self, data):
+        if "mode" not in data:
+            return jpxnp.NumpyNDArrayHandlerView()(self.context).restore(data)
         mode = data["mode"]
 
         if mode in ["npy", "npz"]:
-            with self._ah.open_file(data["file_uuid"], mode="rb") as open_file:
-                arr = np.load(open_file)  # @, dtype=self.restore_dtype(data))
-                if mode == "npz":
-                    arr = arr["arr_0"]
+            arr = self.restore_mmap(data)
+            if arr is None:
+                with self._ah.open_file(data["file_uuid"], mode="rb") as open_file:
+                    arr = np.load(open_file)  # @, dtype=self.restore_dtype(data))
+                    if mode == "npz":
+                        arr = arr["arr_0"]
+        elif mode == "raw":
+            arr = self.restore_mmap(data)
+            if arr is None:
+                arr = self.restore_raw(data)
         elif mode == "txt":
             with self._ah.open_file(data["file_uuid"], mode="r") as open_file:
-                arr = np.loadtxt(open_file)  # @@, dtype=self.restore_dtype(data))
+                arr = np.loadtxt(open_file)
+            # values are written as floats, restore the stored dtype if it is numeric
+            dtype = self.restore_dtype(data)
+            if dtype.kind in "biuf":
+                arr = arr.astype(dtype, copy=False)
+        elif mode == "chunked":
+            arr = self.restore_chunks(data)
 
         shape = data.get("shape", None)
         if shape is not None:
@@ -101,11 +563,123 @@ class NumpyNDArrayHandler(NumpyBaseHandler):
         self.restore_flags(data, arr)
         return arr
 
+    def restore_slice(self, data, index):
+        """Restore part of an array.
+
+        npy files are memory mapped if stored on the local filesystem else only the needed
+        rows are read from the file. Only the chunks overlapping integer and slice indexes
+        of chunked arrays are read. Other modes are restored in full and then indexed.
+        """
+        if data["mode"] == "chunked":
+            return self.restore_chunk_slice(data, index)
+        if data["mode"] == "raw":
+            return self.restore_raw_slice(data, index)
+        if data["mode"] != "npy":
+            return self.restore(data)[index]
+
+        path = self._ah.native_path(data["file_uuid"])
+        if path is not None:
+            arr = np.array(np.load(path, mmap_mode="r", allow_pickle=False)[index])
+        else:
+            with self._ah.open_file(data["file_uuid"], mode="rb") as open_file:
+                arr = read_npy_slice(open_file, index)
+        self.restore_flags(data, arr)
+        return arr
+
+    def restore_raw_slice(self, data, index):
+        """Restore part of a raw array, see `restore_slice`."""
+        path = self._ah.native_path(data["file_uuid"])
+        if path is not None and math.prod(data["shape"]):
+            arr = np.array(self.memmap_raw(data, path)[index])
+            self.restore_flags(data, arr)
+            return arr
+
+        index = index if isinstance(index, tuple) else (index,)
+        shape = data["shape"]
+        region = None
+        if shape and data["order"] == "C":
+            region = _axis_region(index[0] if index else slice(None), shape[0])
+        if region is None:
+            return self.restore(data)[index]
+
+        dtype = np.lib.format.descr_to_dtype(data["raw_dtype"])
+        with self._ah.open_file(data["file_uuid"], mode="rb") as open_file:
+            arr = _read_rows(open_file, 0, shape, dtype, region, index)
+        self.restore_flags(data, arr)
+        return arr
+
+    def append(self, data, obj):
+        """Append rows to a stored array along the first axis.
+
+        npy files are extended in place, raw (C ordered) and txt files have values added
+        to the end and only the last row of chunks of a chunked array is rewritten.
+        """
+        self.check_appendable(data["file_uuid"])
+        obj = np.asarray(obj)
+        shape = list(data["shape"])
+        if not shape or list(obj.shape[1:]) != shape[1:]:
+            raise ValueError(f"Cannot append an array of shape {obj.shape} to {shape}")
+
+        mode = data["mode"]
+        if mode == "npy":
+            with self._ah.file_path(data["file_uuid"], mode="a") as file_path:
+                append_npy(file_path, obj)
+        elif mode == "raw":
+            dtype = np.lib.format.descr_to_dtype(data["raw_dtype"])
+            if data["order"] != "C" and len(shape) > 1:
+                raise ValueError("Only C ordered raw arrays can be appended to")
+            if not np.can_cast(obj.dtype, dtype, casting="safe"):
+                raise ValueError(f"Cannot append an array of {obj.dtype} to {dtype}")
+            with self._ah.file_path(data["file_uuid"], mode="a") as file_path:
+                with open(file_path, "ab") as open_file:
+                    write_raw(open_file, obj.astype(dtype, copy=False), "C")
+        elif mode == "txt":
+            dtype = self.restore_dtype(data)
+            if not np.can_cast(obj.dtype, dtype, casting="safe"):
+                raise ValueError(f"Cannot append an array of {obj.dtype} to {dtype}")
+            with self._ah.file_path(data["file_uuid"], mode="a") as file_path:
+                with open(file_path, "a") as open_file:
+                    write_txt(open_file, obj)
+        elif mode == "chunked":
+            self.append_chunks(data, obj)
+        else:
+            raise ValueError(f"Arrays stored as {mode} cannot be appended to")
+
+        data["shape"] = [shape[0] + obj.shape[0]] + shape[1:]
+        return data
+
+    def restore_chunk_slice(self, data, index):
+        """Restore part of a chunked array, only the chunks overlapping the index are read."""
+        index = index if isinstance(index, tuple) else (index,)
+        shape = data["shape"]
+        regions = [None]
+        if len(index) <= len(shape):
+            regions = [_axis_region(item, size) for item, size in zip(index, shape)]
+            regions += [(0, size, slice(None)) for size in shape[len(index) :]]
+        if any(region is None for region in regions):
+            return self.restore(data)[index]
+
+        arr = self.restore_chunks(data, [(low, high) for low, high, _ in regions])
+        arr = arr[tuple(local for _, _, local in regions)]
+        self.restore_flags(data, arr)
+        return arr
+
+
+def _chunk_name(chunk_id: tuple) -> str:
+    return ".".join(str(i) for i in chunk_id) or "0"
+
 
 def get_numpy_handlers(
-    array_mode: Literal["txt", "npy", "npz", "json"] = "txt"
+    array_mode: Literal["raw", "txt", "npy", "npz", "chunked", "json"] = "raw",
+    naming: Literal["uuid", "hash"] = "uuid",
 ) -> dict:
-    """Get a dictionary of numpy dtype, handler pairs."""
+    """Get a dictionary of numpy dtype, handler pairs.
+
+    Args:
+        array_mode: the file format to store arrays with, "raw" is the fastest and
+            keeps the dtype, "txt" stores arrays as float text.
+        naming: "hash" to only store identical arrays once, see `BaseFileHandler`.
+    """
     type_handlers = {
         np.dtype: jpxnp.NumpyDTypeHandler,
         np.generic: jpxnp.NumpyGenericHandler,
@@ -118,5 +692,5 @@ def get_numpy_handlers(
     if array_mode == "json":
         type_handlers[np.ndarray] = jpxnp.NumpyNDArrayHandlerView()
     else:
-        type_handlers[np.ndarray] = NumpyNDArrayHandler(mode=array_mode)
+        type_handlers[np.ndarray] = NumpyNDArrayHandler(mode=array_mode, naming=naming)
     return type_handlers
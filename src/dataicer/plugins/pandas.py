@@ -1,6 +1,11 @@
 """This plugin is modelled on jsonpickles extensions.
 
-Instead of saving pandas DataFrames to json they are saved to either CSV or HDF files.
+Instead of saving pandas DataFrames to json they are saved to either CSV, HDF, Parquet
+or Feather (Arrow IPC) files. Parquet and Feather require `pyarrow`.
+
+Series and Index values are saved to npy files, categoricals as their codes and
+datetimes as int64. Values without a binary representation (e.g. strings) fall back to
+the jsonpickle extensions.
 """
 
 from typing import Literal, Type
@@ -8,25 +13,286 @@ import jsonpickle as jp
 from jsonpickle.handlers import BaseHandler
 import jsonpickle.ext.pandas as jpxpd
 
+import numpy as np
 import pandas as pd
 
 from .file import BaseFileHandler
-from .numpy import get_numpy_handlers
+from .numpy import append_npy, get_numpy_handlers, write_npy
+
+
+def _csv_read_dtypes(dtypes: dict):
+    """Split stored column dtypes into `pd.read_csv` dtype and parse_dates arguments.
+
+    Datetimes are parsed by the reader, timedeltas, periods and intervals cannot be
+    parsed by `pd.read_csv` and are left to be converted after reading.
+    """
+    read_dtypes = dict()
+    parse_dates = list()
+    for key, dtype in dtypes.items():
+        kind = getattr(pd.api.types.pandas_dtype(dtype), "kind", "O")
+        if kind == "M":
+            parse_dates.append(key)
+        elif kind != "m" and not isinstance(
+            pd.api.types.pandas_dtype(dtype), (pd.PeriodDtype, pd.IntervalDtype)
+        ):
+            read_dtypes[key] = dtype
+    return read_dtypes, parse_dates
+
+
+class PandasArrayHandler(BaseHandler, BaseFileHandler):
+    """Base handler for pandas objects with values stored as npy files."""
+
+    def __init__(self, naming: Literal["uuid", "hash"] = "uuid"):
+        """
+
+        Args:
+            naming: "hash" to only store identical files once, see `BaseFileHandler`.
+        """
+        BaseFileHandler.__init__(self, naming=naming)
+
+    def write_array(self, arr: np.ndarray) -> str:
+        """Write an array to a npy file and return the file name."""
+        return self.write_file("npy", lambda open_file: write_npy(open_file, arr), "wb")
+
+    def read_array(self, file_name: str) -> np.ndarray:
+        with self._ah.open_file(file_name, mode="rb") as open_file:
+            return np.load(open_file, allow_pickle=False)
+
+    @staticmethod
+    def binary_values(obj):
+        """The values of a Series or Index as a numpy array to store or None if they
+        have no binary form.
+
+        Categoricals are stored as their codes and timezone aware datetimes as int64.
+        """
+        dtype = obj.dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            return np.asarray(obj.array.codes)
+        if isinstance(dtype, pd.DatetimeTZDtype):
+            # the timezone has to be restored from the dtype name
+            if pd.api.types.pandas_dtype(str(dtype)) != dtype:
+                return None
+            return np.asarray(obj.array.asi8)
+        if isinstance(dtype, np.dtype) and dtype.kind in "biufcmM":
+            return np.asarray(obj)
+        return None
+
+    def flatten_values(self, obj, arr: np.ndarray, data: dict) -> dict:
+        """Store the binary values of a Series or Index, see `binary_values`."""
+        dtype = obj.dtype
+        data["values_dtype"] = str(dtype)
+        if isinstance(dtype, pd.CategoricalDtype):
+            data["categories"] = self.context.flatten(dtype.categories, reset=False)
+            data["ordered"] = dtype.ordered
+        data["file_uuid"] = self.write_array(arr)
+        return data
+
+    def restore_values(self, data: dict):
+        arr = self.read_array(data["file_uuid"])
+        dtype = data["values_dtype"]
+        if dtype == "category":
+            categories = self.context.restore(data["categories"], reset=False)
+            return pd.Categorical.from_codes(
+                arr, categories=categories, ordered=data["ordered"]
+            )
+        dtype = pd.api.types.pandas_dtype(dtype)
+        if isinstance(dtype, pd.DatetimeTZDtype):
+            index = pd.DatetimeIndex(arr.view(f"M8[{dtype.unit}]"), tz="UTC")
+            return index.tz_convert(dtype.tz).array
+        return arr
+
+
+class PandasIndexHandler(PandasArrayHandler):
+    """Stores Index values as npy files.
+
+    RangeIndexes are stored by their range and MultiIndexes by their levels and codes.
+    """
+
+    def flatten(self, obj, data):
+        if isinstance(obj, pd.RangeIndex):
+            data["range"] = [obj.start, obj.stop, obj.step]
+            data["name"] = obj.name
+            return data
+
+        if isinstance(obj, pd.MultiIndex):
+            data["levels"] = [
+                self.context.flatten(level, reset=False) for level in obj.levels
+            ]
+            data["names"] = list(obj.names)
+            data["file_uuid"] = self.write_array(np.stack(obj.codes))
+            return data
+
+        data["name"] = obj.name
+        arr = self.binary_values(obj)
+        if arr is None:
+            return jpxpd.PandasIndexHandler(self.context).flatten(obj, data)
+
+        if getattr(obj, "freq", None) is not None:
+            data["freq"] = obj.freqstr
+        return self.flatten_values(obj, arr, data)
+
+    def restore(self, data):
+        if "range" in data:
+            return pd.RangeIndex(*data["range"], name=data["name"])
+
+        if "levels" in data:
+            levels = [
+                self.context.restore(level, reset=False) for level in data["levels"]
+            ]
+            codes = self.read_array(data["file_uuid"])
+            return pd.MultiIndex(levels=levels, codes=list(codes), names=data["names"])
+
+        if "file_uuid" not in data:
+            # the jsonpickle extension restores names as tuples
+            index = jpxpd.PandasIndexHandler(self.context).restore(data)
+            return index.rename(data.get("name", index.name))
+
+        index = pd.Index(self.restore_values(data), name=data["name"])
+        if "freq" in data:
+            index = type(index)(index, freq=data["freq"])
+        return index
+
+    def append(self, data, obj):
+        """Append values to a stored Index and return its updated data.
+
+        Ranges which continue are extended and values stored as npy files are appended
+        to in place, other indexes are restored and stored again with the new values.
+        """
+        # restoring the stored index sets the context of this handler
+        pickler = self.context
+        if "range" in data:
+            start, stop, step = data["range"]
+            new_stop = stop + len(obj) * step
+            if obj.equals(pd.RangeIndex(stop, new_stop, step)):
+                data["range"] = [start, new_stop, step]
+                return data
+        elif self.append_values(data, obj):
+            return data
+
+        index = restore_index(data).append(obj)
+        return pickler.flatten(index, reset=False)
+
+    def append_values(self, data, obj) -> bool:
+        """Append to the npy file of an Index with the same dtype, returns False if the
+        values cannot be appended in place.
+        """
+        if "file_uuid" not in data or "levels" in data:
+            return False
+        dtype = data["values_dtype"]
+        arr = self.binary_values(obj)
+        if arr is None or dtype == "category" or dtype != str(obj.dtype):
+            return False
+        try:
+            self.check_appendable(data["file_uuid"])
+        except ValueError:
+            return False
+
+        with self._ah.file_path(data["file_uuid"], mode="a") as file_path:
+            keep_freq = "freq" in data and self.continues(file_path, data["freq"], obj)
+            try:
+                append_npy(file_path, arr)
+            except ValueError:
+                return False
+        if not keep_freq:
+            data.pop("freq", None)
+        return True
+
+    def continues(self, file_path, freq: str, obj) -> bool:
+        """Check the values of an Index continue the stored values at `freq`, only the
+        last stored value is read.
+        """
+        if not len(obj):
+            return True
+        if obj.freqstr != freq:
+            return False
+        stored = np.load(file_path, mmap_mode="r")
+        if not len(stored):
+            return True
+        previous = self.binary_values(obj[:1].shift(-1))
+        return int(previous.view("i8")[0]) == int(stored[-1:].view("i8")[0])
+
+
+class PandasSeriesHandler(PandasArrayHandler):
+    """Stores Series values as npy files, the index is stored by `PandasIndexHandler`."""
+
+    def flatten(self, obj, data):
+        arr = self.binary_values(obj)
+        if arr is None:
+            return jpxpd.PandasSeriesHandler(self.context).flatten(obj, data)
+
+        data["name"] = obj.name
+        data["index"] = self.context.flatten(obj.index, reset=False)
+        return self.flatten_values(obj, arr, data)
+
+    def restore(self, data):
+        if "file_uuid" not in data:
+            return jpxpd.PandasSeriesHandler(self.context).restore(data)
+
+        index = self.context.restore(data["index"], reset=False)
+        return pd.Series(self.restore_values(data), index=index, name=data["name"])
+
+
+def restore_index(data, context=None):
+    """Restore a DataFrame index, older archives store it as a JSON string."""
+    if isinstance(data, str):
+        return jp.decode(data)
+    if context is None:
+        context = jp.unpickler.Unpickler(keys=True)
+        return context.restore(data)
+    return context.restore(data, reset=False)
 
 
 class PandasDataFrameHandler(BaseHandler, BaseFileHandler):
-    def __init__(self, mode: Literal["csv", "h5"] = "csv", write_kwargs=None):
+    """Stores DataFrames as csv, h5, parquet or feather files.
+
+    Restore options:
+        columns: only restore this subset of the columns.
+        mmap_mode: memory map feather files stored on the local filesystem, reads
+            are zero-copy for uncompressed files.
+    """
+
+    def __init__(
+        self,
+        mode: Literal["csv", "h5", "parquet", "feather"] = "csv",
+        write_kwargs=None,
+        compression: str = None,
+        naming: Literal["uuid", "hash"] = "uuid",
+    ):
+        """
 
-        BaseFileHandler.__init__(self)
+        Args:
+            mode: the file format to store DataFrames with.
+            write_kwargs: extra keyword arguments for the pandas writer.
+            compression: compression for parquet (e.g. "snappy", "zstd") and feather
+                ("lz4", "zstd" or "uncompressed") files, uses the pyarrow default if None.
+            naming: "hash" to only store identical files once, see `BaseFileHandler`.
+        """
+        BaseFileHandler.__init__(self, naming=naming)
         self._mode = mode
         self._write_kwargs = write_kwargs
+        self._compression = compression
 
     def get_file_id(self):
         return self.get_uuid() + f".{self._mode}"
 
+    def write(self, obj, target, write_kwargs: dict):
+        """Write a DataFrame to an open file or a path (h5)."""
+        if self._mode == "csv":
+            obj.to_csv(target, **write_kwargs, index=False)
+
+        elif self._mode == "h5":
+            kwargs = dict(format="table")
+            kwargs.update(write_kwargs)
+            obj.to_hdf(target, key="dataicer_data", **kwargs)
+
+        elif self._mode == "parquet":
+            obj.to_parquet(target, **write_kwargs)
+
+        elif self._mode == "feather":
+            obj.to_feather(target, **write_kwargs)
+
     def flatten(self, obj, data):
 
-        data["file_uuid"] = self.get_file_id()
         data["shape"] = obj.shape
         data["mode"] = self._mode
 
@@ -35,7 +301,12 @@ class PandasDataFrameHandler(BaseHandler, BaseFileHandler):
         data["dtypes"] = self.context.flatten(
             {k: str(dtype[k]) for k in dtype}, reset=False
         )
-        data["index"] = jp.encode(obj.index)
+        # column order is not kept in the JSON dtypes
+        data["dtype_list"] = [str(dtype) for dtype in obj.dtypes]
+        if self._mode == "csv":
+            # the other formats store the index in the file
+            data["index"] = self.context.flatten(obj.index, reset=False)
+            data["index_names"] = list(obj.index.names)
         data["column_level_names"] = obj.columns.names
         data["header"] = list(range(len(obj.columns.names)))
 
@@ -43,57 +314,172 @@ class PandasDataFrameHandler(BaseHandler, BaseFileHandler):
             data["write_kwargs"] = {}
         else:
             data["write_kwargs"] = self._write_kwargs
+        if self._compression is not None and self._mode in ("parquet", "feather"):
+            data["write_kwargs"] = dict(
+                data["write_kwargs"], compression=self._compression
+            )
 
-        if self._mode == "csv":
-            with self._ah.open_file(data["file_uuid"], mode="w") as open_file:
-                obj.to_csv(open_file, **data["write_kwargs"], index=False)
+        file_mode = {"csv": "w", "h5": None}.get(self._mode, "wb")
+        data["file_uuid"] = self.write_file(
+            self._mode,
+            lambda target: self.write(obj, target, data["write_kwargs"]),
+            mode=file_mode,
+        )
+        return data
 
-        elif self._mode == "h5":
-            kwargs = dict(format="table")
-            kwargs.update(data["write_kwargs"])
-            obj.to_hdf(
-                self._ah.path / data["file_uuid"],
-                "dataicer_data",
-                **kwargs,
+    def append(self, data, obj):
+        """Append rows to a stored DataFrame in place.
+
+        h5 tables are appended to with their index and csv files have the new rows added,
+        only the new values are added to the stored index. Parquet and feather files
+        cannot be appended to.
+        """
+        self.check_appendable(data["file_uuid"])
+        mode = data["mode"]
+        if mode not in ("csv", "h5"):
+            raise ValueError(f"DataFrames stored as {mode} cannot be appended to")
+        rows, columns = data["shape"]
+        if obj.shape[1] != columns:
+            raise ValueError(
+                f"Cannot append a DataFrame with {obj.shape[1]} columns to {columns}"
             )
 
+        with self._ah.file_path(data["file_uuid"], mode="a") as file_path:
+            if mode == "csv":
+                with open(file_path, "a") as open_file:
+                    obj.to_csv(
+                        open_file, **data["write_kwargs"], index=False, header=False
+                    )
+            else:
+                kwargs = dict(format="table")
+                kwargs.update(data["write_kwargs"])
+                obj.to_hdf(file_path, key="dataicer_data", append=True, **kwargs)
+
+        if mode != "csv":
+            # older archives also stored the index of h5 files, it was never restored
+            data.pop("index", None)
+            data.pop("index_names", None)
+            data["shape"] = [rows + obj.shape[0], columns]
+            return data
+
+        index_handler = jp.handlers.get(type(obj.index))
+        if isinstance(data["index"], dict) and hasattr(index_handler, "append"):
+            data["index"] = index_handler(self.context).append(data["index"], obj.index)
+        else:
+            # older archives store the index as a JSON string, it is stored again and
+            # the archive releases the files of the old one
+            index = restore_index(data["index"]).append(obj.index)
+            data["index"] = self.context.flatten(index, reset=False)
+        data["shape"] = [rows + obj.shape[0], columns]
         return data
 
+    def restore_feather(self, data, columns=None):
+        """Read a feather file, memory mapped if requested and stored on disk."""
+        from pyarrow import feather
+
+        path = None
+        if self._ah.get_restore_option("mmap_mode"):
+            path = self._ah.native_path(data["file_uuid"])
+
+        if path is not None:
+            table = feather.read_table(str(path), columns=columns, memory_map=True)
+        else:
+            with self._ah.open_file(data["file_uuid"], mode="rb") as open_file:
+                table = feather.read_table(open_file, columns=columns)
+        return table.to_pandas()
+
+    def restore_csv(self, data, columns=None):
+        """Read a csv file, dtypes are given to the reader so columns are only parsed once.
+
+        The index and column level names are restored from the JSON data.
+        """
+        header = data.get("header", [0])
+        header = header[0] if len(header) == 1 else header
+        positional = "dtype_list" in data and columns is None
+        if "dtype_list" in data:
+            # map dtypes by position, labels of multi-level columns are not kept in the JSON
+            dtypes = dict(enumerate(data["dtype_list"]))
+            if columns is not None:
+                with self._ah.open_file(data["file_uuid"], mode="r") as open_file:
+                    labels = pd.read_csv(open_file, header=header, nrows=0).columns
+                dtypes = {
+                    labels[i]: dtype
+                    for i, dtype in dtypes.items()
+                    if labels[i] in columns
+                }
+        else:
+            dtypes = data["dtypes"]
+            if columns is not None:
+                dtypes = {k: v for k, v in dtypes.items() if k in columns}
+        read_dtypes, parse_dates = _csv_read_dtypes(dtypes)
+
+        kwargs = dict() if columns is None else dict(usecols=columns)
+        with self._ah.open_file(data["file_uuid"], mode="r") as open_file:
+            df = pd.read_csv(
+                open_file,
+                header=header,
+                dtype=read_dtypes,
+                parse_dates=parse_dates,
+                **kwargs,
+            )
+
+        if positional:
+            dtypes = {df.columns[i]: dtype for i, dtype in dtypes.items()}
+        convert = {
+            key: dtype
+            for key, dtype in dtypes.items()
+            if key in df.columns and str(df[key].dtype) != dtype
+        }
+        if convert:
+            df = df.astype(convert)
+
+        df.columns.names = data["column_level_names"]
+        index = restore_index(data["index"], self.context)
+        if len(index) == len(df):
+            if "index_names" in data:
+                index = index.set_names(data["index_names"])
+            df.index = index
+        return df
+
     def restore(self, data):
 
         mode = data["mode"]
-        dtypes = data["dtypes"]
-        index = jp.decode(data["index"])
-        column_level_names = data["column_level_names"]
+        columns = self._ah.get_restore_option("columns")
 
         if mode == "csv":
-            with self._ah.open_file(data["file_uuid"], mode="r") as open_file:
-                df = pd.read_csv(open_file)
-
-            for key, dtype in dtypes.items():
-                df[key] = df[key].astype(dtype=dtype)
+            df = self.restore_csv(data, columns=columns)
 
         elif mode == "h5":
-            df = pd.read_hdf(self._ah.path / data["file_uuid"])
+            with self._ah.file_path(data["file_uuid"], mode="r") as file_path:
+                df = pd.read_hdf(file_path, columns=columns)
+
+        elif mode == "parquet":
+            with self._ah.open_file(data["file_uuid"], mode="rb") as open_file:
+                df = pd.read_parquet(open_file, columns=columns)
+
+        elif mode == "feather":
+            df = self.restore_feather(data, columns=columns)
         return df
 
 
 def get_pandas_handlers(
-    mode: Literal["csv", "h5"] = "csv",
-    array_mode: Literal["txt", "npy", "npz", "json"] = "txt",
+    mode: Literal["csv", "h5", "parquet", "feather"] = "csv",
+    array_mode: Literal["raw", "txt", "npy", "npz", "chunked", "json"] = "raw",
+    naming: Literal["uuid", "hash"] = "uuid",
 ) -> dict:
     """Get a dictionary of pandas/numpy dtype, handler pairs.
 
-    Pandas Series can be saved to numpy objects to avoid putting them in the JSON file.
+    Pandas Series and Index values are saved to npy files to avoid putting them in the
+    JSON file. With "hash" naming identical DataFrames and arrays are only stored once.
     """
-    type_handlers = get_numpy_handlers(array_mode=array_mode)
+    type_handlers = get_numpy_handlers(array_mode=array_mode, naming=naming)
     type_handlers.update(
         {
-            pd.DataFrame: PandasDataFrameHandler(mode=mode),
-            pd.Series: jpxpd.PandasSeriesHandler,
-            pd.Index: jpxpd.PandasIndexHandler,
+            pd.DataFrame: PandasDataFrameHandler(mode=mode, naming=naming),
+            pd.Series: PandasSeriesHandler(naming=naming),
+            pd.Index: PandasIndexHandler(naming=naming),
             pd.PeriodIndex: jpxpd.PandasPeriodIndexHandler,
-            pd.MultiIndex: jpxpd.PandasMultiIndexHandler,
+            pd.MultiIndex: PandasIndexHandler(naming=naming),
             pd.Timestamp: jpxpd.PandasTimestampHandler,
             pd.Period: jpxpd.PandasPeriodHandler,
             pd.Interval: jpxpd.PandasIntervalHandler,
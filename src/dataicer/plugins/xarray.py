@@ -3,30 +3,151 @@
 Instead of saving pandas DataFrames to json they are saved to either CSV or HDF files.
 """
 
-from typing import Literal, Type
+from typing import Literal, Sequence, Type
+from contextlib import contextmanager
+import functools
+import io
 from jsonpickle.handlers import BaseHandler
 
 import xarray as xr
 
 from .file import BaseFileHandler
 
+# encoding keys needed to encode appended values like the stored values
+_APPEND_ENCODING = (
+    "units",
+    "calendar",
+    "dtype",
+    "_FillValue",
+    "scale_factor",
+    "add_offset",
+)
+
+
+@functools.lru_cache(maxsize=None)
+def writes_file_objects() -> bool:
+    """Check if xarray can write netCDF4 files to file objects with h5netcdf.
+
+    Older versions write netCDF3 with scipy instead and close the file object.
+    """
+    target = io.BytesIO()
+    try:
+        xr.Dataset().to_netcdf(target, engine="h5netcdf")
+    except (TypeError, ValueError):
+        return False
+    return not target.closed and target.getvalue().startswith(b"\x89HDF")
+
+
+def append_netcdf(path, obj, dim: str) -> int:
+    """Append to a netcdf file in place along an unlimited dimension.
+
+    The new values are encoded with the encoding of the stored variables, variables
+    without the dimension are not changed. Returns the new size of the dimension.
+    """
+    import h5netcdf
+
+    with xr.open_dataset(path, engine="h5netcdf") as stored:
+        if isinstance(obj, xr.DataArray):
+            obj = obj.to_dataset(name=list(stored.data_vars)[0])
+        encodings = {name: stored[name].encoding for name in stored.variables}
+        size = stored.sizes[dim]
+    new_size = size + obj.sizes[dim]
+
+    with h5netcdf.File(path, "a") as nc:
+        nc.resize_dimension(dim, new_size)
+        for name, var in obj.variables.items():
+            if dim not in var.dims:
+                continue
+            if name not in encodings:
+                raise ValueError(f"{name} is not a variable of the stored object")
+            var = var.copy(deep=False)
+            var.encoding = {
+                key: val
+                for key, val in encodings[name].items()
+                if key in _APPEND_ENCODING
+            }
+            encoded = xr.conventions.encode_cf_variable(var, name=name)
+            index = tuple(
+                slice(size, new_size) if var_dim == dim else slice(None)
+                for var_dim in encoded.dims
+            )
+            nc.variables[name][index] = encoded.values
+    return new_size
+
 
 class XarrayBaseHandler(BaseHandler, BaseFileHandler):
-    def __init__(self, mode: Literal["nc"] = "nc", write_kwargs=None):
-        BaseFileHandler.__init__(self)
+    def __init__(
+        self,
+        mode: Literal["nc"] = "nc",
+        write_kwargs=None,
+        naming: Literal["uuid", "hash"] = "uuid",
+        unlimited_dims: Sequence[str] = None,
+    ):
+        """
+
+        Args:
+            mode: the file format to store xarray objects with.
+            write_kwargs: extra keyword arguments for `to_netcdf`.
+            naming: "hash" to only store identical files once, see `BaseFileHandler`.
+            unlimited_dims: dimensions that can be appended to, see `append`.
+        """
+        BaseFileHandler.__init__(self, naming=naming)
 
         self._mode = mode
         self._write_kwargs = write_kwargs
+        self._unlimited_dims = unlimited_dims
+
+    def flatten_unlimited(self, obj, data):
+        """Store the unlimited dimensions the object has in the write arguments."""
+        unlimited = [dim for dim in self._unlimited_dims or [] if dim in obj.dims]
+        if unlimited:
+            data["unlimited_dims"] = unlimited
+            data["write_kwargs"]["unlimited_dims"] = unlimited
+
+    def append_file(self, data, obj, dim: str = None):
+        """Append to the stored file along an unlimited dimension.
+
+        Returns the dimension appended to and its new size.
+        """
+        self.check_appendable(data["file_uuid"])
+        unlimited = data.get("unlimited_dims", [])
+        dim = unlimited[0] if dim is None and unlimited else dim
+        if dim not in unlimited:
+            raise ValueError(
+                "xarray objects can only be appended to along one of the handler "
+                f"unlimited_dims, not {dim}"
+            )
+        with self._ah.file_path(data["file_uuid"], mode="a") as file_path:
+            return dim, append_netcdf(file_path, obj, dim)
 
     def get_file_id(self):
         return self.get_uuid() + f".{self._mode}"
 
+    def write_netcdf(self, obj, data) -> str:
+        """Write obj to the archive, through a file object if xarray supports it."""
+        return self.write_file(
+            self._mode,
+            lambda target: obj.to_netcdf(target, **data["write_kwargs"]),
+            mode="w+b" if writes_file_objects() else None,
+        )
+
+    @contextmanager
+    def open_source(self, data):
+        """The local path of the stored file or else the file opened from the archive.
+
+        Either can be opened lazily by the h5netcdf engine.
+        """
+        path = self._ah.native_path(data["file_uuid"])
+        if path is not None:
+            yield path
+        else:
+            with self._ah.open_file(data["file_uuid"], mode="rb") as open_file:
+                yield open_file
+
 
 class XarrayDataArrayHandler(XarrayBaseHandler):
     def flatten(self, obj, data):
 
-        data["file_uuid"] = self.get_file_id()
-
         meta = {
             "shape": obj.shape,
             "mode": self._mode,
@@ -40,13 +161,10 @@ class XarrayDataArrayHandler(XarrayBaseHandler):
         if self._write_kwargs:
             kwargs.update(data["write_kwargs"])
         data["write_kwargs"] = kwargs
+        self.flatten_unlimited(obj, data)
 
         if self._mode == "nc":
-            with self._ah.open_file(data["file_uuid"], mode="w") as open_file:
-                obj.to_netcdf(
-                    self._ah.path / data["file_uuid"],
-                    **data["write_kwargs"],
-                )
+            data["file_uuid"] = self.write_netcdf(obj, data)
 
         return data
 
@@ -55,15 +173,37 @@ class XarrayDataArrayHandler(XarrayBaseHandler):
         mode = data["mode"]
 
         if mode == "nc":
-            da = xr.open_dataarray(self._ah.path / data["file_uuid"])
+            path = self._ah.native_path(data["file_uuid"])
+            if path is not None:
+                return xr.open_dataarray(path, engine="h5netcdf")
+            # files in an archive are closed after restoring so are loaded
+            with self._ah.open_file(data["file_uuid"], mode="rb") as open_file:
+                da = xr.load_dataarray(open_file, engine="h5netcdf")
         return da
 
+    def restore_slice(self, data, index):
+        """Restore part of a DataArray, only the selected data is read from the file.
+
+        The index is a positional index or a dict of dimension names and indexes.
+        """
+        with self.open_source(data) as source:
+            with xr.open_dataarray(source, engine="h5netcdf") as da:
+                if isinstance(index, dict):
+                    return da.isel(index).load()
+                return da[index].load()
+
+    def append(self, data, obj, dim: str = None):
+        """Append a DataArray to the stored DataArray along an unlimited dimension."""
+        dim, size = self.append_file(data, obj, dim)
+        shape = list(data["shape"])
+        shape[list(data["dims"]).index(dim)] = size
+        data["shape"] = shape
+        return data
+
 
 class XarrayDatasetHandler(XarrayBaseHandler):
     def flatten(self, obj, data):
 
-        data["file_uuid"] = self.get_file_id()
-
         meta = {
             "info": str(obj.info()),
             "mode": self._mode,
@@ -78,13 +218,10 @@ class XarrayDatasetHandler(XarrayBaseHandler):
         if self._write_kwargs:
             kwargs.update(data["write_kwargs"])
         data["write_kwargs"] = kwargs
+        self.flatten_unlimited(obj, data)
 
         if self._mode == "nc":
-            with self._ah.open_file(data["file_uuid"], mode="w") as open_file:
-                obj.to_netcdf(
-                    self._ah.path / data["file_uuid"],
-                    **data["write_kwargs"],
-                )
+            data["file_uuid"] = self.write_netcdf(obj, data)
 
         return data
 
@@ -93,14 +230,35 @@ class XarrayDatasetHandler(XarrayBaseHandler):
         mode = data["mode"]
 
         if mode == "nc":
-            ds = xr.open_dataset(self._ah.path / data["file_uuid"])
+            path = self._ah.native_path(data["file_uuid"])
+            if path is not None:
+                return xr.open_dataset(path, engine="h5netcdf")
+            with self._ah.open_file(data["file_uuid"], mode="rb") as open_file:
+                ds = xr.load_dataset(open_file, engine="h5netcdf")
         return ds
 
+    def restore_slice(self, data, index: dict):
+        """Restore part of a Dataset, only the selected data is read from the file.
+
+        The index is a dict of dimension names and indexes.
+        """
+        with self.open_source(data) as source:
+            with xr.open_dataset(source, engine="h5netcdf") as ds:
+                return ds.isel(index).load()
+
+    def append(self, data, obj, dim: str = None):
+        """Append a Dataset to the stored Dataset along an unlimited dimension."""
+        dim, size = self.append_file(data, obj, dim)
+        data["dims"][dim] = size
+        return data
+
 
-def get_xarray_handlers(mode: Literal["nc"] = "nc") -> dict:
+def get_xarray_handlers(
+    mode: Literal["nc"] = "nc", naming: Literal["uuid", "hash"] = "uuid"
+) -> dict:
     """Get a dictionary of xarray, handler pairs."""
     type_handlers = {
-        xr.DataArray: XarrayDataArrayHandler(mode=mode),
-        xr.Dataset: XarrayDatasetHandler(mode=mode),
+        xr.DataArray: XarrayDataArrayHandler(mode=mode, naming=naming),
+        xr.Dataset: XarrayDatasetHandler(mode=mode, naming=naming),
     }
     return type_handlers
@@ -1,8 +1,11 @@
 import pytest
+import pathlib
 
-# import numpy as np
+import jsonpickle as jp
+import numpy as np
 
-from dataicer import list_handlers
+from dataicer import DirectoryHandler, list_handlers
+from dataicer.plugins import get_numpy_handlers
 
 # from dataicer.plugins import numpy as dinp
 # from dataicer.plugins import pandas as dipd
@@ -18,6 +21,25 @@ def test_list_handlers():
     assert isinstance(handlers["extra"], dict)
 
 
+def test_list_handlers_archive(tmpdir):
+    handlers = get_numpy_handlers()
+    dh = DirectoryHandler(pathlib.Path(tmpdir) / "archive", handlers, mode="w")
+    listed = list_handlers(dh)
+    assert listed["base"][np.ndarray] is handlers[np.ndarray]
+    assert np.ndarray not in list_handlers()["base"]
+
+
+def test_handlers_get_session_only(tmpdir):
+    registry_get = jp.handlers.get
+    dh = DirectoryHandler(
+        pathlib.Path(tmpdir) / "archive", get_numpy_handlers(), mode="w"
+    )
+    with dh:
+        assert jp.handlers.get is not registry_get
+        assert jp.handlers.get(np.ndarray) is dh._handlers[np.ndarray]
+    assert jp.handlers.get is registry_get
+
+
 # # @pytest.mark.parametrize(
 # #     "comp", ["gz", "bz2", "xz"]
 # # )
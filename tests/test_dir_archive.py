@@ -1,8 +1,13 @@
 from typing import Dict
+import asyncio
 import pytest
+import json
+import os
 import pathlib
 
+import jsonpickle as jp
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 from dataicer._dir_archive import FileHandler, DirectoryHandler
 from dataicer.plugins import (
@@ -134,7 +139,7 @@ def test_DirectoryHandler_ice_deice_baseobjects(tmpdir, baseobj):
     assert test == test_obj
 
 
-@pytest.mark.parametrize("mode", ["txt", "npy", "npz"])
+@pytest.mark.parametrize("mode", ["raw", "txt", "npy", "npz"])
 def test_DirectoryHandler_ice_deice_numpy(tmpdir, numpy_data, mode):
     dh = DirectoryHandler(tmpdir, get_numpy_handlers(array_mode=mode), mode="w")
     dh.ice(npar=numpy_data)
@@ -176,3 +181,310 @@ def test_DirectoryHandler_class_of_baseobjects(directory_handler, test_class):
     directory_handler.ice(tc=tc)
     di = directory_handler.deice(classes=test_class)
     assert di["tc"] == tc
+
+
+def test_DirectoryHandler_dirty(directory_handler):
+    assert not directory_handler.dirty
+    directory_handler.save_json(a="1")
+    assert directory_handler.dirty
+
+    dh = DirectoryHandler(directory_handler.path, mode="a")
+    dh.save_json(a="1")
+    assert not dh.dirty
+
+
+@pytest.mark.parametrize("environment", ["eager", "lazy", "off"])
+def test_DirectoryHandler_environment(tmpdir, environment):
+    dh = DirectoryHandler(tmpdir, mode="w", environment=environment)
+    dh.ice(a=1)
+    meta = json.loads(dh["meta"])
+    assert ("pip_freeze" in meta) == (environment != "off")
+
+
+def test_DirectoryHandler_environment_lazy(tmpdir):
+    dh = DirectoryHandler(tmpdir, mode="w", environment="lazy")
+    dh.save_json(meta=json.dumps({"pip_freeze": ["fake==1.0"]}))
+    dh.ice(a=1)
+    assert json.loads(dh["meta"])["pip_freeze"] == ["fake==1.0"]
+
+
+@pytest.mark.parametrize("workers", [4, "executor"])
+def test_DirectoryHandler_ice_deice_workers(tmpdir, pandas_df, workers):
+    if workers == "executor":
+        workers = ThreadPoolExecutor(2)
+    handlers = get_pandas_handlers(mode="csv", array_mode="npy")
+    dh = DirectoryHandler(tmpdir, handlers, "w", workers=workers)
+    data = {f"key{i}": {"df": pandas_df["df1"], "ar": np.arange(i)} for i in range(10)}
+    dh.ice(**data)
+
+    test = dh.deice()
+    assert set(test) == set(data)
+    for key, val in data.items():
+        assert val["df"].equals(test[key]["df"])
+        np.testing.assert_array_equal(val["ar"], test[key]["ar"])
+
+
+def test_DirectoryHandler_nested_sessions(tmpdir, numpy_data):
+    dh = DirectoryHandler(tmpdir, get_numpy_handlers(array_mode="npy"), "w")
+    with dh as _:
+        dh.ice(a=numpy_data)
+        # handlers are still registered after the nested session closes
+        test = dh.deice()
+    np.testing.assert_array_equal(test["a"]["np_data"], numpy_data["np_data"])
+
+
+def test_DirectoryHandler_hash_naming_dedup(tmpdir):
+    handlers = get_numpy_handlers("npy", naming="hash")
+    dh = DirectoryHandler(pathlib.Path(tmpdir) / "archive", handlers, mode="w")
+    dh.ice(a=np.arange(10), b={"c": np.arange(10), "d": np.ones(3)})
+    assert len(list(dh.path.glob("*.npy"))) == 2
+
+    dh = DirectoryHandler(dh.path, handlers, mode="a")
+    dh.ice(a=np.arange(10), e=np.ones(3))
+    assert len(list(dh.path.glob("*.npy"))) == 2
+
+    dh.remove_key("a")
+    dh.remove_key("b")
+    assert len(list(dh.path.glob("*.npy"))) == 1
+    np.testing.assert_array_equal(dh.deice("e")["e"], np.ones(3))
+
+    dh.remove_key("e")
+    assert not list(dh.path.glob("*.npy"))
+
+
+def test_DirectoryHandler_remove_key_nested_files(tmpdir):
+    dh = DirectoryHandler(
+        pathlib.Path(tmpdir) / "archive", get_numpy_handlers("npy"), mode="w"
+    )
+    dh.ice(a={"b": np.zeros(3), "c": [np.ones(2)]})
+    assert len(list(dh.path.glob("*.npy"))) == 2
+    dh.remove_key("a")
+    assert not list(dh.path.glob("*.npy"))
+
+
+def test_DirectoryHandler_index(tmpdir, monkeypatch):
+    dh = DirectoryHandler(
+        pathlib.Path(tmpdir) / "archive", get_numpy_handlers("npy"), mode="w"
+    )
+    dh.ice(a=np.zeros((2, 3)), b=1)
+    assert (dh.path / "index").exists()
+
+    info = dh.key_info("a")
+    assert info["json"] == "a.json"
+    assert len(info["files"]) == 1
+    assert info["summary"] == {
+        "type": "numpy.ndarray",
+        "shape": [2, 3],
+        "dtype": "float64",
+    }
+    assert info["size"] == (dh.path / "a.json").stat().st_size
+
+    dh = DirectoryHandler(dh.path, get_numpy_handlers("npy"), mode="a")
+    monkeypatch.setattr(pathlib.Path, "glob", None)
+    monkeypatch.setattr(dh, "_read_key", None)
+    assert set(dh.keys()) == {"meta", "a", "b"}
+    dh.remove_key("a")
+    assert set(dh.keys()) == {"meta", "b"}
+    assert not [path for path in dh.path.iterdir() if path.suffix == ".npy"]
+
+
+def test_DirectoryHandler_index_rebuilt(tmpdir):
+    dh = DirectoryHandler(
+        pathlib.Path(tmpdir) / "archive", get_numpy_handlers("npy"), mode="w"
+    )
+    dh.ice(a=np.zeros(3), b=1)
+    (dh.path / "index").unlink()
+
+    dh = DirectoryHandler(dh.path, get_numpy_handlers("npy"), mode="a")
+    assert set(dh.keys()) == {"meta", "a", "b"}
+    assert len(dh.key_info("a")["files"]) == 1
+    dh.remove_key("a")
+    assert not list(dh.path.glob("*.npy"))
+    assert (dh.path / "index").exists()
+
+
+def test_DirectoryHandler_index_killed_session(tmpdir):
+    dh = DirectoryHandler(
+        pathlib.Path(tmpdir) / "archive", get_numpy_handlers("npy"), mode="w"
+    )
+    dh.ice(a=np.zeros(3), b=1)
+
+    # a session which is never closed, as if the writer was killed
+    killed = DirectoryHandler(dh.path, get_numpy_handlers("npy"), mode="a")
+    killed.__enter__()
+    killed.ice(c=np.ones(3))
+    killed.remove_key("a")
+    assert not (dh.path / "index").exists()
+
+    dh = DirectoryHandler(dh.path, get_numpy_handlers("npy"), mode="a")
+    assert set(dh.keys()) == {"meta", "b", "c"}
+    test = dh.deice()
+    assert test["b"] == 1
+    np.testing.assert_array_equal(test["c"], np.ones(3))
+
+
+def test_DirectoryHandler_index_external_writer(tmpdir):
+    dh = DirectoryHandler(
+        pathlib.Path(tmpdir) / "archive", get_numpy_handlers("npy"), mode="w"
+    )
+    dh.ice(a=1, b=2)
+    index_mtime = (dh.path / "index").stat().st_mtime_ns
+
+    # a writer which does not update the index
+    (dh.path / "c.json").write_text(jp.encode(3))
+    (dh.path / "a.json").unlink()
+    os.utime(dh.path, ns=(index_mtime + 1, index_mtime + 1))
+
+    dh = DirectoryHandler(dh.path, mode="r")
+    assert set(dh.keys()) == {"meta", "b", "c"}
+    assert dh.deice() == {"b": 2, "c": 3}
+
+
+def test_DirectoryHandler_index_key_missing(tmpdir):
+    dh = DirectoryHandler(
+        pathlib.Path(tmpdir) / "archive", get_numpy_handlers("npy"), mode="w"
+    )
+    dh.ice(a=1, b=2)
+    index_mtime = (dh.path / "index").stat().st_mtime_ns
+
+    # removed within the timestamp resolution, the index still matches
+    (dh.path / "a.json").unlink()
+    os.utime(dh.path, ns=(index_mtime, index_mtime))
+
+    dh = DirectoryHandler(dh.path, mode="r")
+    with dh:
+        assert "a" in dh.keys()
+        with pytest.raises(FileNotFoundError):
+            dh["a"]
+        assert set(dh.keys()) == {"meta", "b"}
+
+
+def test_DirectoryHandler_aice_adeice(tmpdir, pandas_df):
+    registry = dict(jp.handlers.registry._handlers)
+    archives = {
+        mode: DirectoryHandler(
+            pathlib.Path(tmpdir) / mode, get_pandas_handlers(mode, "npy"), mode="w"
+        )
+        for mode in ("csv", "h5")
+    }
+    data = {f"key{i}": {"df": pandas_df["df1"], "ar": np.arange(i)} for i in range(5)}
+
+    async def ice_deice(dh):
+        await dh.aice(**data)
+        return await dh.adeice()
+
+    async def main():
+        return await asyncio.gather(*(ice_deice(dh) for dh in archives.values()))
+
+    for (mode, dh), test in zip(archives.items(), asyncio.run(main())):
+        assert list(dh.path.glob(f"*.{mode}"))
+        assert set(test) == set(data)
+        for key, val in data.items():
+            assert val["df"].equals(test[key]["df"])
+            np.testing.assert_array_equal(val["ar"], test[key]["ar"])
+    assert jp.handlers.registry._handlers == registry
+
+
+def test_DirectoryHandler_async_session_isolated(tmpdir, pandas_df):
+    df = pandas_df["df1"]
+    csv = DirectoryHandler(
+        pathlib.Path(tmpdir) / "csv", get_pandas_handlers("csv"), mode="w"
+    )
+    h5 = DirectoryHandler(pathlib.Path(tmpdir) / "h5", get_pandas_handlers("h5"), "w")
+    with csv as _:
+        asyncio.run(h5.aice(df=df))
+        csv.ice(df=df)
+        assert df.equals(asyncio.run(h5.adeice())["df"])
+        assert df.equals(csv.deice()["df"])
+    assert list(h5.path.glob("*.h5")) and not list(h5.path.glob("*.csv"))
+    assert list(csv.path.glob("*.csv")) and not list(csv.path.glob("*.h5"))
+
+
+def test_DirectoryHandler_sessions_isolated(tmpdir, pandas_df):
+    registry = dict(jp.handlers.registry._handlers)
+    df = pandas_df["df1"]
+    csv = DirectoryHandler(
+        pathlib.Path(tmpdir) / "csv", get_pandas_handlers("csv"), "w"
+    )
+    h5 = DirectoryHandler(pathlib.Path(tmpdir) / "h5", get_pandas_handlers("h5"), "w")
+    with csv as _, h5 as _:
+        assert jp.handlers.registry._handlers == registry
+        csv.ice(df=df)
+        h5.ice(df=df)
+        assert df.equals(csv.deice()["df"])
+    assert jp.handlers.registry._handlers == registry
+    assert list(h5.path.glob("*.h5")) and not list(h5.path.glob("*.csv"))
+    assert list(csv.path.glob("*.csv")) and not list(csv.path.glob("*.h5"))
+
+
+def test_DirectoryHandler_shared_handlers_threads(tmpdir):
+    handlers = get_numpy_handlers("npy")
+    archives = [
+        DirectoryHandler(pathlib.Path(tmpdir) / f"archive{i}", handlers, mode="w")
+        for i in range(4)
+    ]
+
+    def ice_deice(i):
+        archives[i].ice(**{f"a{j}": np.full(10, i) for j in range(10)})
+        return archives[i].deice()
+
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(ice_deice, range(4)))
+    for i, (dh, test) in enumerate(zip(archives, results)):
+        assert len(list(dh.path.glob("*.npy"))) == 10
+        for val in test.values():
+            np.testing.assert_array_equal(val, np.full(10, i))
+
+
+@pytest.mark.parametrize("compact_json", [True, False])
+def test_DirectoryHandler_compact_json(tmpdir, compact_json):
+    data = {"a": {"b": [1, 2.5, "c"]}, "inf": float("inf"), "big": 2**70}
+    dh = DirectoryHandler(
+        pathlib.Path(tmpdir) / "archive",
+        get_numpy_handlers("npy"),
+        mode="w",
+        compact_json=compact_json,
+    )
+    dh.ice(arr=np.arange(3), **data)
+    assert ("\n" in (dh.path / "a.json").read_text()) != compact_json
+
+    with dh as _:
+        test = dh.deice()
+        pickler = dh._local.pickler
+        dh.ice(c=1)
+        assert dh._local.pickler is pickler
+    np.testing.assert_array_equal(test.pop("arr"), np.arange(3))
+    assert test == data
+
+
+def test_DirectoryHandler_consolidated(tmpdir):
+    path = pathlib.Path(tmpdir) / "archive"
+    dh = DirectoryHandler(path, get_numpy_handlers("npy"), "w", consolidated=True)
+    dh.ice(**{f"key{i}": i for i in range(50)}, arr=np.arange(5))
+    assert not list(dh.path.glob("*.json"))
+    assert len(list(dh.path.glob("*.npy"))) == 1
+
+    dh = DirectoryHandler(path, get_numpy_handlers("npy"), "a")
+    assert dh["key3"] == "3"
+    dh.remove_key("arr")
+    dh.ice(key0="a")
+    assert not list(dh.path.glob("*.npy"))
+    assert set(dh.keys()) == {"meta"} | {f"key{i}" for i in range(50)}
+    test = DirectoryHandler(path, get_numpy_handlers("npy")).deice()
+    assert test == {"key0": "a", **{f"key{i}": i for i in range(1, 50)}}
+    lines = (dh.path / "keys.jsonl").read_text().splitlines()
+    assert len(lines) == 51
+
+
+def test_DirectoryHandler_consolidate_existing(tmpdir):
+    dh = DirectoryHandler(pathlib.Path(tmpdir) / "archive", mode="w")
+    dh.ice(a=1, b=2)
+
+    dh = DirectoryHandler(dh.path, mode="r", consolidated=True)
+    assert dh.deice() == {"a": 1, "b": 2}
+    assert not (dh.path / "keys.jsonl").exists()
+
+    dh = DirectoryHandler(dh.path, mode="a", consolidated=True)
+    dh.ice(c=3)
+    assert not list(dh.path.glob("*.json"))
+    assert DirectoryHandler(dh.path).deice() == {"a": 1, "b": 2, "c": 3}
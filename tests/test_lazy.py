@@ -0,0 +1,48 @@
+import pytest
+
+import numpy as np
+
+from dataicer import DirectoryHandler, LazyDeice, IceProxy
+from dataicer.plugins import get_numpy_handlers
+
+
+@pytest.fixture(scope="function")
+def lazy_handler(tmpdir):
+    dh = DirectoryHandler(tmpdir, get_numpy_handlers(array_mode="npy"), "w")
+    dh.ice(a=np.arange(10), b={"c": 1}, d=[1, 2, 3])
+    return dh
+
+
+def test_deice_lazy_keys(lazy_handler):
+    lazy = lazy_handler.deice_lazy()
+    assert isinstance(lazy, LazyDeice)
+    assert set(lazy) == {"a", "b", "d"}
+    assert lazy.cached() == ()
+
+
+def test_deice_lazy_proxy(lazy_handler):
+    lazy = lazy_handler.deice_lazy()
+    proxy = lazy["a"]
+    assert isinstance(proxy, IceProxy)
+    assert lazy.cached() == ()
+
+    assert proxy.shape == (10,)
+    assert lazy.cached() == ("a",)
+    assert lazy["b"]["c"] == 1
+    assert len(lazy.d) == 3
+    np.testing.assert_array_equal(np.asarray(proxy), np.arange(10))
+
+
+def test_deice_lazy_lru(lazy_handler):
+    lazy = lazy_handler.deice_lazy(cache_size=2)
+    for key in ["a", "b", "d", "b"]:
+        lazy.load(key)
+    assert lazy.cached() == ("d", "b")
+
+
+def test_deice_lazy_missing(lazy_handler):
+    lazy = lazy_handler.deice_lazy("a")
+    with pytest.raises(KeyError):
+        lazy["b"]
+    with pytest.raises(AttributeError):
+        lazy.b
@@ -1,7 +1,24 @@
 import pytest
 
-from dataicer._pip import get_pip_freeze
+from dataicer import _pip
+from dataicer._pip import get_pip_freeze, get_environment
 
 def test_get_pip_freeze():
     frozen_pip_list = get_pip_freeze()
     assert isinstance(frozen_pip_list, list)
+
+
+def test_get_environment():
+    environment = get_environment()
+    assert isinstance(environment, list)
+    assert any(dist.lower().startswith("jsonpickle==") for dist in environment)
+
+
+def test_get_environment_cached(monkeypatch):
+    get_environment()
+
+    def fail():
+        raise AssertionError("environment should be cached")
+
+    monkeypatch.setattr(_pip.metadata, "distributions", fail)
+    get_environment()
@@ -1,15 +1,256 @@
+import io
 import pytest
 import jsonpickle as jp
 import numpy as np
 
 from dataicer import DirectoryHandler
-from dataicer.plugins.numpy import get_numpy_handlers
+from dataicer.plugins.numpy import (
+    NumpyNDArrayHandler,
+    array_digest,
+    auto_chunks,
+    get_numpy_handlers,
+    iter_buffers,
+    read_npy_slice,
+    write_npy,
+)
 
 
-@pytest.mark.parametrize("mode", ["txt", "npy", "npz", "json"])
+@pytest.mark.parametrize("mode", ["raw", "txt", "npy", "npz", "json"])
 def test_ndarray(tmpdir, numpy_data, mode):
     dh = DirectoryHandler(tmpdir, get_numpy_handlers(array_mode=mode), "w")
     with dh as _:
         json = jp.encode(numpy_data)
         test = jp.decode(json)
     np.testing.assert_array_equal(numpy_data["np_data"], test["np_data"])
+
+
+@pytest.mark.parametrize("array_mode", ["raw", "npy"])
+@pytest.mark.parametrize("mmap_mode", ["r", "c"])
+def test_ndarray_mmap(tmpdir, numpy_data, mmap_mode, array_mode):
+    dh = DirectoryHandler(
+        tmpdir,
+        get_numpy_handlers(array_mode=array_mode),
+        "w",
+        restore_options={"mmap_mode": mmap_mode},
+    )
+    dh.ice(a=numpy_data["np_data"])
+    test = dh.deice()["a"]
+    assert isinstance(test, np.memmap)
+    assert test.flags.writeable == (mmap_mode == "c")
+    np.testing.assert_array_equal(numpy_data["np_data"], test)
+
+
+def test_ndarray_mmap_key_options(tmpdir):
+    arr = np.arange(12).reshape(3, 4)
+    arr.flags.writeable = False
+    dh = DirectoryHandler(tmpdir, get_numpy_handlers(array_mode="npy"), "w")
+    dh.ice(a=arr, b=arr)
+    test = dh.deice(restore_options={"a": {"mmap_mode": "c"}})
+    assert isinstance(test["a"], np.memmap)
+    assert not isinstance(test["b"], np.memmap)
+    assert not test["a"].flags.writeable
+    assert test["a"].shape == (3, 4)
+
+
+@pytest.mark.parametrize("naming", ["uuid", "hash"])
+def test_ndarray_raw(tmpdir, naming):
+    arr = np.arange(60, dtype=">i4").reshape(3, 4, 5)
+    data = {
+        "c": arr,
+        "f": np.asfortranarray(arr),
+        "strided": arr[:, ::2, 1:],
+        "datetime": np.arange(3).astype("M8[s]"),
+        "record": np.array([(1, 2.0)], dtype=[("a", "i2"), ("b", "f4")]),
+        "scalar": np.array(2.5, dtype=np.float16),
+        "empty": np.zeros((0, 3), dtype=np.uint8),
+        "object": np.array(["a", 1], dtype=object),
+    }
+    dh = DirectoryHandler(tmpdir, get_numpy_handlers(naming=naming), "w")
+    dh.ice(**data)
+    test = dh.deice()
+    for key, val in data.items():
+        np.testing.assert_array_equal(test[key], val)
+        assert test[key].dtype == val.dtype
+        assert test[key].flags.writeable
+    assert test["f"].flags.f_contiguous
+    assert len(list(dh.path.glob("*.raw"))) == 7
+    np.testing.assert_array_equal(dh.read_slice("f", np.s_[1:, 2]), arr[1:, 2])
+
+
+@pytest.mark.parametrize("mode", ["npy", "chunked"])
+def test_ndarray_object_hash_naming(tmpdir, mode):
+    dh = DirectoryHandler(tmpdir, get_numpy_handlers(mode, naming="hash"), "w")
+    with pytest.raises(ValueError, match="[Oo]bject"):
+        dh.ice(arr=np.array(["a", 1], dtype=object))
+
+
+def test_ndarray_txt_dtype(tmpdir):
+    dh = DirectoryHandler(tmpdir, get_numpy_handlers(array_mode="txt"), "w")
+    dh.ice(a=np.arange(5, dtype=np.int16))
+    assert dh.deice()["a"].dtype == np.int16
+
+
+def test_iter_buffers():
+    arr = np.arange(600.0).reshape(20, 30)
+    blocks = list(iter_buffers(arr))
+    assert len(blocks) == 1 and np.shares_memory(blocks[0], arr)
+    blocks = list(iter_buffers(np.asfortranarray(arr)))
+    assert len(blocks) == 1 and bytes(blocks[0]) == arr.tobytes("F")
+
+    strided = arr[:, ::3]
+    for order in ["C", "F"]:
+        for buffer_size in [100, 16]:
+            blocks = [
+                bytes(block) for block in iter_buffers(strided, order, buffer_size)
+            ]
+            assert max(len(block) for block in blocks) <= buffer_size
+            assert b"".join(blocks) == strided.tobytes(order)
+
+
+@pytest.mark.parametrize("order", ["C", "F", "strided", "scalar"])
+def test_write_npy(order):
+    arr = np.arange(60, dtype=">i4").reshape(3, 4, 5)
+    arr = {
+        "C": arr,
+        "F": np.asfortranarray(arr),
+        "strided": arr[:, ::2],
+        "scalar": np.array(1.5),
+    }[order]
+    expected, test = io.BytesIO(), io.BytesIO()
+    np.save(expected, arr, allow_pickle=False)
+    write_npy(test, arr)
+    assert test.getvalue() == expected.getvalue()
+
+
+def test_array_digest():
+    arr = np.arange(24, dtype=float).reshape(2, 3, 4)
+    assert array_digest(arr) == array_digest(arr.copy())
+    assert array_digest(arr) == array_digest(np.asfortranarray(arr))
+    assert array_digest(arr[:, ::2]) == array_digest(arr[:, ::2].copy())
+    assert array_digest(arr) != array_digest(arr.reshape(6, 4))
+    assert array_digest(arr) != array_digest(arr.astype(np.float32))
+    assert array_digest(arr) != array_digest(arr, "npy")
+
+
+@pytest.mark.parametrize(
+    "index",
+    [
+        np.s_[2:5],
+        np.s_[::-3, 1],
+        np.s_[-1],
+        np.s_[8:2:-2, ::2],
+        np.s_[5:5],
+        np.s_[[1, 3]],
+    ],
+)
+def test_read_npy_slice(index):
+    arr = np.arange(60.0).reshape(10, 6)
+    buffer = io.BytesIO()
+    np.save(buffer, arr)
+    buffer.seek(0)
+    np.testing.assert_array_equal(read_npy_slice(buffer, index), arr[index])
+
+
+def test_read_npy_slice_partial():
+    arr = np.arange(6000.0).reshape(1000, 6)
+    buffer = io.BytesIO()
+    np.save(buffer, arr)
+    buffer.seek(0)
+
+    reads = []
+    readinto = buffer.readinto
+    buffer.readinto = lambda b: reads.append(readinto(b)) or reads[-1]
+    np.testing.assert_array_equal(read_npy_slice(buffer, np.s_[10:20]), arr[10:20])
+    assert sum(reads) == 10 * 6 * 8
+
+
+@pytest.mark.parametrize("mode", ["raw", "txt", "npy", "npz", "json"])
+def test_ndarray_read_slice(tmpdir, mode):
+    arr = np.arange(60.0).reshape(10, 6)
+    dh = DirectoryHandler(tmpdir, get_numpy_handlers(array_mode=mode), "w")
+    dh.ice(arr=arr)
+    np.testing.assert_array_equal(dh.read_slice("arr", np.s_[2:4, 1]), arr[2:4, 1])
+
+
+@pytest.mark.parametrize("compressor", ["zlib", "lzma", "bz2", "blosc", "zstd", "none"])
+def test_ndarray_chunked(tmpdir, numpy_data, compressor):
+    if compressor == "blosc":
+        pytest.importorskip("blosc")
+    if compressor == "zstd":
+        pytest.importorskip("zstandard")
+    handlers = get_numpy_handlers()
+    handlers[np.ndarray] = NumpyNDArrayHandler(
+        mode="chunked", compressor=compressor, chunks=(2,) * numpy_data["np_data"].ndim
+    )
+    dh = DirectoryHandler(tmpdir, handlers, "w")
+    data = {"np_data": numpy_data["np_data"] + 1, "scalar": np.array(2.0)}
+    dh.ice(data=data)
+    test = dh.deice()["data"]
+    np.testing.assert_array_equal(test["np_data"], data["np_data"])
+    np.testing.assert_array_equal(test["scalar"], data["scalar"])
+
+
+def test_ndarray_chunked_read_slice(tmpdir):
+    arr = np.arange(4000.0).reshape(100, 40)
+    handlers = get_numpy_handlers()
+    handlers[np.ndarray] = NumpyNDArrayHandler(mode="chunked", chunks=(10, 10))
+    dh = DirectoryHandler(tmpdir, handlers, "w")
+    dh.ice(arr=arr)
+
+    opened = []
+    open_file = dh.open_file
+    dh.open_file = lambda name, mode="r": opened.append(name) or open_file(name, mode)
+    for index in [np.s_[25:35, 5], np.s_[::-7, 12:3:-2], np.s_[-1], np.s_[[1, 3]]]:
+        np.testing.assert_array_equal(dh.read_slice("arr", index), arr[index])
+
+    opened.clear()
+    np.testing.assert_array_equal(dh.read_slice("arr", np.s_[25:35, 5]), arr[25:35, 5])
+    assert len([name for name in opened if ".chunked/" in name]) == 2
+
+
+def test_auto_chunks():
+    assert auto_chunks((10, 10), 8) == (10, 10)
+    chunks = auto_chunks((4096, 4096), 8)
+    assert np.prod(chunks) * 8 <= 2**20
+    assert auto_chunks((), 8) == ()
+
+
+@pytest.mark.parametrize("mode", ["raw", "npy", "txt", "chunked"])
+def test_ndarray_append(tmpdir, mode):
+    arr = np.arange(12.0).reshape(4, 3)
+    handlers = get_numpy_handlers()
+    handlers[np.ndarray] = NumpyNDArrayHandler(mode=mode, chunks=(3, 3))
+    dh = DirectoryHandler(tmpdir, handlers, "w")
+    dh.ice(arr=arr)
+    dh.append("arr", np.ones((5, 3)))
+    dh.append("arr", np.zeros((1, 3)))
+
+    expected = np.concatenate([arr, np.ones((5, 3)), np.zeros((1, 3))])
+    np.testing.assert_array_equal(dh.deice()["arr"], expected)
+    assert dh.key_info("arr")["summary"]["shape"] == [10, 3]
+    with pytest.raises(ValueError):
+        dh.append("arr", np.ones((2, 4)))
+
+
+@pytest.mark.parametrize("mode", ["raw", "npy", "txt", "chunked"])
+@pytest.mark.parametrize(
+    "dtype,new_dtype", [("int8", "int64"), ("float32", "float64"), ("int64", "f8")]
+)
+def test_ndarray_append_lossy(tmpdir, mode, dtype, new_dtype):
+    handlers = get_numpy_handlers()
+    handlers[np.ndarray] = NumpyNDArrayHandler(mode=mode, chunks=(3,))
+    dh = DirectoryHandler(tmpdir, handlers, "w")
+    dh.ice(arr=np.arange(4, dtype=dtype))
+    with pytest.raises(ValueError):
+        dh.append("arr", np.arange(200, 202, dtype=new_dtype))
+    np.testing.assert_array_equal(dh.deice()["arr"], np.arange(4, dtype=dtype))
+    dh.append("arr", np.arange(4, 6, dtype="int8"))
+    np.testing.assert_array_equal(dh.deice()["arr"], np.arange(6, dtype=dtype))
+
+
+@pytest.mark.parametrize("naming,mode", [("hash", "npy"), ("uuid", "npz")])
+def test_ndarray_append_invalid(tmpdir, naming, mode):
+    dh = DirectoryHandler(tmpdir, get_numpy_handlers(mode, naming=naming), "w")
+    dh.ice(arr=np.arange(5))
+    with pytest.raises(ValueError):
+        dh.append("arr", np.arange(5))
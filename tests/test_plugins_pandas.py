@@ -1,8 +1,11 @@
+import json
 import pytest
 import jsonpickle as jp
+import numpy as np
+import pandas as pd
 
 from dataicer import DirectoryHandler
-from dataicer.plugins.pandas import get_pandas_handlers
+from dataicer.plugins.pandas import get_pandas_handlers, PandasDataFrameHandler
 
 
 @pytest.mark.parametrize("array_mode", ["txt", "npy", "npz", "json"])
@@ -15,3 +18,174 @@ def test_dataframe(tmpdir, pandas_df, mode, array_mode):
         json = jp.encode(pandas_df)
         test = jp.decode(json)
     assert pandas_df["df1"].equals(test["df1"])
+
+
+@pytest.mark.parametrize("compression", [None, "zstd"])
+@pytest.mark.parametrize("mode", ["parquet", "feather"])
+def test_dataframe_arrow(tmpdir, pandas_df, mode, compression):
+    df = pandas_df["df1"].set_index("str_list", append=True)
+    df["cat"] = pd.Categorical(["a", "b"] * 5)
+    handlers = get_pandas_handlers()
+    handlers[pd.DataFrame] = PandasDataFrameHandler(mode, compression=compression)
+    dh = DirectoryHandler(tmpdir, handlers, "w")
+    dh.ice(df=df)
+    test = dh.deice()["df"]
+    pd.testing.assert_frame_equal(df, test)
+
+
+@pytest.mark.parametrize("mode", ["csv", "h5", "parquet", "feather"])
+def test_dataframe_columns(tmpdir, pandas_df, mode):
+    dh = DirectoryHandler(tmpdir, get_pandas_handlers(mode=mode), "w")
+    dh.ice(df=pandas_df["df1"])
+    columns = ["int_range", "str_list"]
+    test = dh.deice(restore_options={"df": {"columns": columns}})["df"]
+    assert pandas_df["df1"][columns].equals(test)
+
+
+@pytest.mark.parametrize("mode", ["h5", "parquet", "feather"])
+def test_dataframe_native_index(tmpdir, pandas_df, mode):
+    df = pandas_df["df1"].set_index(pd.date_range("2000", periods=10, name="time"))
+    dh = DirectoryHandler(tmpdir, get_pandas_handlers(mode=mode), "w")
+    dh.ice(df=df)
+
+    assert not list(dh.path.glob("*.npy"))
+    assert "index" not in json.loads(dh["df"])
+    pd.testing.assert_frame_equal(df, dh.deice()["df"], check_freq=False)
+
+
+def test_dataframe_feather_mmap(tmpdir, pandas_df):
+    handlers = get_pandas_handlers()
+    handlers[pd.DataFrame] = PandasDataFrameHandler(
+        "feather", compression="uncompressed"
+    )
+    dh = DirectoryHandler(tmpdir, handlers, "w", restore_options={"mmap_mode": "r"})
+    dh.ice(df=pandas_df["df1"])
+    test = dh.deice()["df"]
+    assert pandas_df["df1"].equals(test)
+
+
+def test_dataframe_csv_dtypes_index(tmpdir):
+    columns = pd.MultiIndex.from_tuples(
+        [("a", "x"), ("a", "y"), ("b", "x"), ("b", "y"), ("c", "z")],
+        names=["l0", "l1"],
+    )
+    df = pd.DataFrame(
+        {
+            ("a", "x"): np.arange(4, dtype="float32"),
+            ("a", "y"): np.arange(4, dtype="int16"),
+            ("b", "x"): pd.date_range("2000-01-01", periods=4, tz="UTC"),
+            ("b", "y"): pd.to_timedelta(np.arange(4), unit="h"),
+            ("c", "z"): pd.Categorical(["u", "v"] * 2),
+        },
+        index=pd.Index([10, 20, 30, 40], name="idx"),
+    )
+    df.columns = columns
+    dh = DirectoryHandler(tmpdir, get_pandas_handlers(mode="csv"), "w")
+    dh.ice(df=df)
+    test = dh.deice()["df"]
+    pd.testing.assert_frame_equal(df, test)
+
+
+@pytest.mark.parametrize("mode", ["csv", "h5"])
+def test_dataframe_append(tmpdir, pandas_df, mode):
+    df = pandas_df["df1"]
+    dh = DirectoryHandler(tmpdir, get_pandas_handlers(mode=mode), "w")
+    dh.ice(df=df)
+    dh.append("df", df.iloc[:3])
+
+    test = dh.deice()["df"]
+    assert pd.concat([df, df.iloc[:3]]).equals(test)
+    assert dh.key_info("df")["summary"]["shape"] == [13, df.shape[1]]
+
+
+def test_dataframe_append_invalid(tmpdir, pandas_df):
+    df = pandas_df["df1"]
+    dh = DirectoryHandler(tmpdir, get_pandas_handlers(mode="parquet"), "w")
+    dh.ice(df=df)
+    with pytest.raises(ValueError):
+        dh.append("df", df)
+
+
+@pytest.mark.parametrize(
+    "obj",
+    [
+        pd.Series(np.arange(5.0), index=pd.date_range("2000", periods=5, tz="UTC")),
+        pd.Series(pd.Categorical(["a", "b", "a"], ordered=True), name="cat"),
+        pd.Series(pd.date_range("2000", periods=3, tz="Europe/London")),
+        pd.Series(["a", "b"], index=pd.Index(["x", "y"], name="s")),
+        pd.date_range("2000", periods=5, freq="D", name="time"),
+        pd.timedelta_range("1D", periods=3),
+        pd.CategoricalIndex(["a", "b", "a"]),
+        pd.MultiIndex.from_product([["a", "b"], [1, 2, 3]], names=["k", "n"]),
+        pd.RangeIndex(2, 20, 3, name="r"),
+        pd.Index(["x", "y"]),
+    ],
+    ids=[
+        "series",
+        "categorical",
+        "datetimetz",
+        "object",
+        "datetimeindex",
+        "timedeltaindex",
+        "categoricalindex",
+        "multiindex",
+        "rangeindex",
+        "objectindex",
+    ],
+)
+def test_series_index(tmpdir, obj):
+    dh = DirectoryHandler(tmpdir, get_pandas_handlers(array_mode="json"), "w")
+    dh.ice(obj=obj)
+    test = dh.deice()["obj"]
+    if isinstance(obj, pd.Series):
+        pd.testing.assert_series_equal(obj, test)
+    else:
+        pd.testing.assert_index_equal(obj, test, exact=True)
+        assert getattr(obj, "freq", None) == getattr(test, "freq", None)
+
+
+def test_series_index_npy(tmpdir):
+    index = pd.date_range("2000", periods=1000, freq="h", tz="UTC")
+    obj = pd.Series(np.arange(1000), index=index)
+    dh = DirectoryHandler(tmpdir, get_pandas_handlers(array_mode="json"), "w")
+    dh.ice(obj=obj, df=obj.to_frame("a"), rng=pd.RangeIndex(10))
+
+    assert len(list(dh.path.glob("*.npy"))) == 3
+    assert str(index[0].value) not in dh["df"]
+    pd.testing.assert_frame_equal(obj.to_frame("a"), dh.deice()["df"])
+
+
+def test_dataframe_append_index(tmpdir, pandas_df):
+    df = pandas_df["df1"].set_index(pd.date_range("2000", periods=10, name="time"))
+    dh = DirectoryHandler(tmpdir, get_pandas_handlers(mode="h5"), "w")
+    dh.ice(df=df)
+    dh.append("df", df.iloc[:3])
+    dh.append("df", df.iloc[3:])
+
+    assert not list(dh.path.glob("*.npy"))
+    assert pd.concat([df, df.iloc[:3], df.iloc[3:]]).equals(dh.deice()["df"])
+
+
+@pytest.mark.parametrize(
+    "index",
+    [
+        pd.date_range("2000", periods=13, freq="h", tz="Europe/London", name="t"),
+        pd.RangeIndex(13),
+        pd.Index([f"r{i}" for i in range(13)]),
+    ],
+    ids=["datetimeindex", "rangeindex", "objectindex"],
+)
+def test_dataframe_append_csv_index(tmpdir, pandas_df, index):
+    df = pd.concat([pandas_df["df1"], pandas_df["df1"].iloc[:3]]).set_axis(index)
+    dh = DirectoryHandler(tmpdir, get_pandas_handlers(mode="csv"), "w")
+    dh.ice(df=df.iloc[:10])
+    index_files = sorted(dh.path.glob("*.npy"))
+    dh.append("df", df.iloc[10:])
+
+    # the stored index is extended, not written again
+    assert sorted(dh.path.glob("*.npy")) == index_files
+    pd.testing.assert_frame_equal(df, dh.deice()["df"])
+
+    dh.append("df", df.iloc[:3])
+    test = dh.deice()["df"]
+    pd.testing.assert_frame_equal(pd.concat([df, df.iloc[:3]]), test)
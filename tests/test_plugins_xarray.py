@@ -1,8 +1,15 @@
 import pytest
 import jsonpickle as jp
+import numpy as np
+import pandas as pd
+import xarray as xr
 
 from dataicer import DirectoryHandler
-from dataicer.plugins.xarray import get_xarray_handlers
+from dataicer.plugins.xarray import (
+    XarrayDataArrayHandler,
+    XarrayDatasetHandler,
+    get_xarray_handlers,
+)
 
 
 @pytest.mark.parametrize("mode", ["nc"])
@@ -22,3 +29,51 @@ def test_dataarray(tmpdir, xarray_dataarray, mode):
         test = jp.decode(json)
 
     assert xarray_dataarray["da1"].equals(test["da1"])
+
+
+def test_restore_lazy(tmpdir, xarray_dataset, xarray_dataarray):
+    dh = DirectoryHandler(tmpdir, get_xarray_handlers(), "w")
+    dh.ice(ds=xarray_dataset["ds1"], da=xarray_dataarray["da1"])
+
+    test = dh.deice()
+    # files on disk are opened lazily
+    assert not isinstance(test["da"].variable._data, np.ndarray)
+    assert not isinstance(test["ds"]["temperature"].variable._data, np.ndarray)
+    assert xarray_dataset["ds1"].equals(test["ds"])
+    assert xarray_dataarray["da1"].equals(test["da"])
+
+
+def test_read_slice(tmpdir, xarray_dataset, xarray_dataarray):
+    dh = DirectoryHandler(tmpdir, get_xarray_handlers(), "w")
+    dh.ice(ds=xarray_dataset["ds1"], da=xarray_dataarray["da1"])
+
+    test = dh.read_slice("ds", {"x": 1, "time": slice(0, 2)})
+    assert test.equals(xarray_dataset["ds1"].isel(x=1, time=slice(0, 2)))
+    test = dh.read_slice("da", (slice(1, 3), 0))
+    assert test.equals(xarray_dataarray["da1"][1:3, 0])
+
+
+def test_append(tmpdir, xarray_dataset, xarray_dataarray):
+    handlers = {
+        xr.DataArray: XarrayDataArrayHandler(unlimited_dims=["time"]),
+        xr.Dataset: XarrayDatasetHandler(unlimited_dims=["time"]),
+    }
+    da, ds = xarray_dataarray["da1"], xarray_dataset["ds1"]
+    new_da = da.assign_coords(time=da.time + pd.Timedelta(days=4))
+    new_ds = ds.assign_coords(time=ds.time + pd.Timedelta(days=3))
+    dh = DirectoryHandler(tmpdir, handlers, "w")
+    dh.ice(da=da, ds=ds)
+    dh.append("da", new_da)
+    dh.append("ds", new_ds, dim="time")
+
+    test = dh.deice()
+    assert test["da"].equals(xr.concat([da, new_da], "time"))
+    assert test["ds"].equals(xr.concat([ds, new_ds], "time"))
+    assert dh.key_info("da")["summary"]["shape"] == [8, da.shape[1]]
+
+
+def test_append_not_unlimited(tmpdir, xarray_dataarray):
+    dh = DirectoryHandler(tmpdir, get_xarray_handlers(), "w")
+    dh.ice(da=xarray_dataarray["da1"])
+    with pytest.raises(ValueError):
+        dh.append("da", xarray_dataarray["da1"])
@@ -0,0 +1,221 @@
+import pytest
+import pathlib
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+from dataicer import SQLiteHandler
+from dataicer.plugins import (
+    get_numpy_handlers,
+    get_pandas_handlers,
+    get_xarray_handlers,
+)
+from dataicer.plugins.xarray import writes_file_objects
+
+
+@pytest.fixture(scope="function")
+def sqlite_handler(tmpdir):
+    handler = SQLiteHandler(pathlib.Path(tmpdir) / "archive", mode="w")
+    return handler
+
+
+def test_SQLiteHandler_init_creates_db(sqlite_handler):
+    assert sqlite_handler._archive_type == "sqlite"
+    assert sqlite_handler.db_path.exists()
+    assert sqlite_handler.db_path.name == "archive.ice.sqlite"
+    with sqlite3.connect(sqlite_handler.db_path) as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+@pytest.mark.parametrize("mode", ("r", "a"))
+def test_SQLiteHandler_init_not_exists(tmpdir, mode):
+    with pytest.raises(FileNotFoundError):
+        SQLiteHandler(pathlib.Path(tmpdir) / "this_db_does_not_exist", mode=mode)
+
+
+def test_SQLiteHandler_open_file(sqlite_handler):
+    with sqlite_handler as sh:
+        with sh.open_file("A.txt", "w") as f:
+            f.write("test text")
+        with sh.open_file("A.txt", "r") as f:
+            assert f.read() == "test text"
+        with sh.open_file("B.bin", "wb") as f:
+            f.write(bytes(range(256)) * 10000)
+        with sh.open_file("B.bin", "rb") as f:
+            f.seek(256 * 5000 + 3)
+            assert f.read(2) == bytes([3, 4])
+        assert sh.has_file("B.bin") and not sh.has_file("C.bin")
+
+
+def test_SQLiteHandler_no_blobopen(sqlite_handler, pandas_df, monkeypatch):
+    # Python < 3.11
+    monkeypatch.setattr("dataicer._sqlite_archive._HAS_BLOBOPEN", False)
+    with sqlite_handler as sh:
+        with sh.open_file("B.bin", "wb") as f:
+            f.write(bytes(range(256)) * 10000)
+        with sh.open_file("B.bin", "rb") as f:
+            f.seek(256 * 5000 + 3)
+            assert f.read(2) == bytes([3, 4])
+            f.seek(-1, 2)
+            assert f.read() == bytes([255])
+
+    handlers = get_pandas_handlers("h5", "npy")
+    sh = SQLiteHandler(sqlite_handler.db_path, handlers, mode="a")
+    sh.ice(df=pandas_df["df1"], arr=np.arange(10))
+    test = SQLiteHandler(sqlite_handler.db_path, handlers).deice()
+    assert pandas_df["df1"].equals(test["df"])
+    np.testing.assert_array_equal(test["arr"], np.arange(10))
+
+
+def test_SQLiteHandler_save_json_keys(sqlite_handler):
+    sqlite_handler.save_json(A="1", B="2")
+    assert set(sqlite_handler.keys()) == {"A", "B"}
+    assert sqlite_handler["A"] == "1"
+
+
+def test_SQLiteHandler_read_only(sqlite_handler):
+    sqlite_handler.ice(a=1)
+    sh = SQLiteHandler(sqlite_handler.db_path, mode="r")
+    assert sh.deice() == {"a": 1}
+    with pytest.raises(ValueError):
+        sh.remove_key("a")
+    with pytest.raises(ValueError):
+        sh.ice(b=1)
+
+
+def test_SQLiteHandler_replace_remove_key(tmpdir):
+    sh = SQLiteHandler(pathlib.Path(tmpdir) / "archive", get_numpy_handlers("npy"), "w")
+    sh.ice(a=np.zeros(5), b=np.zeros(3))
+    sh = SQLiteHandler(sh.db_path, get_numpy_handlers("npy"), mode="a")
+    sh.ice(a=np.ones(5))
+    sh.remove_key("b")
+
+    with sqlite3.connect(sh.db_path) as conn:
+        names = [row[0] for row in conn.execute("SELECT name FROM files")]
+    assert len([name for name in names if name.endswith(".npy")]) == 1
+    test = SQLiteHandler(sh.db_path, get_numpy_handlers("npy")).deice()
+    assert set(test) == {"a"}
+    np.testing.assert_array_equal(test["a"], np.ones(5))
+
+
+def test_SQLiteHandler_index_external_writer(tmpdir):
+    sh = SQLiteHandler(pathlib.Path(tmpdir) / "archive", mode="w")
+    sh.ice(a=1, b=2)
+    with sqlite3.connect(sh.db_path) as conn:
+        conn.execute("DELETE FROM keys WHERE key = 'a'")
+
+    sh = SQLiteHandler(sh.db_path, mode="r")
+    assert set(sh.keys()) == {"meta", "b"}
+    assert sh.deice() == {"b": 2}
+
+
+def test_SQLiteHandler_concurrent_writers(sqlite_handler):
+    sqlite_handler.ice(a=0)
+    errors = []
+
+    def write(n):
+        sh = SQLiteHandler(sqlite_handler.db_path, mode="a", environment="off")
+        try:
+            for i in range(10):
+                with sh as _:
+                    # the index is read before another writer commits
+                    sh.keys()
+                    sh.ice(**{f"k{n}_{i}": i})
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    keys = SQLiteHandler(sqlite_handler.db_path).keys()
+    assert {f"k{n}_{i}" for n in range(4) for i in range(10)} <= set(keys)
+
+
+class Unpicklable:
+    def __getstate__(self):
+        raise RuntimeError("cannot pickle")
+
+
+def test_SQLiteHandler_ice_rollback(sqlite_handler):
+    sqlite_handler.ice(a=1)
+    sh = SQLiteHandler(sqlite_handler.db_path, get_numpy_handlers("npy"), mode="a")
+    with pytest.raises(RuntimeError):
+        sh.ice(a=2, arr=np.arange(5), b=Unpicklable())
+
+    assert set(sh.keys()) == {"meta", "a"}
+    assert sh.deice() == {"a": 1}
+    with sqlite3.connect(sh.db_path) as conn:
+        assert conn.execute("SELECT count(*) FROM files").fetchone()[0] == 1
+
+
+@pytest.mark.parametrize("mode", ["raw", "txt", "npy", "npz", "chunked"])
+def test_SQLiteHandler_ice_deice_numpy(tmpdir, numpy_data, mode):
+    sh = SQLiteHandler(tmpdir / "archive", get_numpy_handlers(array_mode=mode), "w")
+    sh.ice(npar=numpy_data)
+
+    test = sh.deice()
+    np.testing.assert_array_equal(test["npar"]["np_data"], numpy_data["np_data"])
+
+
+@pytest.mark.parametrize("mode", ["csv", "h5", "parquet", "feather"])
+def test_SQLiteHandler_ice_pandas(tmpdir, pandas_df, mode):
+    sh = SQLiteHandler(tmpdir / "archive", get_pandas_handlers(mode=mode), "w")
+    sh.ice(df=pandas_df)
+
+    test = sh.deice()
+    assert pandas_df["df1"].equals(test["df"]["df1"])
+
+
+def test_SQLiteHandler_ice_xarray(
+    tmpdir, xarray_dataset, xarray_dataarray, monkeypatch
+):
+    sh = SQLiteHandler(tmpdir / "archive", get_xarray_handlers(), "w")
+    if writes_file_objects():
+        # older xarray versions need a path to write netCDF4 files
+        monkeypatch.setattr(sh, "file_path", None)
+    sh.ice(ds=xarray_dataset, da=xarray_dataarray["da1"])
+
+    test = SQLiteHandler(sh.db_path, get_xarray_handlers()).deice()
+    assert xarray_dataset["ds1"].equals(test["ds"]["ds1"])
+    assert xarray_dataarray["da1"].equals(test["da"])
+    test = sh.read_slice("da", {"time": slice(1, 3)})
+    assert test.equals(xarray_dataarray["da1"].isel(time=slice(1, 3)))
+
+
+def test_SQLiteHandler_read_slice_append(sqlite_handler, pandas_df):
+    handlers = get_pandas_handlers("h5", "chunked")
+    sh = SQLiteHandler(sqlite_handler.db_path, handlers, mode="a")
+    arr = np.arange(60.0).reshape(10, 6)
+    sh.ice(arr=arr, df=pandas_df["df1"])
+    sh.append("arr", arr)
+    sh.append("df", pandas_df["df1"])
+
+    sh = SQLiteHandler(sqlite_handler.db_path, handlers)
+    np.testing.assert_array_equal(
+        sh.read_slice("arr", np.s_[8:12, ::2]), np.r_[arr, arr][8:12, ::2]
+    )
+    assert pd.concat([pandas_df["df1"]] * 2).equals(sh.deice("df")["df"])
+
+
+def test_SQLiteHandler_workers_hash_naming(tmpdir, pandas_df):
+    handlers = get_pandas_handlers(mode="csv", array_mode="npy", naming="hash")
+    sh = SQLiteHandler(tmpdir / "archive", handlers, "w", workers=4)
+    data = {
+        f"key{i}": {"df": pandas_df["df1"], "ar": np.arange(i % 2)} for i in range(8)
+    }
+    sh.ice(**data)
+
+    with sqlite3.connect(sh.db_path) as conn:
+        names = [row[0] for row in conn.execute("SELECT name FROM files")]
+    assert len([name for name in names if name.endswith(".csv")]) == 1
+    assert len([name for name in names if name.endswith(".npy")]) == 2
+    test = SQLiteHandler(sh.db_path, handlers, "r", workers=4).deice()
+    for key, val in data.items():
+        assert val["df"].equals(test[key]["df"])
+        np.testing.assert_array_equal(val["ar"], test[key]["ar"])
@@ -0,0 +1,86 @@
+import logging
+import pathlib
+
+import numpy as np
+import pytest
+
+from dataicer import ArchiveStats, DirectoryHandler, SQLiteHandler, ZipHandler
+from dataicer.plugins import get_numpy_handlers, get_pandas_handlers
+
+
+@pytest.mark.parametrize("archive", [DirectoryHandler, ZipHandler, SQLiteHandler])
+@pytest.mark.parametrize("mode", ["raw", "npy", "txt", "chunked"])
+def test_stats_key_events(tmpdir, archive, mode):
+    stats = ArchiveStats()
+    handlers = get_numpy_handlers(mode)
+    arr = np.arange(100.0).reshape(10, 10)
+    path = pathlib.Path(tmpdir) / "archive"
+    archive(path, handlers, mode="w", stats=stats).ice(arr=arr, b=1)
+    test = archive(path, handlers, stats=stats)
+    np.testing.assert_array_equal(test.deice()["arr"], arr)
+
+    keys = stats.key_stats()
+    assert keys["arr"]["ice"]["handler"] == "NumpyNDArrayHandler"
+    assert keys["arr"]["ice"]["mode"] == mode
+    assert keys["arr"]["ice"]["files"] >= 1
+    assert keys["arr"]["ice"]["bytes_written"] > 0
+    assert keys["arr"]["ice"]["encode_seconds"] <= keys["arr"]["ice"]["seconds"]
+    assert keys["arr"]["deice"]["bytes_read"] > 0
+    assert keys["b"]["ice"]["files"] == 0
+
+    files = [event for event in stats.events if event["event"] == "file"]
+    assert {event["key"] for event in files} >= {"arr"}
+    assert sum(e["bytes_written"] for e in files if e["key"] == "arr") == (
+        keys["arr"]["ice"]["bytes_written"]
+    )
+
+
+def test_stats_pandas(tmpdir, pandas_df):
+    stats = ArchiveStats()
+    zh = ZipHandler(
+        pathlib.Path(tmpdir) / "archive", get_pandas_handlers("csv"), "w", stats=stats
+    )
+    zh.ice(df=pandas_df["df1"])
+    assert pandas_df["df1"].equals(zh.deice()["df"])
+
+    keys = stats.key_stats()
+    assert keys["df"]["ice"]["handler"] == "PandasDataFrameHandler"
+    assert keys["df"]["ice"]["mode"] == "csv"
+    assert keys["df"]["deice"]["bytes_read"] == keys["df"]["ice"]["bytes_written"]
+
+
+def test_stats_zip_events(tmpdir, pandas_df):
+    stats = ArchiveStats()
+    handlers = get_pandas_handlers("h5")
+    path = pathlib.Path(tmpdir) / "archive"
+    ZipHandler(path, handlers, "w", stats=stats).ice(df=pandas_df["df1"])
+    zh = ZipHandler(path, handlers, "a", stats=stats)
+    assert pandas_df["df1"].equals(zh.deice()["df"])
+    zh.compact()
+
+    totals = stats.totals()
+    assert totals["zip_compress"]["count"] == 1
+    assert totals["zip_extract"]["count"] == 1
+    assert totals["zip_compact"]["count"] == 1
+    keys = stats.key_stats()
+    assert keys["df"]["deice"]["bytes_read"] == keys["df"]["ice"]["bytes_written"] > 0
+
+
+def test_stats_log_events(tmpdir, caplog):
+    stats = ArchiveStats([ArchiveStats.log_events()], keep_events=False)
+    dh = DirectoryHandler(pathlib.Path(tmpdir) / "archive", mode="w", stats=stats)
+    with caplog.at_level(logging.DEBUG, logger="dataicer"):
+        dh.ice(a=1)
+    assert not stats.events
+    assert any(record.getMessage().startswith("ice key=a") for record in caplog.records)
+
+
+def test_stats_none(tmpdir):
+    dh = DirectoryHandler(pathlib.Path(tmpdir) / "archive", mode="w")
+    assert "open_file" not in vars(dh)
+    dh.stats = ArchiveStats()
+    assert "open_file" in vars(dh)
+    dh.ice(a=1)
+    assert dh.stats.key_stats()["a"]["ice"]["files"] == 0
+    dh.stats = None
+    assert "open_file" not in vars(dh)
@@ -0,0 +1,433 @@
+import asyncio
+import pytest
+import pathlib
+import subprocess
+import sys
+import threading
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from dataicer._zip_archive import ZipHandler, stored_member
+from dataicer.plugins import (
+    get_numpy_handlers,
+    get_pandas_handlers,
+    get_xarray_handlers,
+)
+from dataicer.plugins.xarray import writes_file_objects
+
+
+@pytest.fixture(scope="function")
+def zip_handler(tmpdir):
+    handler = ZipHandler(pathlib.Path(tmpdir) / "archive", mode="w")
+    return handler
+
+
+def test_ZipHandler_has_archive_type(zip_handler):
+    assert zip_handler._archive_type == "zip"
+
+
+def test_ZipHandler_init_creates_zip(zip_handler):
+    assert zip_handler.zip_path.exists()
+    assert zip_handler.zip_path.name == "archive.ice.zip"
+
+
+@pytest.mark.parametrize("mode", ("r", "a"))
+def test_ZipHandler_init_not_exists(tmpdir, mode):
+    with pytest.raises(FileNotFoundError):
+        ZipHandler(pathlib.Path(tmpdir) / "this_zip_does_not_exist", mode=mode)
+
+
+def test_ZipHandler_open_file(zip_handler):
+    with zip_handler as zh:
+        with zh.open_file("A.txt", "w") as f:
+            f.write("test text")
+        with zh.open_file("A.txt", "r") as f:
+            assert f.read() == "test text"
+
+
+def test_ZipHandler_save_json_keys(zip_handler):
+    zip_handler.save_json(A="1", B="2")
+    assert set(zip_handler.keys()) == {"A", "B"}
+    assert zip_handler["A"] == "1"
+
+
+def test_ZipHandler_no_extract(zip_handler):
+    zip_handler.ice(a=1, b=2)
+    zh = ZipHandler(zip_handler.zip_path, mode="r")
+    assert zh.deice("a") == {"a": 1}
+    assert zh._tempdir is None
+
+
+def test_ZipHandler_replace_key(tmpdir):
+    zh = ZipHandler(
+        pathlib.Path(tmpdir) / "archive", get_numpy_handlers("npy"), mode="w"
+    )
+    zh.ice(a=np.zeros(5))
+    zh = ZipHandler(zh.zip_path, get_numpy_handlers("npy"), mode="a")
+    zh.ice(a=np.ones(5), b=2)
+
+    with zipfile.ZipFile(zh.zip_path) as zip_file:
+        names = zip_file.namelist()
+    assert len(names) == len(set(names))
+    assert len([name for name in names if name.endswith(".npy")]) == 1
+
+    test = ZipHandler(zh.zip_path, get_numpy_handlers("npy"), mode="r").deice()
+    np.testing.assert_array_equal(test["a"], np.ones(5))
+    assert test["b"] == 2
+
+
+def test_ZipHandler_read_only(zip_handler):
+    zip_handler.ice(a=1)
+    zh = ZipHandler(zip_handler.zip_path, mode="r")
+    with pytest.raises(ValueError):
+        zh.remove_key("a")
+
+
+@pytest.mark.parametrize("mode", ["raw", "txt", "npy", "npz", "chunked"])
+def test_ZipHandler_ice_deice_numpy(tmpdir, numpy_data, mode):
+    zh = ZipHandler(tmpdir / "archive", get_numpy_handlers(array_mode=mode), mode="w")
+    zh.ice(npar=numpy_data)
+
+    test = zh.deice()
+    np.testing.assert_array_equal(test["npar"]["np_data"], numpy_data["np_data"])
+
+
+@pytest.mark.parametrize("mode", ["csv", "h5"])
+def test_ZipHandler_ice_pandas(tmpdir, pandas_df, mode):
+    zh = ZipHandler(tmpdir / "archive", get_pandas_handlers(mode=mode), "w")
+    zh.ice(df=pandas_df)
+
+    test = zh.deice()
+    assert pandas_df["df1"].equals(test["df"]["df1"])
+
+
+@pytest.mark.parametrize("mode", ["nc"])
+def test_ZipHandler_ice_xarray_dataset(tmpdir, xarray_dataset, mode):
+    zh = ZipHandler(tmpdir / "archive", get_xarray_handlers(mode=mode), "w")
+    zh.ice(ds=xarray_dataset)
+
+    test = zh.deice()
+    assert xarray_dataset["ds1"].equals(test["ds"]["ds1"])
+
+
+@pytest.mark.parametrize("mode", ("r", "a"))
+def test_ZipHandler_read_session_no_write(zip_handler, mode):
+    zip_handler.ice(a=1, b=2)
+    before = zip_handler.zip_path.read_bytes()
+    stat = zip_handler.zip_path.stat()
+
+    zh = ZipHandler(zip_handler.zip_path, mode=mode)
+    with zh as _:
+        zh.deice()
+    assert not zh.dirty
+    assert zip_handler.zip_path.stat().st_mtime_ns == stat.st_mtime_ns
+    assert zip_handler.zip_path.read_bytes() == before
+
+
+def test_ZipHandler_append_in_place(zip_handler):
+    zip_handler.ice(a=np.arange(1000))
+    before = zip_handler.zip_path.read_bytes()
+    with zipfile.ZipFile(zip_handler.zip_path) as zip_file:
+        start_dir = zip_file.start_dir
+    stat = zip_handler.zip_path.stat()
+
+    zh = ZipHandler(zip_handler.zip_path, get_numpy_handlers(), mode="a")
+    zh.ice(b=1)
+    # the members of earlier sessions are not rewritten
+    assert zh.zip_path.stat().st_ino == stat.st_ino
+    assert zh.zip_path.read_bytes()[:start_dir] == before[:start_dir]
+    test = ZipHandler(zh.zip_path, get_numpy_handlers()).deice()
+    np.testing.assert_array_equal(test["a"], np.arange(1000))
+    assert test["b"] == 1
+
+
+def test_ZipHandler_session_atomic(zip_handler):
+    zip_handler.ice(a=1)
+    zh = ZipHandler(zip_handler.zip_path, get_numpy_handlers(), mode="a", atomic=True)
+    with zh as _:
+        zh.ice(b=np.arange(5))
+        zh.remove_key("a")
+        # readers see the archive of the last closed session
+        assert zipfile.is_zipfile(zh.zip_path)
+        assert ZipHandler(zh.zip_path).deice() == {"a": 1}
+    test = ZipHandler(zh.zip_path, get_numpy_handlers()).deice()
+    assert set(test) == {"b"}
+    assert not list(zh.zip_path.parent.glob(".dataicer_*"))
+
+
+def test_ZipHandler_killed_session(zip_handler):
+    zip_handler.ice(a=1)
+    script = (
+        "import os, sys\n"
+        "import numpy as np\n"
+        "from dataicer import ZipHandler\n"
+        "from dataicer.plugins import get_numpy_handlers\n"
+        "zh = ZipHandler(sys.argv[1], get_numpy_handlers(), mode='a', atomic=True)\n"
+        "with zh as _:\n"
+        "    zh.ice(b=np.zeros(2**20))\n"
+        "    zh.remove_key('a')\n"
+        "    os._exit(0)\n"
+    )
+    subprocess.run(
+        [sys.executable, "-c", script, str(zip_handler.zip_path)], check=True
+    )
+    assert ZipHandler(zip_handler.zip_path).deice() == {"a": 1}
+
+
+def test_ZipHandler_unchanged_json_not_written(zip_handler):
+    zip_handler.save_json(a="1")
+    zh = ZipHandler(zip_handler.zip_path, mode="a")
+    with zh as _:
+        zh.save_json(a="1")
+        assert not zh.dirty
+        zh.save_json(a="2")
+        assert zh.dirty
+    assert zh["a"] == "2"
+
+
+def test_ZipHandler_compact(tmpdir):
+    zh = ZipHandler(
+        pathlib.Path(tmpdir) / "archive",
+        get_numpy_handlers("npy"),
+        mode="w",
+        compact_threshold=1.0,
+    )
+    for i in range(5):
+        zh.ice(a=np.full(1000, i))
+    size = zh.zip_path.stat().st_size
+    assert zh._unreachable_fraction() > 0.5
+
+    zh.compact()
+    assert zh.zip_path.stat().st_size < size
+    assert zh._unreachable_fraction() == 0.0
+    np.testing.assert_array_equal(zh.deice()["a"], np.full(1000, 4))
+
+
+def test_ZipHandler_ice_deice_workers(tmpdir, pandas_df):
+    handlers = get_pandas_handlers(mode="h5", array_mode="npy")
+    zh = ZipHandler(tmpdir / "archive", handlers, "w", workers=4)
+    data = {f"key{i}": {"df": pandas_df["df1"], "ar": np.arange(i)} for i in range(10)}
+    zh.ice(**data)
+
+    test = ZipHandler(zh.zip_path, handlers, "r", workers=4).deice()
+    assert set(test) == set(data)
+    for key, val in data.items():
+        assert val["df"].equals(test[key]["df"])
+        np.testing.assert_array_equal(val["ar"], test[key]["ar"])
+
+
+def test_ZipHandler_hash_naming_dedup(tmpdir, pandas_df):
+    handlers = get_pandas_handlers(mode="csv", array_mode="npy", naming="hash")
+    zh = ZipHandler(pathlib.Path(tmpdir) / "archive", handlers, mode="w", workers=4)
+    zh.ice(
+        **{f"key{i}": {"df": pandas_df["df1"], "ar": np.arange(5)} for i in range(8)}
+    )
+
+    zh = ZipHandler(zh.zip_path, handlers, mode="a")
+    zh.ice(key0={"df": pandas_df["df1"], "ar": np.arange(6)})
+    with zipfile.ZipFile(zh.zip_path) as zip_file:
+        names = zip_file.namelist()
+    assert len([name for name in names if name.endswith(".csv")]) == 1
+    assert len([name for name in names if name.endswith(".npy")]) == 2
+
+    for i in range(1, 8):
+        zh.remove_key(f"key{i}")
+    with zipfile.ZipFile(zh.zip_path) as zip_file:
+        names = zip_file.namelist()
+    assert len([name for name in names if name.endswith(".npy")]) == 1
+
+    test = zh.deice()
+    assert pandas_df["df1"].equals(test["key0"]["df"])
+    np.testing.assert_array_equal(test["key0"]["ar"], np.arange(6))
+
+
+def test_ZipHandler_index(zip_handler):
+    zip_handler.ice(a=1, b=2)
+    with zipfile.ZipFile(zip_handler.zip_path) as zip_file:
+        assert "index" in zip_file.namelist()
+
+    zh = ZipHandler(zip_handler.zip_path, mode="r")
+    assert set(zh.keys()) == {"meta", "a", "b"}
+    assert zh.key_info("a")["summary"] == {"type": "builtins.int"}
+    assert zh.key_info("a")["checksum"] == zh._scan_keys()["a"]["checksum"]
+
+
+def test_ZipHandler_index_outside_session(tmpdir):
+    assert ZipHandler(pathlib.Path(tmpdir) / "new", mode="w").keys() == ()
+
+    # written before the index
+    zip_path = pathlib.Path(tmpdir) / "legacy.ice.zip"
+    with zipfile.ZipFile(zip_path, "w") as zip_file:
+        zip_file.writestr("meta.json", "{}")
+        zip_file.writestr("a.json", "1")
+    zh = ZipHandler(zip_path, mode="a")
+    assert set(zh.keys()) == {"meta", "a"}
+    assert zh["a"] == "1"
+    zh.ice(b=2)
+    assert set(ZipHandler(zip_path).keys()) == {"meta", "a", "b"}
+
+
+def test_ZipHandler_scanned_index_not_written(tmpdir):
+    zip_path = pathlib.Path(tmpdir) / "legacy.ice.zip"
+    with zipfile.ZipFile(zip_path, "w") as zip_file:
+        zip_file.writestr("a.json", "1")
+    before = zip_path.read_bytes()
+    stat = zip_path.stat()
+
+    zh = ZipHandler(zip_path, mode="a")
+    with zh as _:
+        assert zh.deice() == {"a": 1}
+    assert zip_path.stat().st_ino == stat.st_ino
+    assert zip_path.read_bytes() == before
+
+    # the index is written with the next change
+    zh.ice(b=2)
+    with zipfile.ZipFile(zip_path) as zip_file:
+        assert "index" in zip_file.namelist()
+    assert set(ZipHandler(zip_path).keys()) == {"meta", "a", "b"}
+
+
+def test_ZipHandler_read_slice(zip_handler, xarray_dataarray):
+    handlers = get_numpy_handlers("npy")
+    handlers.update(get_xarray_handlers())
+    arr = np.arange(60.0).reshape(10, 6)
+    zh = ZipHandler(zip_handler.zip_path, handlers, mode="a")
+    zh.ice(arr=arr, da=xarray_dataarray["da1"])
+
+    zh = ZipHandler(zip_handler.zip_path, handlers, mode="r")
+    np.testing.assert_array_equal(zh.read_slice("arr", np.s_[3:7, ::2]), arr[3:7, ::2])
+    test = zh.read_slice("da", {"time": slice(1, 3)})
+    assert test.equals(xarray_dataarray["da1"].isel(time=slice(1, 3)))
+    assert zh._tempdir is None
+
+
+def test_ZipHandler_remove_chunked(zip_handler):
+    zh = ZipHandler(zip_handler.zip_path, get_numpy_handlers("chunked"), mode="a")
+    zh.ice(a=np.arange(10), b=1)
+    zh.remove_key("a")
+    with zipfile.ZipFile(zh.zip_path) as zip_file:
+        assert not [name for name in zip_file.namelist() if ".chunked/" in name]
+
+
+def test_ZipHandler_files_not_listed(zip_handler):
+    class Members(dict):
+        def __iter__(self):
+            raise AssertionError("the members were listed")
+
+    zh = ZipHandler(zip_handler.zip_path, get_numpy_handlers("npy"), mode="a")
+    with zh as _:
+        zh.ice(a=np.arange(3))
+        zh._zip.NameToInfo = Members(zh._zip.NameToInfo)
+        zh.ice(b=np.arange(4))
+        zh.remove_key("a")
+    assert set(ZipHandler(zh.zip_path).keys()) == {"meta", "b"}
+
+
+def test_ZipHandler_append(zip_handler, pandas_df):
+    zh = ZipHandler(zip_handler.zip_path, get_pandas_handlers("h5", "npy"), mode="a")
+    zh.ice(df=pandas_df["df1"], arr=np.arange(5))
+    zh.append("df", pandas_df["df1"])
+    zh.append("arr", np.arange(3))
+
+    with zipfile.ZipFile(zh.zip_path) as zip_file:
+        names = zip_file.namelist()
+    assert len(names) == len(set(names))
+    test = ZipHandler(zh.zip_path, get_pandas_handlers("h5", "npy")).deice()
+    assert pd.concat([pandas_df["df1"]] * 2).equals(test["df"])
+    np.testing.assert_array_equal(test["arr"], np.r_[np.arange(5), np.arange(3)])
+
+
+def test_ZipHandler_aice_adeice(zip_handler, pandas_df):
+    handlers = get_pandas_handlers("h5", "npy")
+    zh = ZipHandler(zip_handler.zip_path, handlers, mode="a", workers=4)
+    data = {f"key{i}": {"df": pandas_df["df1"], "ar": np.arange(i)} for i in range(5)}
+    asyncio.run(zh.aice(**data))
+
+    test = asyncio.run(ZipHandler(zh.zip_path, handlers).adeice("key1", "key4"))
+    assert set(test) == {"key1", "key4"}
+    assert data["key4"]["df"].equals(test["key4"]["df"])
+    np.testing.assert_array_equal(test["key4"]["ar"], np.arange(4))
+
+
+def test_ZipHandler_xarray_no_extract(zip_handler, xarray_dataset, monkeypatch):
+    zh = ZipHandler(zip_handler.zip_path, get_xarray_handlers(), mode="a")
+    if writes_file_objects():
+        # older xarray versions need a path to write netCDF4 files
+        monkeypatch.setattr(zh, "file_path", None)
+    zh.ice(ds=xarray_dataset["ds1"])
+
+    assert xarray_dataset["ds1"].equals(zh.deice()["ds"])
+    assert zh._tempdir is None
+
+
+@pytest.mark.parametrize(
+    "compression", [zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2, zipfile.ZIP_LZMA]
+)
+def test_ZipHandler_compression(zip_handler, pandas_df, compression):
+    handlers = get_pandas_handlers("h5", "npy")
+    zh = ZipHandler(
+        zip_handler.zip_path, handlers, mode="a", compression=compression, workers=4
+    )
+    data = {f"key{i}": {"df": pandas_df["df1"], "ar": np.arange(i)} for i in range(5)}
+    zh.ice(**data)
+
+    with zipfile.ZipFile(zh.zip_path) as zip_file:
+        assert zip_file.testzip() is None
+        types = {
+            info.filename.rpartition(".")[2]: info.compress_type
+            for info in zip_file.infolist()
+        }
+    assert types["npy"] == types["json"] == compression
+    assert types["h5"] == zipfile.ZIP_STORED
+
+    test = ZipHandler(zh.zip_path, handlers, workers=4).deice()
+    for key, val in data.items():
+        assert val["df"].equals(test[key]["df"])
+        np.testing.assert_array_equal(val["ar"], test[key]["ar"])
+
+
+def test_ZipHandler_compression_policy(zip_handler):
+    def policy(file_name):
+        if file_name.endswith(".npy"):
+            return zipfile.ZIP_LZMA
+        return zipfile.ZIP_STORED
+
+    zh = ZipHandler(
+        zip_handler.zip_path, get_numpy_handlers("npy"), "a", compression=policy
+    )
+    zh.ice(a=np.zeros(1000))
+    with zipfile.ZipFile(zh.zip_path) as zip_file:
+        infos = zip_file.infolist()
+    assert {info.compress_type for info in infos if info.filename.endswith(".npy")} == {
+        zipfile.ZIP_LZMA
+    }
+    assert zipfile.ZIP_STORED in {info.compress_type for info in infos}
+    np.testing.assert_array_equal(zh.deice()["a"], np.zeros(1000))
+
+
+def test_ZipHandler_compressed_writes_unlocked(zip_handler):
+    zh = ZipHandler(zip_handler.zip_path, mode="a", compression=zipfile.ZIP_DEFLATED)
+
+    def write_b():
+        with zh.open_file("b.bin", "wb") as f:
+            f.write(b"b" * 1000)
+
+    with zh as _:
+        with zh.open_file("a.bin", "wb") as f:
+            f.write(b"a" * 1000)
+            # members are compressed without holding the zip file lock
+            thread = threading.Thread(target=write_b)
+            thread.start()
+            thread.join(timeout=10)
+            assert not thread.is_alive()
+        with zh.open_file("a.bin", "rb") as f:
+            assert f.read() == b"a" * 1000
+
+
+def test_stored_member():
+    assert stored_member("abc.h5")
+    assert stored_member("abc.chunked/0.1")
+    assert not stored_member("abc.npy")
+    assert not stored_member("meta.json")